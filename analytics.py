@@ -0,0 +1,277 @@
+import math
+from columnar import NUMERIC_COLUMNS, RowSequence
+
+# Portfolio analytics: counts, means, quantiles and breakdowns of prices.
+#
+# PortfolioStats keeps running aggregates per bhk and per bath count that
+# add() and remove() adjust in O(1) per property, so a store can keep them
+# current through every change instead of recomputing them. Quantiles come
+# from a QuantileSketch, a histogram over logarithmic buckets of a fixed
+# relative width: every quantile is within SKETCH_ACCURACY of the true value,
+# and unlike a sample it can forget a removed value. build() computes the
+# same figures in vectorized numpy passes, for a whole store when the stats
+# are first needed or for any row sequence, such as a search result.
+# Price per sqft is price / total_sqft, for rows with both and a positive area.
+# numpy is imported inside the functions that need it, as in pricing.py.
+
+SKETCH_ACCURACY = 0.01
+
+# Fields the statistics read; changes to the others leave them as they are
+STAT_COLUMNS = ('total_sqft', 'bath', 'price', 'bhk')
+
+# Groups of the breakdowns
+GROUPS = ('bhk', 'bath')
+
+
+# Counts of values per logarithmic bucket of their magnitude (as in DDSketch),
+# with a mirrored set of buckets for negative values, since a predicted price
+# can fall below zero; zeros are counted apart
+class QuantileSketch:
+    def __init__(self, accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}  # Bucket key -> count; bucket k holds (gamma^(k-1), gamma^k]
+        self.negatives = {}  # The same for the magnitudes of negative values
+        self.zeros = 0
+        self.count = 0
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    # Function to get the buckets a nonzero value is counted in and its key there
+    def _bucket(self, value):
+        if value > 0:
+            return self.buckets, self._key(value)
+        return self.negatives, self._key(-value)
+
+    def add(self, value):
+        self.count += 1
+        if value == 0:
+            self.zeros += 1
+            return
+        buckets, key = self._bucket(value)
+        buckets[key] = buckets.get(key, 0) + 1
+
+    # A value at a bucket edge may have been put in its neighbour by add_array,
+    # whose logarithm can round the other way
+    def remove(self, value):
+        self.count -= 1
+        if value == 0:
+            self.zeros -= 1
+            return
+        buckets, key = self._bucket(value)
+        for key in (key, key - 1, key + 1):
+            count = buckets.get(key)
+            if count is not None:
+                if count > 1:
+                    buckets[key] = count - 1
+                else:
+                    del buckets[key]
+                return
+
+    # Function to add every value of a numpy array in one pass
+    def add_array(self, values):
+        import numpy as np
+        positive, negative = values[values > 0], -values[values < 0]
+        self.count += len(values)
+        self.zeros += len(values) - len(positive) - len(negative)
+        for buckets, magnitudes in ((self.buckets, positive), (self.negatives, negative)):
+            keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                buckets[key] = buckets.get(key, 0) + count
+
+    # Function to estimate a bucket's values by the point of least relative error
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    # Function to list (estimate, count) of every bucket, from the lowest values up
+    def _ascending(self):
+        for key in sorted(self.negatives, reverse=True):
+            yield -self._value(key), self.negatives[key]
+        if self.zeros:
+            yield 0.0, self.zeros
+        for key in sorted(self.buckets):
+            yield self._value(key), self.buckets[key]
+
+    def quantile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * (self.count - 1)
+        seen = 0
+        for value, count in self._ascending():
+            seen += count
+            if seen > rank:
+                return value
+        return value
+
+    # Function to count the values between consecutive edges, as a list of
+    # (low, high, count); each bucket counts where its estimate falls
+    def histogram(self, edges):
+        counts = [0] * (len(edges) - 1)
+        for value, count in self._ascending():
+            for i in range(len(counts)):
+                if edges[i] <= value < edges[i + 1] or (i == len(counts) - 1 and value == edges[-1]):
+                    counts[i] += count
+                    break
+        return [(edges[i], edges[i + 1], counts[i]) for i in range(len(counts))]
+
+
+# Function to get the price per sqft of a property, or None
+def price_per_sqft(price, total_sqft):
+    if price is None or total_sqft is None or total_sqft <= 0:
+        return None
+    return price / total_sqft
+
+
+# Running figures of one group of properties
+class GroupStats:
+    def __init__(self):
+        self.count = 0
+        self.price_sum = 0.0
+        self.sqft_count = 0
+        self.sqft_sum = 0.0
+        self.ppsf_sum = 0.0
+        self.price = QuantileSketch()
+        self.price_per_sqft = QuantileSketch()
+
+    def add(self, prop):
+        self.count += 1
+        price, total_sqft = prop['price'], prop['total_sqft']
+        if price is not None:
+            self.price_sum += price
+            self.price.add(price)
+        if total_sqft is not None:
+            self.sqft_count += 1
+            self.sqft_sum += total_sqft
+        ppsf = price_per_sqft(price, total_sqft)
+        if ppsf is not None:
+            self.ppsf_sum += ppsf
+            self.price_per_sqft.add(ppsf)
+
+    def remove(self, prop):
+        self.count -= 1
+        price, total_sqft = prop['price'], prop['total_sqft']
+        if price is not None:
+            self.price_sum -= price
+            self.price.remove(price)
+        if total_sqft is not None:
+            self.sqft_count -= 1
+            self.sqft_sum -= total_sqft
+        ppsf = price_per_sqft(price, total_sqft)
+        if ppsf is not None:
+            self.ppsf_sum -= ppsf
+            self.price_per_sqft.remove(ppsf)
+
+    # Function to add the rows of float arrays (NaN where missing) in one pass each
+    def add_arrays(self, price, total_sqft):
+        import numpy as np
+        self.count += len(price)
+        prices = price[~np.isnan(price)]
+        self.price_sum += float(prices.sum())
+        self.price.add_array(prices)
+        areas = total_sqft[~np.isnan(total_sqft)]
+        self.sqft_count += len(areas)
+        self.sqft_sum += float(areas.sum())
+        valid = ~np.isnan(price) & (total_sqft > 0)
+        ppsf = price[valid] / total_sqft[valid]
+        self.ppsf_sum += float(ppsf.sum())
+        self.price_per_sqft.add_array(ppsf)
+
+    def summary(self):
+        price_count, ppsf_count = self.price.count, self.price_per_sqft.count
+        return {
+            'count': self.count,
+            'mean_price': self.price_sum / price_count if price_count else None,
+            'p10_price': self.price.quantile(0.1),
+            'median_price': self.price.quantile(0.5),
+            'p90_price': self.price.quantile(0.9),
+            'mean_sqft': self.sqft_sum / self.sqft_count if self.sqft_count else None,
+            'mean_price_per_sqft': self.ppsf_sum / ppsf_count if ppsf_count else None,
+            'median_price_per_sqft': self.price_per_sqft.quantile(0.5),
+        }
+
+
+# Function to get the numeric columns of a row sequence as float arrays, NaN where a
+# value is missing, plus the list of names under 'name' when names is set. A
+# RowSequence is gathered straight from its column buffers.
+def column_arrays(rows, names=False):
+    import numpy as np
+    if isinstance(rows, RowSequence):
+        rowids = np.fromiter(rows.rowids, dtype=np.int64, count=len(rows.rowids))
+        arrays = {}
+        for column, code in NUMERIC_COLUMNS.items():
+            values = np.frombuffer(rows.columns.values[column], dtype=np.float64 if code == 'd' else np.int64)
+            values = values[rowids].astype(np.float64)
+            values[np.frombuffer(rows.columns.nulls[column], dtype=np.uint8)[rowids] != 0] = np.nan
+            arrays[column] = values
+        if names:
+            arrays['name'] = list(map(rows.columns.names.__getitem__, rowids.tolist()))
+        return arrays
+    rows = list(rows)
+    arrays = tuple_arrays([[prop[column] for column in STAT_COLUMNS] for prop in rows])
+    if names:
+        arrays['name'] = [prop['name'] for prop in rows]
+    return arrays
+
+
+# Function to turn rows of STAT_COLUMNS values (None where missing) into column_arrays() output
+def tuple_arrays(rows):
+    import numpy as np
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(STAT_COLUMNS))
+    return {column: table[:, i] for i, column in enumerate(STAT_COLUMNS)}
+
+
+# Figures of all properties and of each bhk and bath group. A property missing
+# the group's field is counted under None.
+class PortfolioStats:
+    def __init__(self):
+        self.all = GroupStats()
+        self.groups = {group: {} for group in GROUPS}
+
+    def add(self, prop):
+        self.all.add(prop)
+        for group, stats in self.groups.items():
+            key = prop[group]
+            if key not in stats:
+                stats[key] = GroupStats()
+            stats[key].add(prop)
+
+    # Call it with the property as it was added
+    def remove(self, prop):
+        self.all.remove(prop)
+        for group, stats in self.groups.items():
+            key = prop[group]
+            group_stats = stats.get(key)
+            if group_stats is not None:
+                group_stats.remove(prop)
+                if not group_stats.count:
+                    del stats[key]
+
+    # Function to add the rows of column_arrays() output, a mask per group value
+    def build(self, arrays):
+        import numpy as np
+        price, total_sqft = arrays['price'], arrays['total_sqft']
+        self.all.add_arrays(price, total_sqft)
+        for group, stats in self.groups.items():
+            values = arrays[group]
+            missing = np.isnan(values)
+            for value in np.unique(values[~missing]).tolist():
+                mask = values == value
+                key = int(value) if group == 'bhk' else value
+                stats.setdefault(key, GroupStats()).add_arrays(price[mask], total_sqft[mask])
+            if missing.any():
+                stats.setdefault(None, GroupStats()).add_arrays(price[missing], total_sqft[missing])
+        return self
+
+    # Function to list the figures of every group: {'all': ..., 'bhk': {value: ...}, 'bath': {...}}
+    def summary(self):
+        summary = {'all': self.all.summary()}
+        for group, stats in self.groups.items():
+            summary[group] = {key: stats[key].summary()
+                              for key in sorted(stats, key=lambda key: (key is None, key or 0))}
+        return summary
+
+
+# Function to compute the figures of a row sequence, e.g. a search result
+def summarize(rows):
+    return PortfolioStats().build(column_arrays(rows))
@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+import pricing
+import storage
+import streaming
+from engine import ModelNotLoaded, PropertyEngine
+
+# Headless benchmarks for the property store and the price model.
+#
+# Usage: python benchmark.py [suite|search|memory|reprice] [rows ...]
+#        python benchmark.py suite [rows ...] [--store json|sqlite|binary] [--output results.json]
+#                                  [--compare baseline.json] [--tolerance 1.25]
+#
+# The suite drives the core operations of the app through PropertyEngine, the
+# same code the Tk buttons call, so it runs without a display. Each operation
+# is timed call by call to report latency percentiles, then called once more
+# under tracemalloc for its peak memory. Results are written as JSON; with
+# --compare, any operation whose median got slower than the baseline by more
+# than the tolerance is reported and the exit status is 1.
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), pricing.MODEL_FILENAME)
+ESTIMATOR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), pricing.ESTIMATOR_FILENAME)
+
+SEARCHES = [
+    {'min_price': 150.0, 'max_price': 152.0},
+    {'bhk': 3, 'bath': 2.0, 'max_price': 60.0},
+    {'total_sqft': 1200.0},
+    {'bhk': 2, 'min_price': 400.0},
+]
+
+
+LOCALITIES = ('Whitefield', 'Electronic City', 'Sarjapur Road', 'Hebbal', 'Yelahanka', 'Marathahalli',
+              'Rajaji Nagar', 'Indira Nagar', 'Koramangala', 'Jayanagar', 'Hennur Road', 'Kanakpura Road')
+KINDS = ('Residency', 'Enclave', 'Heights', 'Apartments', 'Villas', 'Gardens', 'Towers', 'Homes')
+
+
+# Function to generate synthetic properties with realistic-looking values: sizes
+# grow with bhk and are log-normally spread, bathrooms track bedrooms, prices
+# follow a per-locality rate per sqft, and a few records miss a field as in
+# the real listings data
+def generate_properties(count, seed=42):
+    rng = random.Random(seed)
+    rates = [rng.uniform(0.04, 0.12) for _ in LOCALITIES]
+    properties = []
+    for i in range(count):
+        locality = rng.randrange(len(LOCALITIES))
+        bhk = rng.choice((1, 2, 2, 3, 3, 3, 4, 4, 5))
+        total_sqft = float(round(rng.lognormvariate(0, 0.25) * (450 * bhk + 300)))
+        bath = float(max(1, bhk + rng.choice((-1, 0, 0, 1))))
+        price = round(max(10.0, total_sqft * rates[locality] * rng.lognormvariate(0, 0.2)), 2)
+        prop = {'name': '%s %s %07d' % (LOCALITIES[locality], rng.choice(KINDS), i),
+                'total_sqft': total_sqft, 'bath': bath, 'price': price, 'bhk': bhk}
+        if rng.random() < 0.01:
+            prop[rng.choice(('total_sqft', 'bath', 'price'))] = None
+        properties.append(prop)
+    return properties
+
+
+# Function to time fn over a few repetitions, returning the best time in milliseconds
+def best_of(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_search(count):
+    properties = generate_properties(count)
+    store = storage.JsonStore(None)
+    store.set_properties(properties)
+    print('%d rows' % count)
+    for criteria in SEARCHES:
+        scan = best_of(lambda: [prop for prop in properties if storage.matches(prop, criteria)])
+        indexed = best_of(lambda: store.search(criteria))
+        print('  %-50s scan %8.2f ms  indexed %8.2f ms  (%d hits)'
+              % (criteria, scan, indexed, len(store.search(criteria))))
+
+
+# Vectorized repricing vs. one predict() call per property (timed on a sample).
+# The per-row calls go to the scikit-learn model the app used to call, or to the
+# exported model when scikit-learn is not installed.
+def bench_reprice(count, sample=1000):
+    model = pricing.load_model(MODEL_PATH)
+    try:
+        baseline, label = pricing.load_estimator(ESTIMATOR_PATH), 'scikit-learn'
+    except ImportError:
+        baseline, label = model, 'exported model'
+    properties = generate_properties(count)
+    start = time.perf_counter()
+    pricing.predict_prices(model, properties)
+    vectorized = time.perf_counter() - start
+    rows = [row for row in ([prop[feature] for feature in pricing.FEATURES] for prop in properties[:2 * sample])
+            if None not in row][:sample]
+    with warnings.catch_warnings():  # scikit-learn warns on every call about feature names
+        warnings.simplefilter('ignore', UserWarning)
+        start = time.perf_counter()
+        for row in rows:
+            baseline.predict([row])
+        per_row = (time.perf_counter() - start) / len(rows)
+    print('%d rows: vectorized %.2f s, per-row %s calls ~%.1f s (extrapolated from %d)'
+          % (count, vectorized, label, per_row * count, len(rows)))
+
+
+# Memory held by a list of dicts vs. the columnar store (records, then with indexes)
+def bench_memory(count):
+    import gc
+    from array import array
+    from columnar import PropertyColumns
+    gc.collect()
+    tracemalloc.start()
+    properties = generate_properties(count)
+    as_dicts = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del properties
+    gc.collect()
+    properties = generate_properties(count)
+    tracemalloc.start()
+    columns = PropertyColumns()
+    order = array('q', [columns.append(prop) for prop in properties])
+    del properties
+    gc.collect()
+    as_columns = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del columns, order
+    gc.collect()
+    properties = generate_properties(count)
+    tracemalloc.start()
+    store = storage.JsonStore(None)
+    store.set_properties(properties)
+    del properties
+    gc.collect()
+    with_indexes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('%d rows: list of dicts %.1f MB, columnar %.1f MB, columnar + indexes %.1f MB'
+          % (count, as_dicts / 1e6, as_columns / 1e6, with_indexes / 1e6))
+
+
+# Function to summarize per-call times in seconds as millisecond percentiles
+def latency_stats(samples):
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return {'samples': len(ordered), 'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p50_ms': percentile(0.5), 'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99),
+            'max_ms': ordered[-1] * 1000}
+
+
+# Function to time fn(i) for i in range(samples), then run fn(samples) once more
+# under tracemalloc; returns the latency stats plus the peak memory of that call
+def measure(fn, samples):
+    times = []
+    for i in range(samples):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    fn(samples)
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return dict(latency_stats(times), peak_kb=peak / 1024)
+
+
+# Function to run every core operation on a store of count rows, returning
+# {operation: stats}. Quick operations get samples calls, whole-file ones fewer.
+def run_suite(count, backend='json', samples=200, slow_samples=3, seed=42):
+    rng = random.Random(seed)
+    properties = generate_properties(count, seed)
+    names = [prop['name'] for prop in properties]
+    extra = generate_properties(samples + 1, seed + 1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'properties.json')
+        streaming.write_properties(path, properties)
+        del properties
+        engine = PropertyEngine(storage.open_store(backend, path), model_path=MODEL_PATH)
+        engine.load()
+        engine.load_model_async().join()
+        store = engine.store
+        columns = ('name', 'price', 'total_sqft', 'bhk')
+        results = {}
+
+        def find(i):
+            engine.find(rng.choice(names))
+
+        def search(i):
+            len(engine.search(SEARCHES[i % len(SEARCHES)]))
+
+        def search_prefix(i):
+            len(engine.search({'name': rng.choice(names)[:-3], 'name_match': 'prefix'}))
+
+        def sort_build(i):
+            store.sort(columns[i % len(columns)], False)
+            store.all()[:50]
+
+        def sort(i):
+            store.sort(columns[i % len(columns)], i // len(columns) % 2 == 1)
+            store.all()[:50]
+
+        def add(i):
+            engine.add(dict(extra[i], name='Benchmark %07d' % i))
+
+        def update(i):
+            engine.update(rng.choice(names), {'price': round(rng.uniform(20, 500), 2)})
+
+        def remove(i):
+            engine.remove('Benchmark %07d' % i)
+
+        def predict(i):
+            prop = extra[i]
+            engine.predict_price(prop['total_sqft'] or 1000.0, prop['bath'] or 2.0, prop['bhk'])
+
+        def save(i):
+            engine.save()
+
+        def load(i):
+            fresh = storage.open_store(backend, path)
+            fresh.load()
+            fresh.close()
+
+        operations = [('find', find, samples), ('search', search, samples),
+                      ('search_prefix', search_prefix, samples),
+                      ('sort_build', sort_build, len(columns) - 1), ('sort', sort, samples),
+                      ('add', add, samples), ('update', update, samples), ('remove', remove, samples),
+                      ('predict', predict, samples), ('save', save, slow_samples), ('load', load, slow_samples)]
+        for operation, fn, runs in operations:
+            try:
+                results[operation] = measure(fn, runs)
+            except ModelNotLoaded as error:
+                print('  %s skipped: %s' % (operation, error))
+                continue
+            stats = results[operation]
+            print('  %-14s p50 %9.3f ms  p90 %9.3f ms  p99 %9.3f ms  max %9.3f ms  peak %10.1f KB'
+                  % (operation, stats['p50_ms'], stats['p90_ms'], stats['p99_ms'], stats['max_ms'],
+                     stats['peak_kb']))
+        engine.close()
+    return results
+
+
+# Function to describe the machine and code a run was made on
+def run_metadata(backend, seed):
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(), 'store': backend,
+            'seed': seed, 'git': revision}
+
+
+# Function to list (rows, operation, baseline p50, current p50) for every operation
+# whose median latency grew by more than tolerance times since the baseline run
+def find_regressions(baseline, current, tolerance):
+    regressions = []
+    for rows, operations in current['results'].items():
+        for operation, stats in operations.items():
+            before = baseline['results'].get(rows, {}).get(operation)
+            if before and stats['p50_ms'] > before['p50_ms'] * tolerance:
+                regressions.append((rows, operation, before['p50_ms'], stats['p50_ms']))
+    return regressions
+
+
+def bench_suite(counts, backend='json', output='benchmark_results.json', compare=None, tolerance=1.25):
+    report = {'meta': run_metadata(backend, 42), 'results': {}}
+    for count in counts:
+        print('%d rows (%s store)' % (count, backend))
+        report['results'][str(count)] = run_suite(count, backend)
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('Results written to %s' % output)
+    if compare:
+        with open(compare) as file:
+            baseline = json.load(file)
+        if baseline['meta'].get('store') != backend:
+            print('Warning: %s was run on the %s store' % (compare, baseline['meta'].get('store')))
+        regressions = find_regressions(baseline, report, tolerance)
+        for rows, operation, before, after in regressions:
+            print('REGRESSION %s rows %s: p50 %.3f ms -> %.3f ms' % (rows, operation, before, after))
+        if not regressions:
+            print('No regressions against %s' % compare)
+        return not regressions
+    return True
+
+
+BENCHMARKS = {'search': (bench_search, [10000, 100000]),
+              'memory': (bench_memory, [100000, 1000000]),
+              'reprice': (bench_reprice, [100000, 1000000])}
+SUITE_COUNTS = [1000, 10000, 100000, 1000000]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the property store and the price model.')
+    parser.add_argument('benchmark', nargs='?', default='suite', choices=['suite'] + sorted(BENCHMARKS))
+    parser.add_argument('rows', nargs='*', type=int)
+    parser.add_argument('--store', default='json', choices=storage.BACKENDS)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.25)
+    args = parser.parse_args()
+    if args.benchmark == 'suite':
+        ok = bench_suite(args.rows or SUITE_COUNTS, args.store, args.output, args.compare, args.tolerance)
+        raise SystemExit(0 if ok else 1)
+    bench, default_counts = BENCHMARKS[args.benchmark]
+    for count in args.rows or default_counts:
+        bench(count)
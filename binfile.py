@@ -0,0 +1,403 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from itertools import accumulate, compress
+import journal
+import locking
+import streaming
+from columnar import NUMERIC_COLUMNS, PropertyColumns
+
+# Memory-mapped binary property file.
+#
+# Layout (little-endian):
+#   header   magic, format version, then the counts below as 64-bit integers
+#   columns  one fixed-width array per field, each `capacity` slots long:
+#              name_offset, name_length   where the row's UTF-8 name sits in the heap
+#              total_sqft, bath, price    float64
+#              bhk                        int64
+#              <column>_null              one byte per row, 1 when the value is missing
+#              order                      live row ids sorted by (lower-cased name, row id)
+#   heap     the names, back to back, from the first 64 KiB boundary after the columns
+# A row id is a slot number. Deleted rows keep their slot with a name length of
+# 0 until the file is compacted; renames append the new name to the heap.
+#
+# Opening a file maps it and reads the header, nothing more: every column is a
+# memoryview straight onto the map, so values are decoded when they are read
+# and assigning to them patches the file in place. The name order is kept up
+# to date on every change, so listing by name needs no sort after opening.
+#
+# Usage: python binfile.py to-binary properties.json properties.bin
+#        python binfile.py to-json properties.bin properties.json
+
+MAGIC = b'PROPBIN\0'
+VERSION = 1
+
+# Counts kept in the header, in order
+COUNT_FIELDS = ('rows', 'capacity', 'live', 'heap_used', 'changes', 'order_valid')
+ROWS, CAPACITY, LIVE, HEAP_USED, CHANGES, ORDER_VALID = range(len(COUNT_FIELDS))
+HEADER = struct.Struct('<8sI4x%dQ' % len(COUNT_FIELDS))
+COUNTS_OFFSET = 16
+HEADER_SIZE = 64
+
+NULL_SUFFIX = '_null'
+
+# Column sections in file order, widest first so every section stays aligned
+SECTIONS = ((('name_offset', 'q'),) + tuple(NUMERIC_COLUMNS.items()) + (('order', 'q'), ('name_length', 'I'))
+            + tuple((column + NULL_SUFFIX, 'B') for column in NUMERIC_COLUMNS))
+
+# The heap starts on a multiple of this, which is a valid mmap offset everywhere
+HEAP_ALIGNMENT = 1 << 16
+
+MIN_CAPACITY = 1024
+MIN_HEAP = 1 << 16
+
+
+# Function to get the offset of every section and of the heap for a capacity
+def layout(capacity):
+    offsets, position = {}, HEADER_SIZE
+    for section, code in SECTIONS:
+        offsets[section] = position
+        position += capacity * struct.calcsize(code)
+    return offsets, -(-position // HEAP_ALIGNMENT) * HEAP_ALIGNMENT
+
+
+# Function to size a new file for rows rows, leaving room to grow
+def capacity_for(rows):
+    return -(-max(MIN_CAPACITY, rows + rows // 8) // 8) * 8
+
+
+# Read-through view of the name column; None for deleted rows
+class NameColumn(Sequence):
+    __slots__ = ('columns',)
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return self.columns.counts[ROWS]
+
+    def __getitem__(self, rowid):
+        return self.columns.name(rowid)
+
+    def __setitem__(self, rowid, name):
+        self.columns.set_name(rowid, name)
+
+    def __iter__(self):
+        name = self.columns.name
+        for rowid in range(len(self)):
+            yield name(rowid)
+
+
+# PropertyColumns over a mapped binary file. Every change is written to the
+# map at once and bumps the change counter other instances watch.
+class BinaryColumns(PropertyColumns):
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise ValueError('binary property files need a little-endian machine')
+        self.path = path
+        self.file = open(path, 'r+b')
+        try:
+            magic, version, *counts = HEADER.unpack(self.file.read(HEADER.size))
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError('%s is not a binary property file' % path)
+        if version != VERSION:
+            self.file.close()
+            raise ValueError('%s has unsupported format version %d' % (path, version))
+        self.capacity = counts[CAPACITY]
+        self.offsets, self.heap_start = layout(self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), self.heap_start)
+        self.heap = None
+        self._map_heap()
+        self.counts = self._view(COUNTS_OFFSET, len(COUNT_FIELDS), 'Q')
+        self.views = {section: self._view(self.offsets[section], self.capacity, code) for section, code in SECTIONS}
+        self.names = NameColumn(self)
+        self.values = {column: self.views[column] for column in NUMERIC_COLUMNS}
+        self.nulls = {column: self.views[column + NULL_SUFFIX] for column in NUMERIC_COLUMNS}
+        self.free = []  # Deleted slots are only reclaimed by compact()
+        if not self.counts[ORDER_VALID]:  # Left by a crash in the middle of a change
+            self.sort_names()
+
+    def _view(self, start, count, code):
+        return memoryview(self.map)[start:start + count * struct.calcsize(code)].cast(code)
+
+    # Function to map the heap up to the end of the file, which another instance may have extended
+    def _map_heap(self):
+        size = os.fstat(self.file.fileno()).st_size - self.heap_start
+        if self.heap is not None:
+            if len(self.heap) == size:
+                return
+            self.heap.close()
+        self.heap = mmap.mmap(self.file.fileno(), size, offset=self.heap_start)
+
+    def __len__(self):
+        return self.counts[LIVE]
+
+    def rows(self):
+        return self.counts[ROWS]
+
+    def changes(self):
+        return self.counts[CHANGES]
+
+    # Function to pick up the heap growth of other instances after the change counter moved
+    def refresh(self):
+        if self.counts[HEAP_USED] > len(self.heap):
+            self._map_heap()
+
+    def name(self, rowid):
+        length = self.views['name_length'][rowid]
+        if not length:
+            return None
+        offset = self.views['name_offset'][rowid]
+        return self.heap[offset:offset + length].decode('utf-8')
+
+    def _store_name(self, rowid, name):
+        data = name.encode('utf-8')
+        used = self.counts[HEAP_USED]
+        if used + len(data) > len(self.heap):
+            self.file.truncate(self.heap_start + max(used + len(data), 2 * len(self.heap)))
+            self._map_heap()
+        self.heap[used:used + len(data)] = data
+        self.counts[HEAP_USED] = used + len(data)
+        self.views['name_offset'][rowid] = used
+        self.views['name_length'][rowid] = len(data)
+
+    def _order_key(self, rowid):
+        return (self.name(rowid).lower(), rowid)
+
+    # Function to move the entries of the name order from index start on by shift slots
+    def _shift_order(self, start, shift):
+        base, entries = self.offsets['order'], self.counts[LIVE]
+        self.map.move(base + 8 * (start + shift), base + 8 * start, 8 * (entries - start))
+
+    # The row must be live and not yet counted in LIVE
+    def _order_insert(self, rowid):
+        order = self.views['order'][:self.counts[LIVE]]
+        i = bisect_left(order, self._order_key(rowid), key=self._order_key)
+        order.release()
+        self._shift_order(i, 1)
+        self.views['order'][i] = rowid
+
+    # The row must still carry the name it is ordered by and be counted in LIVE
+    def _order_remove(self, rowid):
+        order = self.views['order'][:self.counts[LIVE]]
+        i = bisect_left(order, self._order_key(rowid), key=self._order_key)
+        order.release()
+        self._shift_order(i + 1, -1)
+
+    # Function to rebuild the name order from scratch
+    def sort_names(self):
+        self.counts[ORDER_VALID] = 0
+        order = array('q', sorted(self.rowids(), key=lambda rowid: self.name(rowid).lower()))
+        self.views['order'][:len(order)] = order
+        self.counts[ORDER_VALID] = 1
+
+    # Function to get the live row ids in name order
+    def name_order(self):
+        return array('q', self.views['order'][:self.counts[LIVE]])
+
+    def rowids(self):
+        rows = self.counts[ROWS]
+        return list(compress(range(rows), self.views['name_length'][:rows]))
+
+    # Function to tell whether count more rows fit before the file must be rewritten
+    def has_room(self, count):
+        return self.counts[ROWS] + count <= self.capacity
+
+    # Function to add a property in a free slot at the end, returning its row id
+    def append(self, prop):
+        rowid = self._append(prop)
+        self.counts[ORDER_VALID] = 0
+        self._order_insert(rowid)
+        self.counts[LIVE] += 1
+        self.counts[ORDER_VALID] = 1
+        self.counts[CHANGES] += 1
+        return rowid
+
+    def _append(self, prop):
+        rowid = self.counts[ROWS]
+        if rowid >= self.capacity:
+            raise ValueError('%s is full' % self.path)
+        self._store_name(rowid, prop['name'])
+        for column in NUMERIC_COLUMNS:
+            self._store(rowid, column, prop.get(column))
+        self.counts[ROWS] = rowid + 1
+        return rowid
+
+    # Function to add many properties, merging them into the name order in one pass
+    def append_many(self, properties):
+        self.counts[ORDER_VALID] = 0
+        old = self.name_order()
+        rowids = [self._append(prop) for prop in properties]
+        merged, start = array('q'), 0
+        for rowid in sorted(rowids, key=self._order_key):
+            i = bisect_left(old, self._order_key(rowid), start, key=self._order_key)
+            merged.extend(old[start:i])
+            merged.append(rowid)
+            start = i
+        merged.extend(old[start:])
+        self.views['order'][:len(merged)] = merged
+        self.counts[LIVE] += len(rowids)
+        self.counts[ORDER_VALID] = 1
+        self.counts[CHANGES] += 1
+        return rowids
+
+    def set(self, rowid, prop):
+        super().set(rowid, prop)
+        self.counts[CHANGES] += 1
+
+    def set_name(self, rowid, name):
+        self.counts[ORDER_VALID] = 0
+        self._order_remove(rowid)
+        self.counts[LIVE] -= 1
+        self._store_name(rowid, name)
+        self._order_insert(rowid)
+        self.counts[LIVE] += 1
+        self.counts[ORDER_VALID] = 1
+
+    def delete(self, rowid):
+        self.counts[ORDER_VALID] = 0
+        self._order_remove(rowid)
+        self.views['name_length'][rowid] = 0
+        self.counts[LIVE] -= 1
+        self.counts[ORDER_VALID] = 1
+        self.counts[CHANGES] += 1
+
+    # Function to delete many rows, dropping them from the name order in one pass
+    def delete_many(self, rowids):
+        self.counts[ORDER_VALID] = 0
+        lengths = self.views['name_length']
+        for rowid in rowids:
+            lengths[rowid] = 0
+        old = self.name_order()
+        order = array('q', compress(old, map(lengths.__getitem__, old)))
+        self.views['order'][:len(order)] = order
+        self.counts[LIVE] = len(order)
+        self.counts[ORDER_VALID] = 1
+        self.counts[CHANGES] += 1
+
+    # Function to estimate the share of the file taken by deleted rows and replaced names
+    def garbage(self):
+        rows = self.counts[ROWS]
+        if not rows:
+            return 0.0
+        heap_used = self.counts[HEAP_USED]
+        dead_heap = heap_used - sum(self.views['name_length'][:rows])
+        return max((rows - self.counts[LIVE]) / rows, dead_heap / heap_used if heap_used else 0.0)
+
+    def flush(self):
+        self.map.flush()
+        self.heap.flush()
+
+    def close(self):
+        for view in self.views.values():
+            view.release()
+        self.counts.release()
+        self.map.close()
+        self.heap.close()
+        self.file.close()
+
+
+# Function to write sections to a new file at path; names are UTF-8 encoded,
+# order lists the row ids in name order
+def _write(path, names, values, nulls, order, spare=0, changes=0):
+    count = len(names)
+    capacity = capacity_for(count + spare)
+    offsets, heap_start = layout(capacity)
+    lengths = array('I', map(len, names))
+    heap = b''.join(names)
+    sections = {'name_offset': array('q', accumulate(lengths[:-1], initial=0) if count else ()),
+                'name_length': lengths, 'order': array('q', order)}
+    sections.update(values)
+    sections.update((column + NULL_SUFFIX, nulls[column]) for column in NUMERIC_COLUMNS)
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, count, capacity, count, len(heap), changes, 1))
+        # Sections are written only as far as they are used; the rest stays a hole
+        for section, _ in SECTIONS:
+            file.seek(offsets[section])
+            file.write(sections[section])
+        file.seek(heap_start)
+        file.write(heap)
+        file.truncate(heap_start + max(MIN_HEAP, len(heap) + len(heap) // 8))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+# Function to write properties (mappings with unique names) to a new binary file at path
+def write_file(path, properties, spare=0):
+    names = []
+    values = {column: array(code) for column, code in NUMERIC_COLUMNS.items()}
+    nulls = {column: bytearray() for column in NUMERIC_COLUMNS}
+    for prop in properties:
+        names.append(prop['name'].encode('utf-8'))
+        for column in NUMERIC_COLUMNS:
+            value = prop.get(column)
+            nulls[column].append(value is None)
+            values[column].append(0 if value is None else int(value) if column == 'bhk' else float(value))
+    lowered = [name.decode('utf-8').lower() for name in names]
+    _write(path, names, values, nulls, sorted(range(len(names)), key=lowered.__getitem__), spare)
+    return len(names)
+
+
+# Function to copy the live rows of columns to a new file at path, in name order,
+# dropping deleted rows and replaced names; spare rows are left free
+def compact(columns, path, spare=0):
+    order = columns.name_order()
+    heap, offsets, lengths = columns.heap, columns.views['name_offset'], columns.views['name_length']
+    names = [heap[offsets[rowid]:offsets[rowid] + lengths[rowid]] for rowid in order]
+    values = {column: array(code, map(columns.values[column].__getitem__, order))
+              for column, code in NUMERIC_COLUMNS.items()}
+    nulls = {column: bytearray(map(columns.nulls[column].__getitem__, order)) for column in NUMERIC_COLUMNS}
+    _write(path, names, values, nulls, range(len(names)), spare, columns.changes() + 1)
+
+
+# Function to convert a property file (JSON, NDJSON or CSV, plus its journal)
+# into a binary file, with the lock of path held; duplicate names are renamed
+# as the JSON store does
+def to_binary(source, path):
+    from storage import JsonStore  # storage builds on this module
+    store = JsonStore(source)
+    if source is not None:
+        store.load()
+    rows = store.all()
+    write_file(path + '.tmp', rows)
+    os.replace(path + '.tmp', path)
+    store.close()
+    return len(rows)
+
+
+# Function to convert a binary file into a property file; its journal, if any,
+# is removed so it is not replayed over the new rows
+def to_json(path, target):
+    columns = BinaryColumns(path)
+    try:
+        with locking.locked(target):
+            count = streaming.write_properties(target, map(columns.to_dict, columns.name_order()))
+            try:
+                os.remove(journal.log_path(target))
+            except FileNotFoundError:
+                pass
+    finally:
+        columns.close()
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert property files to and from the binary format.')
+    parser.add_argument('command', choices=('to-binary', 'to-json'))
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+    if args.command == 'to-binary':
+        with locking.locked(args.target):
+            count = to_binary(args.source, args.target)
+    else:
+        count = to_json(args.source, args.target)
+    print('Wrote %d properties to %s' % (count, args.target))
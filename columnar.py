@@ -0,0 +1,292 @@
+import heapq
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Mapping, Sequence
+from itertools import chain
+
+# Columnar in-memory record store for properties.
+#
+# Each numeric field lives in a typed array with a parallel null mask, names
+# are interned strings, and a row is addressed by its row id (its slot in the
+# columns). Slots of deleted rows are reused. PropertyRow and RowSequence are
+# light views that read through to the columns, so callers can keep using
+# prop['name'] and friends without a dict per property.
+
+COLUMNS = ('name', 'total_sqft', 'bath', 'price', 'bhk')
+
+# Type code of the array holding each numeric column
+NUMERIC_COLUMNS = {'total_sqft': 'd', 'bath': 'd', 'price': 'd', 'bhk': 'q'}
+
+
+class PropertyColumns:
+    def __init__(self):
+        self.names = []
+        self.values = {column: array(code) for column, code in NUMERIC_COLUMNS.items()}
+        self.nulls = {column: bytearray() for column in NUMERIC_COLUMNS}
+        self.free = []  # Row ids of deleted rows, reused by append()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def copy(self):
+        other = PropertyColumns()
+        other.names = self.names[:]
+        other.values = {column: values[:] for column, values in self.values.items()}
+        other.nulls = {column: bytearray(nulls) for column, nulls in self.nulls.items()}
+        other.free = self.free[:]
+        other.count = self.count
+        return other
+
+    def _store(self, rowid, column, value):
+        if value is None:
+            self.nulls[column][rowid] = 1
+            self.values[column][rowid] = 0
+        else:
+            self.nulls[column][rowid] = 0
+            self.values[column][rowid] = int(value) if column == 'bhk' else float(value)
+
+    # Function to add a property, returning its row id
+    def append(self, prop):
+        if self.free:
+            rowid = self.free.pop()
+            self.names[rowid] = sys.intern(prop['name'])
+        else:
+            rowid = len(self.names)
+            self.names.append(sys.intern(prop['name']))
+            for column in NUMERIC_COLUMNS:
+                self.values[column].append(0)
+                self.nulls[column].append(1)
+        for column in NUMERIC_COLUMNS:
+            self._store(rowid, column, prop.get(column))
+        self.count += 1
+        return rowid
+
+    # Function to overwrite the fields present in prop
+    def set(self, rowid, prop):
+        for column, value in prop.items():
+            if column == 'name':
+                self.names[rowid] = sys.intern(value)
+            elif column in NUMERIC_COLUMNS:
+                self._store(rowid, column, value)
+
+    def delete(self, rowid):
+        self.names[rowid] = None
+        self.free.append(rowid)
+        self.count -= 1
+
+    def get(self, rowid, column):
+        if column == 'name':
+            return self.names[rowid]
+        if self.nulls[column][rowid]:
+            return None
+        return self.values[column][rowid]
+
+    def to_dict(self, rowid):
+        return {column: self.get(rowid, column) for column in COLUMNS}
+
+    def rowids(self):
+        return [rowid for rowid, name in enumerate(self.names) if name is not None]
+
+    # Function to build the (value, row id) sort key of rows that have a value
+    def sort_key(self, column):
+        if column == 'name':
+            names = self.names
+            return lambda rowid: (names[rowid].lower(), rowid)
+        values = self.values[column]
+        return lambda rowid: (values[rowid], rowid)
+
+    # Function to list the bare sort values of rows that have a value (names lower-cased)
+    def sort_values(self, column, rowids):
+        if column == 'name':
+            return list(map(str.lower, map(self.names.__getitem__, rowids)))
+        return list(map(self.values[column].__getitem__, rowids))
+
+    # Function to get the null mask of a column (None for names, which are never missing)
+    def null_mask(self, column):
+        return self.nulls.get(column)
+
+
+# Read-through view of one row
+class PropertyRow(Mapping):
+    __slots__ = ('columns', 'rowid')
+
+    def __init__(self, columns, rowid):
+        self.columns = columns
+        self.rowid = rowid
+
+    def __getitem__(self, key):
+        if key not in COLUMNS:
+            raise KeyError(key)
+        return self.columns.get(self.rowid, key)
+
+    def __iter__(self):
+        return iter(COLUMNS)
+
+    def __len__(self):
+        return len(COLUMNS)
+
+    def to_dict(self):
+        return self.columns.to_dict(self.rowid)
+
+    def __repr__(self):
+        return 'PropertyRow(%r)' % self.to_dict()
+
+
+# Function to find where each row of new goes among items, both sorted in (value,
+# row id) order: key(rowid) gives that pair and values(rowids) the bare values of
+# many rows. A small batch is bisected with key; a large one against the bare
+# values of items listed once, then the row ids among equal values, which runs
+# no key function per comparison.
+def insertion_points(items, new, key, values):
+    if len(new) * len(items).bit_length() < len(items):
+        return [bisect_left(items, key(rowid), key=key) for rowid in new]
+    keys = values(items)
+    points = []
+    for rowid, value in zip(new, values(new)):
+        low = bisect_left(keys, value)
+        points.append(bisect_left(items, rowid, low, bisect_right(keys, value, low)))
+    return points
+
+
+# Function to insert items into a sorted array in one pass: new is sorted the
+# same way and points[i] is where new[i] goes among the current items (as
+# bisect gives it), so the array is copied once instead of once per insertion
+def splice(items, points, new):
+    merged = array(items.typecode)
+    start = 0
+    for point, item in zip(points, new):
+        merged.extend(items[start:point])
+        merged.append(item)
+        start = point
+    merged.extend(items[start:])
+    return merged
+
+
+# Read-through view of a sequence of row ids
+class RowSequence(Sequence):
+    __slots__ = ('columns', 'rowids')
+
+    def __init__(self, columns, rowids):
+        self.columns = columns
+        self.rowids = rowids
+
+    def __len__(self):
+        return len(self.rowids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [PropertyRow(self.columns, rowid) for rowid in self.rowids[index]]
+        return PropertyRow(self.columns, self.rowids[index])
+
+
+# Row ids of the live rows sorted on one column. Rows with a value are kept in
+# ascending (value, row id) order and rows missing it separately in row id
+# order, so missing values are listed last in both directions and the
+# descending order is the ascending one read backwards. Insertions and
+# removals keep it up to date by bisection instead of re-sorting, and a batch
+# of insertions is spliced in with one copy.
+# Row ids already in name order (as a binary file keeps them) can be passed
+# with presorted set to skip the sort. With chunk_size set, the rows are sorted
+# that many at a time and the chunks merged, so a build on a worker thread
+# never holds the GIL long enough to stall the thread running the UI.
+class SortOrder:
+    def __init__(self, columns, column, rowids, presorted=False, chunk_size=None):
+        self.column = column
+        self.key = columns.sort_key(column)
+        self.nulls = columns.null_mask(column)
+        if presorted and self.nulls is None:
+            self.values = array('q', rowids)
+            self.missing = array('q')
+            return
+        rowids = sorted(rowids)
+        if self.nulls is None:
+            values, missing = rowids, []
+            lowered = [name.lower() if name is not None else None for name in columns.names]
+            sort_value = lowered.__getitem__
+        else:
+            nulls = self.nulls
+            values = [rowid for rowid in rowids if not nulls[rowid]]
+            missing = [rowid for rowid in rowids if nulls[rowid]]
+            sort_value = columns.values[column].__getitem__
+        # A stable sort of ascending row ids on the bare value gives (value, row id) order;
+        # merging keeps it stable, taking ties from the earlier chunk first
+        if chunk_size is None or len(values) <= chunk_size:
+            values.sort(key=sort_value)
+            self.values = array('q', values)
+        else:
+            chunks = [sorted(values[i:i + chunk_size], key=sort_value) for i in range(0, len(values), chunk_size)]
+            self.values = array('q', heapq.merge(*chunks, key=sort_value))
+        self.missing = array('q', missing)
+
+    def _is_missing(self, rowid):
+        return self.nulls is not None and self.nulls[rowid]
+
+    # The row must hold the values it was inserted with
+    def _index(self, rowid):
+        if self._is_missing(rowid):
+            return self.missing, bisect_left(self.missing, rowid)
+        return self.values, bisect_left(self.values, self.key(rowid), key=self.key)
+
+    def insert(self, rowid):
+        items, i = self._index(rowid)
+        items.insert(i, rowid)
+
+    def remove(self, rowid):
+        items, i = self._index(rowid)
+        if i < len(items) and items[i] == rowid:
+            del items[i]
+
+    # Function to insert many rows at once, copying the order once
+    def insert_many(self, columns, rowids):
+        values = sorted((rowid for rowid in rowids if not self._is_missing(rowid)), key=self.key)
+        missing = sorted(rowid for rowid in rowids if self._is_missing(rowid))
+        points = insertion_points(self.values, values, self.key,
+                                  lambda rowids: columns.sort_values(self.column, rowids))
+        self.values = splice(self.values, points, values)
+        self.missing = splice(self.missing, [bisect_left(self.missing, rowid) for rowid in missing], missing)
+
+    # Function to get where a row is listed in the given direction
+    def position(self, rowid, descending=False):
+        items, i = self._index(rowid)
+        if items is self.missing:
+            return len(self.values) + i
+        return len(self.values) - 1 - i if descending else i
+
+    def view(self, descending=False):
+        return OrderView(self, descending)
+
+    # Function to sort a subset of the row ids the same way
+    def sort(self, rowids, descending=False):
+        values = sorted((rowid for rowid in rowids if not self._is_missing(rowid)), key=self.key, reverse=descending)
+        missing = sorted(rowid for rowid in rowids if self._is_missing(rowid))
+        return array('q', values + missing)
+
+
+# Read-through view of a SortOrder in one direction
+class OrderView(Sequence):
+    __slots__ = ('order', 'descending')
+
+    def __init__(self, order, descending):
+        self.order = order
+        self.descending = descending
+
+    def __len__(self):
+        return len(self.order.values) + len(self.order.missing)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        values = self.order.values
+        if index < 0:
+            index += len(self)
+            if index < 0:
+                raise IndexError('index out of range')
+        if index < len(values):
+            return values[len(values) - 1 - index] if self.descending else values[index]
+        return self.order.missing[index - len(values)]
+
+    def __iter__(self):
+        values = self.order.values
+        return chain(reversed(values) if self.descending else values, self.order.missing)
@@ -0,0 +1,242 @@
+import math
+import analytics
+import pricing
+import streaming
+import training
+from metrics import METRICS
+
+# UI-independent core of the property manager.
+#
+# PropertyEngine wraps a store (see storage.py) and the price model and holds
+# the operations the Tk app and the HTTP service share: lookups, search, CRUD
+# and pricing. It never talks to the user: bad input raises ValueError (or its
+# subclass storage.DuplicateName for a name already in use), an unknown
+# property KeyError and a missing model ModelNotLoaded, and each front end
+# reports those its own way. The engine is not thread-safe: it must be driven
+# from a single thread (the Tk loop, or the server's event loop), except for
+# searches prepared with prepare_search() (see livesearch.py).
+# Searches, writes and predictions are timed into metrics.METRICS as engine.*.
+#
+# The model in use is either the one loaded from model_path (version 0) or a
+# version fitted from the stored listings (see training.py). With learning on,
+# refresh_model() refits after the listings change; each front end calls it
+# from its own loop. A fit replaces the model in use only if it does not score
+# worse on the holdout listings, and self.model is swapped by one assignment,
+# so a prediction never sees a half-updated model.
+
+
+class ModelNotLoaded(Exception):
+    pass
+
+
+NAME_MATCHES = ('exact', 'prefix', 'fuzzy')
+
+
+# Function to parse search fields given as strings (empty means "any") into criteria
+def parse_criteria(fields):
+    criteria = {'name': (fields.get('name') or '').strip(),
+                'name_match': (fields.get('name_match') or 'exact').strip().lower()}
+    if criteria['name_match'] not in NAME_MATCHES:
+        raise ValueError('name_match must be one of %s' % ', '.join(NAME_MATCHES))
+    for key in ('total_sqft', 'bath', 'min_price', 'max_price'):
+        value = (fields.get(key) or '').strip()
+        try:
+            criteria[key] = float(value) if value else None
+        except ValueError:
+            raise ValueError('%s must be a number' % key)
+    for key in ('bhk', 'top_k'):
+        value = (fields.get(key) or '').strip()
+        try:
+            criteria[key] = int(value) if value else None
+        except ValueError:
+            raise ValueError('%s must be an integer' % key)
+    return criteria
+
+
+# Function to parse the features of a price prediction, given as numbers or numeric
+# strings, into the (total_sqft, bath, bhk) arguments of predict_price()
+def parse_features(fields):
+    features = []
+    for key in pricing.FEATURES:
+        value = fields.get(key)
+        kind = 'an integer' if key == 'bhk' else 'a number'
+        if isinstance(value, bool):
+            raise ValueError('%s must be %s' % (key, kind))
+        try:
+            number = float(value.strip() if isinstance(value, str) else value)
+        except (TypeError, ValueError):
+            raise ValueError('%s must be %s' % (key, kind))
+        if not math.isfinite(number) or (key == 'bhk' and not number.is_integer()):
+            raise ValueError('%s must be %s' % (key, kind))
+        features.append(int(number) if key == 'bhk' else number)
+    return features
+
+
+class PropertyEngine:
+    def __init__(self, store, model_path=pricing.MODEL_FILENAME, cache_size=10000):
+        self.store = store
+        self.model_path = model_path
+        self.model = None
+        self.model_error = None
+        self.model_loading = False
+        self.loaded_model = None  # Version 0, once loaded
+        self.trainer = training.ModelTrainer()
+        self.learning = True  # Whether refresh_model() follows the listings
+        self.prediction_cache = pricing.PredictionCache(cache_size)
+
+    def load(self):
+        self.store.load()
+
+    # Function to start loading the model on a background thread. on_done(model, error)
+    # is called from that thread once the model is in place; a version fitted in the
+    # meantime stays in use.
+    def load_model_async(self, on_done=None):
+        def loaded(model, error):
+            self.loaded_model, self.model_error = model, error
+            if self.model is None:
+                self.model = model
+            self.model_loading = False
+            if on_done:
+                on_done(model, error)
+        self.model_loading = True
+        return pricing.load_model_async(loaded, self.model_path)
+
+    def all(self):
+        return self.store.all()
+
+    @METRICS.timed('engine.search')
+    def search(self, criteria):
+        return self.store.search(criteria)
+
+    # Function to get the store ready to run search(criteria) from another thread
+    @METRICS.timed('engine.prepare_search')
+    def prepare_search(self, criteria):
+        self.store.prepare_search(criteria)
+
+    # Function to get the PortfolioStats of every property, kept current by the store
+    # (see analytics.py)
+    @METRICS.timed('engine.statistics')
+    def statistics(self):
+        return self.store.statistics()
+
+    # Function to compute the same figures for a row sequence, e.g. a search result
+    @METRICS.timed('engine.summarize')
+    def summarize(self, rows):
+        return analytics.summarize(rows)
+
+    # Function to find a property by its exact name, or None
+    def find(self, name):
+        return self.store.get(name)
+
+    @METRICS.timed('engine.add')
+    def add(self, property):
+        prop = streaming.validate_property(property)
+        self.store.add(prop)
+        return prop
+
+    @METRICS.timed('engine.remove')
+    def remove(self, name):
+        if self.find(name) is None:
+            raise KeyError(name)
+        self.store.remove(name)
+
+    # Function to change some fields of a property, returning the updated property.
+    # Only the fields whose values differ reach the store, so other instances'
+    # edits of the remaining fields merge in sync() (see storage.py)
+    @METRICS.timed('engine.update')
+    def update(self, name, changes):
+        current = self.find(name)
+        if current is None:
+            raise KeyError(name)
+        prop = streaming.validate_property(dict(current, **changes))
+        changed = {field: value for field, value in prop.items() if current[field] != value}
+        if changed:
+            self.store.update(name, changed)
+        return prop
+
+    # Function to get the loaded model, raising ModelNotLoaded when there is none
+    def require_model(self):
+        if self.model is None:
+            raise ModelNotLoaded(self.model_error or 'the prediction model is still loading')
+        return self.model
+
+    @METRICS.timed('engine.predict_price')
+    def predict_price(self, total_sqft, bath, bhk):
+        return pricing.predict_price(self.require_model(), total_sqft, bath, bhk, cache=self.prediction_cache)
+
+    # Function to predict prices for many properties (None where a feature is missing)
+    @METRICS.timed('engine.predict_prices')
+    def predict_prices(self, props):
+        return pricing.predict_prices(self.require_model(), props, cache=self.prediction_cache)
+
+    # Function to fit a new model version from the stored listings and swap it in
+    # unless it scores worse than the model in use. Returns the new version, or
+    # None with too few listings to fit; it is in use if self.model is it.
+    @METRICS.timed('engine.retrain')
+    def retrain(self):
+        stats = self.store.training_stats()
+        model = self.trainer.fit(stats)
+        if model is not None and not self.trainer.worse(stats, model, self.model):
+            self.model = model
+        self.trainer.prune(stats, self.model)
+        return model
+
+    # Function to retrain if learning is on and the listings changed since the last fit
+    def refresh_model(self):
+        if self.learning and self.trainer.stale(self.store.training_stats()):
+            return self.retrain()
+        return None
+
+    # Function to get the number of the model in use, or None while there is none
+    def model_version(self):
+        if self.model is None:
+            return None
+        return 0 if self.model is self.loaded_model else self.model.version
+
+    # Function to describe the model in use and every version, each scored on the
+    # current holdout listings next to the figures of its own fit
+    def model_info(self):
+        stats = self.store.training_stats()
+        versions = []
+        if self.loaded_model is not None:
+            versions.append({'version': 0, 'source': self.model_path})
+        versions += [dict(model.info, version=model.version, source='listings') for model in self.trainer.versions]
+        for info in versions:
+            model = self.loaded_model if info['version'] == 0 else self.trainer.version(info['version'])
+            info['holdout_r2'], info['holdout_rmse'] = stats.evaluate(model)
+        return {'version': self.model_version(), 'learning': self.learning,
+                'training_rows': stats.train.count, 'holdout_rows': stats.holdout.count, 'versions': versions}
+
+    # Function to go back to an earlier version; learning stops, or the next
+    # change to the listings would replace it again
+    def use_version(self, number):
+        if number == 0:
+            if self.loaded_model is None:
+                raise ModelNotLoaded(self.model_error or 'the prediction model is still loading')
+            model = self.loaded_model
+        else:
+            model = self.trainer.version(number)
+        self.learning = False
+        self.model = model
+        return model
+
+    # Function to store new prices as (name, price) pairs, returning how many were applied
+    def apply_prices(self, names, prices):
+        changes = [(name, {'price': price}) for name, price in zip(names, prices) if price is not None]
+        self.store.update_many(changes)
+        return len(changes)
+
+    # Function to reprice properties with one model call and one write.
+    # Returns (repriced, skipped) counts; skipped rows miss a model feature.
+    def reprice(self, props):
+        props = list(props)
+        prices = self.predict_prices(props)
+        repriced = self.apply_prices([prop['name'] for prop in props], prices)
+        return repriced, len(props) - repriced
+
+    @METRICS.timed('engine.save')
+    def save(self):
+        self.store.save()
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,116 @@
+from itertools import groupby
+
+# Undo/redo history of a store, kept as a log of inverse operations.
+#
+# Every mutation is recorded as an Entry holding the operations that redo it
+# and the ones that undo it. Only the rows and fields that changed are kept,
+# so the history grows with the edits made and never with the size of the
+# store: unchanged rows are simply shared with the live data. Versions are
+# entry numbers, so a checkpoint (like the one taken at load) costs O(1) and
+# going back to it undoes just the entries recorded since.
+#
+# Operations are tuples:
+#   ('add', [property, ...])
+#   ('remove', [name, ...])
+#   ('update', name, changes)             one row, may rename it
+#   ('set', [name, ...], {column: [value, ...]})
+#                                         the same columns of many rows, stored
+#                                         column-wise so a full reprice stays small
+# Stores replay them through their regular methods, so indexes, change events
+# and the journal all see an undo as ordinary edits.
+
+LOAD_CHECKPOINT = 'load'
+
+# Replay runs longer than this through the bulk methods (one rebuild, one event)
+BULK_THRESHOLD = 1000
+
+
+class Entry:
+    def __init__(self, version, label, forward, inverse):
+        self.version = version
+        self.label = label
+        self.forward = forward  # Operations that redo the change
+        self.inverse = inverse  # Operations that undo it, in order
+
+
+class History:
+    def __init__(self):
+        self.clear()
+
+    # Function to forget every change and take the current state as the load checkpoint
+    def clear(self):
+        self.done = []
+        self.undone = []  # Redo stack, next entry to redo last
+        self.checkpoints = {LOAD_CHECKPOINT: 0}
+        self.next_version = 1
+        self.replaying = False  # Set while a store applies undo/redo operations
+
+    def version(self):
+        return self.done[-1].version if self.done else 0
+
+    def record(self, label, forward, inverse):
+        if self.replaying or not forward:
+            return
+        if self.undone:
+            # A new edit abandons the undone branch and the checkpoints taken on it
+            abandoned = {entry.version for entry in self.undone}
+            self.checkpoints = {name: version for name, version in self.checkpoints.items()
+                                if version not in abandoned}
+            self.undone = []
+        self.done.append(Entry(self.next_version, label, forward, inverse))
+        self.next_version += 1
+
+    def undo_label(self):
+        return self.done[-1].label if self.done else None
+
+    def redo_label(self):
+        return self.undone[-1].label if self.undone else None
+
+    def checkpoint(self, name):
+        self.checkpoints[name] = self.version()
+
+    # Function to move to a version, returning the operations that take the store there
+    def move_to(self, version):
+        operations = []
+        if version == 0 or any(entry.version == version for entry in self.done):
+            while self.version() != version:
+                entry = self.done.pop()
+                operations.extend(entry.inverse)
+                self.undone.append(entry)
+        elif any(entry.version == version for entry in self.undone):
+            while self.version() != version:
+                entry = self.undone.pop()
+                operations.extend(entry.forward)
+                self.done.append(entry)
+        else:
+            raise KeyError(version)
+        return operations
+
+    def undo(self):
+        if not self.done:
+            return []
+        return self.move_to(self.done[-2].version if len(self.done) > 1 else 0)
+
+    def redo(self):
+        if not self.undone:
+            return []
+        return self.move_to(self.undone[-1].version)
+
+    def restore(self, name):
+        return self.move_to(self.checkpoints[name])
+
+
+# Function to record a batch of (name, changes) updates as 'set' operations, one
+# per set of changed columns; old(name) gives the current row of a name
+def set_operations(changes, old):
+    forward, inverse = [], []
+    for columns, group in groupby(changes, key=lambda change: tuple(change[1])):
+        group = list(group)
+        names = [name for name, _ in group]
+        rows = [old(name) for name in names]
+        forward.append(('set', names, {column: [change[column] for _, change in group] for column in columns}))
+        # Renamed rows are found by their new name when undoing
+        inverse.append(('set', [change.get('name', name) for name, change in group],
+                        {column: [row[column] for row in rows] for column in columns}))
+    inverse.reverse()
+    return forward, inverse
@@ -0,0 +1,44 @@
+import os
+import tkinter as tk
+
+# Button icons, served from an on-disk cache of pre-resized PNGs.
+#
+# The cached file name carries the source file's size and mtime, so a cache
+# entry is rebuilt only when its source icon changes. Cache hits are loaded
+# straight into a Tk PhotoImage; PIL is only imported to rebuild an entry.
+
+CACHE_DIR = '.icon_cache'
+
+
+# Function to get the cache path for an icon at a given size
+def cached_path(path, size):
+    stat = os.stat(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, '%s-%dx%d-%d-%d.png' % (stem, size[0], size[1], stat.st_size, stat.st_mtime_ns))
+
+
+# Function to resize an icon with PIL and write it to the cache, dropping stale entries
+def build_cached(path, size, target):
+    from PIL import Image
+    stem = os.path.splitext(os.path.basename(path))[0]
+    prefix = '%s-%dx%d-' % (stem, size[0], size[1])
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(prefix):
+            os.remove(os.path.join(CACHE_DIR, name))
+    temp = target + '.tmp'
+    Image.open(path).resize(size, Image.LANCZOS).save(temp, format='PNG')
+    os.replace(temp, target)
+
+
+# Load icons for buttons and resize them
+def load_icon(path, size=(16, 16)):
+    try:
+        target = cached_path(path, size)
+        if not os.path.exists(target):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            build_cached(path, size, target)
+        return tk.PhotoImage(file=target)
+    except (OSError, tk.TclError):
+        # Cache not writable or unreadable: resize in memory as before
+        from PIL import Image, ImageTk
+        return ImageTk.PhotoImage(Image.open(path).resize(size, Image.LANCZOS))
@@ -0,0 +1,357 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import chain, groupby, islice
+from columnar import insertion_points, splice
+
+# In-memory secondary indexes over the property store.
+#
+# Entries refer to rows by row id. Missing (None) values are not indexed
+# since they never satisfy a search predicate. All index kinds keep their
+# entries in typed arrays so they stay small next to the columnar store.
+
+# Fuzzy name search: results returned by default, the lowest similarity kept, and
+# how many posting entries one query may count (rarer trigrams are counted first)
+FUZZY_TOP_K = 50
+FUZZY_THRESHOLD = 0.3
+FUZZY_SCAN_BUDGET = 200000
+
+
+# Parallel sorted arrays of (value, row id) for range queries on one column
+class SortedIndex:
+    def __init__(self, column):
+        self.column = column
+        self.values = array('d')
+        self.rowids = array('q')
+
+    def build(self, rows):
+        entries = sorted((prop[self.column], rowid) for rowid, prop in rows
+                         if prop[self.column] is not None)
+        self.values = array('d', [value for value, _ in entries])
+        self.rowids = array('q', [rowid for _, rowid in entries])
+
+    # Function to build from the row ids with a value, already in (value, row id)
+    # order as a SortOrder keeps them; value(rowid) gives a row's value
+    def build_sorted(self, rowids, value):
+        self.values = array('d', map(value, rowids))
+        self.rowids = array('q', rowids)
+
+    # Function to find where (value, rowid) is or would go
+    def _position(self, value, rowid):
+        low = bisect_left(self.values, value)
+        high = bisect_right(self.values, value, low)
+        return bisect_left(self.rowids, rowid, low, high), high
+
+    def add(self, rowid, prop):
+        value = prop[self.column]
+        if value is not None:
+            i, _ = self._position(value, rowid)
+            self.values.insert(i, value)
+            self.rowids.insert(i, rowid)
+
+    # Function to add many rows at once, copying the arrays once
+    def add_many(self, rows):
+        entries = sorted((prop[self.column], rowid) for rowid, prop in rows if prop[self.column] is not None)
+        points = [self._position(value, rowid)[0] for value, rowid in entries]
+        self.values = splice(self.values, points, [value for value, _ in entries])
+        self.rowids = splice(self.rowids, points, [rowid for _, rowid in entries])
+
+    def remove(self, rowid, prop):
+        value = prop[self.column]
+        if value is not None:
+            i, high = self._position(value, rowid)
+            if i < high and self.rowids[i] == rowid:
+                del self.values[i]
+                del self.rowids[i]
+
+    def _bounds(self, low, high):
+        start = 0 if low is None else bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect_right(self.values, high)
+        return start, max(start, end)
+
+    def count(self, low, high):
+        start, end = self._bounds(low, high)
+        return end - start
+
+    def ids(self, low, high):
+        start, end = self._bounds(low, high)
+        return set(self.rowids[start:end])
+
+
+# Row ids per value for equality queries on one column. A bucket holding a
+# single row is stored as a bare int, larger buckets as a sorted array.
+class HashIndex:
+    def __init__(self, column):
+        self.column = column
+        self.buckets = {}
+
+    def _value(self, prop):
+        return prop[self.column]
+
+    def build(self, rows):
+        self.buckets = {}
+        for rowid, prop in rows:
+            self.add(rowid, prop)
+
+    # Function to build from the row ids with a value, in (value, row id) order
+    def build_sorted(self, rowids, value):
+        self.buckets = {}
+        for key, group in groupby(rowids, key=value):
+            bucket = array('q', group)
+            self.buckets[key] = bucket[0] if len(bucket) == 1 else bucket
+
+    def add(self, rowid, prop):
+        value = self._value(prop)
+        if value is None:
+            return
+        bucket = self.buckets.get(value)
+        if bucket is None:
+            self.buckets[value] = rowid
+        elif isinstance(bucket, int):
+            self.buckets[value] = array('q', sorted((bucket, rowid)))
+        else:
+            bucket.insert(bisect_left(bucket, rowid), rowid)
+
+    # Function to add many rows at once, merging each bucket once
+    def add_many(self, rows):
+        added = {}
+        for rowid, prop in rows:
+            value = self._value(prop)
+            if value is not None:
+                added.setdefault(value, []).append(rowid)
+        for value, rowids in added.items():
+            bucket = self.buckets.get(value, ())
+            bucket = array('q', sorted(chain([bucket] if isinstance(bucket, int) else bucket, rowids)))
+            self.buckets[value] = bucket[0] if len(bucket) == 1 else bucket
+
+    def remove(self, rowid, prop):
+        value = self._value(prop)
+        bucket = self.buckets.get(value)
+        if bucket is None:
+            return
+        if isinstance(bucket, int):
+            if bucket == rowid:
+                del self.buckets[value]
+            return
+        i = bisect_left(bucket, rowid)
+        if i < len(bucket) and bucket[i] == rowid:
+            del bucket[i]
+            if len(bucket) == 1:
+                self.buckets[value] = bucket[0]
+
+    def _lookup(self, value):
+        return self.buckets.get(value, ())
+
+    def count(self, value):
+        bucket = self._lookup(value)
+        return 1 if isinstance(bucket, int) else len(bucket)
+
+    def ids(self, value):
+        bucket = self._lookup(value)
+        return {bucket} if isinstance(bucket, int) else set(bucket)
+
+
+# Row ids sorted by lower-cased name, for case-insensitive name equality and
+# prefix (type-ahead) queries: a prefix is one contiguous range of the array,
+# found by bisection like a walk down a trie. No per-row key is stored.
+class NameIndex:
+    def __init__(self, names):
+        self.column = 'name'
+        self.names = names  # Name of each row id, e.g. PropertyColumns.names
+        self.rowids = array('q')
+
+    def _key(self, rowid):
+        return (self.names[rowid].lower(), rowid)
+
+    def build(self, rows):
+        self.rowids = array('q', sorted((rowid for rowid, _ in rows), key=self._key))
+
+    # Function to build from row ids already in (lower-cased name, row id) order
+    def build_sorted(self, rowids, value=None):
+        self.rowids = array('q', rowids)
+
+    def add(self, rowid, prop):
+        key = (prop['name'].lower(), rowid)
+        self.rowids.insert(bisect_left(self.rowids, key, key=self._key), rowid)
+
+    # Function to add many rows at once, copying the array once
+    def add_many(self, rows):
+        rowids = sorted((rowid for rowid, _ in rows), key=self._key)
+        points = insertion_points(self.rowids, rowids, self._key,
+                                  lambda rowids: list(map(str.lower, map(self.names.__getitem__, rowids))))
+        self.rowids = splice(self.rowids, points, rowids)
+
+    # The row's name must still be the indexed one when it is removed
+    def remove(self, rowid, prop):
+        key = (prop['name'].lower(), rowid)
+        i = bisect_left(self.rowids, key, key=self._key)
+        if i < len(self.rowids) and self.rowids[i] == rowid:
+            del self.rowids[i]
+
+    def _bounds(self, value, prefix=False):
+        value = value.lower()
+        start = bisect_left(self.rowids, value, key=lambda rowid: self.names[rowid].lower())
+        if prefix:
+            end = bisect_left(self.rowids, value + '\U0010ffff', start, key=lambda rowid: self.names[rowid].lower())
+        else:
+            end = bisect_right(self.rowids, value, start, key=lambda rowid: self.names[rowid].lower())
+        return start, end
+
+    def count(self, value, prefix=False):
+        start, end = self._bounds(value, prefix)
+        return end - start
+
+    def ids(self, value, prefix=False):
+        start, end = self._bounds(value, prefix)
+        return set(self.rowids[start:end])
+
+
+# Function to get the trigrams of a name, padded so word starts count (as in pg_trgm)
+def trigrams(text):
+    padded = '  %s ' % ' '.join(text.lower().split())
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Function to score two names from 0 to 1 by the share of trigrams they have in common
+def similarity(a, b):
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+# Function to rank (rowid, name) pairs by similarity to query, keeping the best top_k
+def rank_by_similarity(query, pairs, top_k=FUZZY_TOP_K, threshold=FUZZY_THRESHOLD):
+    query_grams = trigrams(query)
+    scored = []
+    for rowid, name in pairs:
+        grams = trigrams(name)
+        score = len(query_grams & grams) / len(query_grams | grams)
+        if score >= threshold:
+            scored.append((-score, name.lower(), rowid))
+    scored.sort()
+    return [rowid for _, _, rowid in scored[:top_k]]
+
+
+# Sorted row ids per name trigram, for fuzzy name search. Building it is costly
+# on large stores, so rows can be handed over lazily as (rowid, name) pairs and
+# indexed a batch at a time with build(); add() and remove() keep the index
+# current meanwhile and tolerate rows that are indexed twice or not yet.
+class TrigramIndex:
+    def __init__(self, pending=()):
+        self.postings = {}
+        self.pending = iter(pending)
+        self.complete = False
+
+    # Function to index up to limit pending rows (all when None); True once done
+    def build(self, limit=None):
+        if not self.complete:
+            count = 0
+            for rowid, name in islice(self.pending, limit):
+                self.add(rowid, name)
+                count += 1
+            if limit is None or count < limit:
+                self.complete = True
+                self.pending = iter(())
+        return self.complete
+
+    def add(self, rowid, name):
+        for gram in trigrams(name):
+            postings = self.postings.get(gram)
+            if postings is None:
+                self.postings[gram] = array('q', [rowid])
+                continue
+            i = bisect_left(postings, rowid)
+            if i == len(postings) or postings[i] != rowid:
+                postings.insert(i, rowid)
+
+    def remove(self, rowid, name):
+        for gram in trigrams(name):
+            postings = self.postings.get(gram)
+            if postings is None:
+                continue
+            i = bisect_left(postings, rowid)
+            if i < len(postings) and postings[i] == rowid:
+                del postings[i]
+                if not postings:
+                    del self.postings[gram]
+
+    # Function to list up to limit row ids sharing the most trigrams with query.
+    # Rare trigrams are counted first; very common ones stop the count once the
+    # scan budget is spent, since they say little about the match.
+    def candidates(self, query, limit):
+        lists = sorted((self.postings[gram] for gram in trigrams(query) if gram in self.postings), key=len)
+        counts = Counter()
+        budget = FUZZY_SCAN_BUDGET
+        for postings in lists:
+            if counts and len(postings) > budget:
+                break
+            counts.update(postings)
+            budget -= len(postings)
+        return [rowid for rowid, _ in counts.most_common(limit)]
+
+
+# All secondary indexes of a store plus the planner that picks between them
+class PropertyIndexes:
+    def __init__(self, names):
+        self.name = NameIndex(names)
+        self.bath = HashIndex('bath')
+        self.bhk = HashIndex('bhk')
+        self.price = SortedIndex('price')
+        self.total_sqft = SortedIndex('total_sqft')
+        self.all = (self.name, self.bath, self.bhk, self.price, self.total_sqft)
+
+    # Function to rebuild every index from (rowid, property) pairs
+    def build(self, rows):
+        rows = list(rows)
+        for index in self.all:
+            index.build(rows)
+
+    # Function to rebuild every index from the sort order of its column;
+    # order(column) gives (row ids with a value in order, value of a row id)
+    def build_sorted(self, order):
+        for index in self.all:
+            index.build_sorted(*order(index.column))
+
+    def add(self, rowid, prop):
+        for index in self.all:
+            index.add(rowid, prop)
+
+    # Function to add many (rowid, property) pairs, one pass over each index
+    def add_many(self, rows):
+        rows = list(rows)
+        for index in self.all:
+            index.add_many(rows)
+
+    def remove(self, rowid, prop):
+        for index in self.all:
+            index.remove(rowid, prop)
+
+    # Function to list (estimated row count, index, arguments) for every active predicate.
+    # Fuzzy name matches are ranked by the store, so they are not planned here.
+    def plan(self, criteria):
+        steps = []
+        if criteria.get('name') and criteria.get('name_match', 'exact') != 'fuzzy':
+            steps.append((self.name, (criteria['name'], criteria.get('name_match') == 'prefix')))
+        for index, key in ((self.bath, 'bath'), (self.bhk, 'bhk')):
+            if criteria.get(key) is not None:
+                steps.append((index, (criteria[key],)))
+        if criteria.get('total_sqft') is not None:
+            steps.append((self.total_sqft, (criteria['total_sqft'], criteria['total_sqft'])))
+        if criteria.get('min_price') is not None or criteria.get('max_price') is not None:
+            steps.append((self.price, (criteria.get('min_price'), criteria.get('max_price'))))
+        return sorted(((index.count(*args), index, args) for index, args in steps), key=lambda step: step[0])
+
+    # Function to find the row ids matching the criteria (in no particular order),
+    # or None when no predicate is set. Starts from the most selective predicate and
+    # intersects with the others while their candidate sets stay small; row(rowid)
+    # gives the property used to verify the survivors.
+    def search(self, criteria, matches, row):
+        steps = self.plan(criteria)
+        if not steps:
+            return None
+        count, index, args = steps[0]
+        candidates = index.ids(*args)
+        for count, index, args in steps[1:]:
+            if not candidates or count > 4 * len(candidates):
+                break
+            candidates &= index.ids(*args)
+        return [rowid for rowid in candidates if matches(row(rowid), criteria)]
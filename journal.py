@@ -0,0 +1,179 @@
+import json
+import os
+import streaming
+
+# Append-only journal for property edits.
+#
+# The snapshot file (properties.json) holds the full list as of the last
+# compaction. Every add/remove/update after that is appended to a sidecar
+# log (properties.json.log) as one JSON record per line, so the cost of an
+# edit depends on the size of the change and not on the size of the data.
+#
+# Several processes may share the files (see locking.py). Records written by
+# a BackgroundWriter carry a global sequence number 'seq', the 'origin' of
+# the writing process and, for updates and removals, the 'base' sequence
+# number of the row version the edit was made on. A log starts with a header
+# record giving its generation and the last sequence number before it.
+# Compaction bumps the generation and keeps the old log as
+# "<log>.<generation>" for a while, so other processes can finish reading it
+# instead of loading the new snapshot in full. A header marked 'partial'
+# means the snapshot holds edits that never went through the log.
+
+LOG_SUFFIX = '.log'
+
+# Fold the log back into the snapshot once it holds this many records
+COMPACT_THRESHOLD = 1000
+
+# Archived logs kept after compaction, for processes still reading them
+ARCHIVE_GENERATIONS = 2
+
+
+def log_path(filename):
+    return filename + LOG_SUFFIX
+
+
+def archive_path(filename, generation):
+    return '%s.%d' % (log_path(filename), generation)
+
+
+# Function to build the first record of a log; seq is the last sequence number
+# given out so far, so numbering carries on across generations
+def make_header(generation, seq=0, **fields):
+    return dict({'op': 'header', 'generation': generation, 'seq': seq}, **fields)
+
+
+# Function to read the header of a log, None if it has none. Together with the file
+# id it tells a log apart from an earlier one that happened to get the same inode.
+def read_header(path):
+    try:
+        with open(path, 'rb') as file:
+            line = file.readline()
+    except FileNotFoundError:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) and record.get('op') == 'header' else None
+
+
+# Function to get the generation of a log from its records (0 for logs without a header)
+def generation_of(records):
+    if records and records[0].get('op') == 'header':
+        return records[0]['generation']
+    return 0
+
+
+# Function to build one mutation record
+def make_record(op, name=None, property=None):
+    record = {'op': op}
+    if name is not None:
+        record['name'] = name
+    if property is not None:
+        record['property'] = dict(property)
+    return record
+
+
+# Function to append several mutation records with a single write, synced to disk
+def append_records(filename, records):
+    with open(log_path(filename), 'a') as file:
+        file.write(''.join(json.dumps(record) + '\n' for record in records))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+# Function to apply a single log record to a list of properties
+def apply_record(properties, record):
+    op = record.get('op')
+    if op == 'add':
+        properties.append(record['property'])
+    elif op == 'remove':
+        properties[:] = [prop for prop in properties if prop['name'] != record['name']]
+    elif op == 'update':
+        for prop in properties:
+            if prop['name'] == record['name']:
+                prop.update(record['property'])
+                break
+
+
+# Function to read the log records, dropping a torn last line left by a crash
+def read_records(filename):
+    try:
+        with open(log_path(filename), 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return []
+    records = []
+    good_offset = 0
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b'\n'):
+            break
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+        good_offset += len(line)
+    if good_offset < len(data):
+        with open(log_path(filename), 'r+b') as file:
+            file.truncate(good_offset)
+    return records
+
+
+# Function to read the complete records of a log from a byte offset on, returning
+# (records, end offset). A line another process is still writing is left for the
+# next read, and lines that cannot be parsed are skipped.
+def read_log(path, offset=0):
+    try:
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            data = file.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b'\n') + 1
+    records = []
+    for line in data[:end].splitlines():
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records, offset + end
+
+
+# Function to load the snapshot and replay the log on top of it
+def load(filename):
+    properties = []
+    try:
+        for batch in streaming.iter_properties(filename):
+            properties.extend(batch)
+    except FileNotFoundError:
+        pass
+    records = read_records(filename)
+    for record in records:
+        apply_record(properties, record)
+    if records:
+        properties.sort(key=lambda x: x['name'].lower())
+    return properties, len(records)
+
+
+# Function to start a new, empty log of the given generation
+def start_log(filename, generation, seq=0, **fields):
+    append_records(filename, [make_header(generation, seq, **fields)])
+
+
+# Function to fold the log of the given generation into a fresh snapshot, written
+# one record at a time. The log is archived and a log of the next generation is
+# started; returns that generation.
+def compact(filename, properties, generation=0, seq=0, **fields):
+    streaming.write_properties(filename, properties)
+    try:
+        os.replace(log_path(filename), archive_path(filename, generation))
+    except FileNotFoundError:
+        open(archive_path(filename, generation), 'w').close()
+    try:
+        os.remove(archive_path(filename, generation - ARCHIVE_GENERATIONS))
+    except FileNotFoundError:
+        pass
+    start_log(filename, generation + 1, seq, **fields)
+    return generation + 1
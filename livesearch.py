@@ -0,0 +1,127 @@
+import threading
+import time
+from collections.abc import Sequence
+from metrics import METRICS
+
+# Search-as-you-type on a worker thread.
+#
+# The UI submits the criteria after each (debounced) edit and polls results()
+# from its own loop, as the Tk app does for imports. Every submit() starts a
+# new generation: the worker runs only the newest query, skipping those typed
+# over before it got to them, and a query that is overtaken while it runs
+# stops at its next step and never reaches the screen.
+# A query hands back its first page of rows as soon as it has them and the
+# total count separately, since counting can take far longer (a COUNT(*) in
+# SQLite); later pages are read from the result as the table scrolls to them.
+# The store must be prepared for the query on its own thread first (see
+# prepare_search() in storage.py), and every change to the store must be
+# followed by a new submit(), as a query running across a change is stale.
+
+PAGE_SIZE = 100
+
+
+# Rows of a search as the table shows them: the first page until the total is
+# known, then every row, the others being read from the search result
+class SearchResults(Sequence):
+    def __init__(self, rows, first_page, total=None):
+        self.rows = rows  # Result sequence returned by the store's search()
+        self.first_page = first_page  # Copied, so it stays put whatever the store does
+        self.total = total
+
+    def __len__(self):
+        return len(self.first_page) if self.total is None else self.total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            rows = self.first_page[start:stop]
+            if stop > len(self.first_page):
+                rows += list(self.rows[max(start, len(self.first_page)):stop])
+            return rows
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('row index out of range')
+        return self.first_page[index] if index < len(self.first_page) else self.rows[index]
+
+
+# Worker running the newest search submitted; search(criteria) is the store's
+# (or engine's) search function
+class LiveSearch:
+    def __init__(self, search, page_size=PAGE_SIZE):
+        self.search = search
+        self.page_size = page_size
+        self.generation = 0
+        self.finished = 0  # Last generation that delivered everything or failed
+        self.pending = None  # (generation, criteria) the worker has not started yet
+        self.updates = []  # (generation, kind, value) waiting for results()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name='live-search', daemon=True)
+
+    # Function to queue a search in place of any other; returns its generation
+    def submit(self, criteria):
+        with self.condition:
+            self.generation += 1
+            self.pending = (self.generation, criteria)
+            self.updates = []
+            if not self.thread.is_alive():
+                self.thread.start()
+            self.condition.notify()
+            return self.generation
+
+    # Function to drop the current search, whether it is running or not
+    def cancel(self):
+        with self.condition:
+            self.generation += 1
+            self.finished = self.generation
+            self.pending = None
+            self.updates = []
+
+    # True until the current search has delivered its count (or failed)
+    def busy(self):
+        return self.finished != self.generation
+
+    # Function to take what the current search delivered since the last call, oldest
+    # first: ('page', SearchResults) once, then ('count', total), or ('error', exception)
+    def results(self):
+        with self.condition:
+            updates, self.updates = self.updates, []
+        return [(kind, value) for generation, kind, value in updates if generation == self.generation]
+
+    def _stale(self, generation):
+        return generation != self.generation
+
+    def _post(self, generation, kind, value):
+        with self.condition:
+            if generation == self.generation:
+                self.updates.append((generation, kind, value))
+                if kind != 'page':
+                    self.finished = generation
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                generation, criteria = self.pending
+                self.pending = None
+            try:
+                self._query(generation, criteria)
+            except Exception as error:  # Bad criteria, or the store changed under the query
+                self._post(generation, 'error', error)
+
+    def _query(self, generation, criteria):
+        started = time.perf_counter()
+        rows = self.search(criteria)
+        if self._stale(generation):
+            return
+        first_page = [dict(prop) for prop in rows[:self.page_size]]
+        METRICS.record('live_search.first_page', time.perf_counter() - started)
+        self._post(generation, 'page', SearchResults(rows, first_page))
+        if self._stale(generation):
+            return
+        total = len(rows)
+        METRICS.record('live_search.count', time.perf_counter() - started)
+        self._post(generation, 'count', total)
@@ -0,0 +1,56 @@
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Advisory lock shared by every process working on the same property file.
+#
+# The lock lives in a separate "<file>.lock" file so the data files can be
+# replaced by rename while it is held. Each use opens its own descriptor, so
+# threads of one process exclude each other as well. Only cooperating
+# programs see the lock: it guards against other instances of this app, not
+# against arbitrary editors.
+
+LOCK_SUFFIX = '.lock'
+
+
+def lock_path(filename):
+    return filename + LOCK_SUFFIX
+
+
+# Context manager holding the exclusive lock of filename while its body runs
+@contextmanager
+def locked(filename):
+    with open(lock_path(filename), 'a+') as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after about 10 seconds
+                    time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Function to identify the file at path, so a replaced file can be told apart
+def file_id(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_dev, stat.st_ino)
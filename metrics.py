@@ -0,0 +1,150 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# In-process timing metrics and opt-in profiling.
+#
+# Every instrumented operation feeds a Histogram of its call durations, kept
+# in fixed log-spaced buckets so recording is O(1) and memory stays constant
+# however long the app runs. Percentiles are interpolated from the buckets, so
+# they are only accurate to within one bucket (a factor of BUCKET_GROWTH).
+#
+# Profiling is armed on demand: the next instrumented call (one slow click,
+# say) runs under cProfile and its stats are dumped to a .prof file, with a
+# plain-text summary next to it for reading without extra tools.
+
+# Bucket upper bounds in seconds: 10 us doubling up to about 170 s, then overflow
+BUCKET_START = 1e-5
+BUCKET_GROWTH = 2.0
+BUCKET_COUNT = 25
+BUCKET_BOUNDS = [BUCKET_START * BUCKET_GROWTH ** i for i in range(BUCKET_COUNT)]
+
+PROFILE_LINES = 40
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (BUCKET_COUNT + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def record(self, seconds):
+        self.buckets[bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+        self.last = seconds
+
+    # Function to estimate a quantile (0..1) in seconds from the bucket counts,
+    # interpolating inside the bucket on a log scale
+    def quantile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = max(BUCKET_BOUNDS[i - 1] if i else 0.0, self.min)
+                upper = min(BUCKET_BOUNDS[i] if i < BUCKET_COUNT else self.max, self.max)
+                if lower <= 0 or upper <= lower:
+                    return upper
+                return lower * (upper / lower) ** ((rank - seen) / count)
+            seen += count
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'total_ms': self.total * 1000, 'mean_ms': self.total / self.count * 1000,
+                'min_ms': self.min * 1000, 'p50_ms': self.quantile(0.5) * 1000,
+                'p95_ms': self.quantile(0.95) * 1000, 'p99_ms': self.quantile(0.99) * 1000,
+                'max_ms': self.max * 1000, 'last_ms': self.last * 1000}
+
+
+# Named histograms shared by every thread of the process
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.profile_directory = None  # Set while a profile capture is armed
+        self.profiling = False
+        self.last_profile = None  # Path of the last profile written
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    # Decorator timing every call of a function under the given name
+    def timed(self, name):
+        def decorate(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.profile_directory is not None and not self.profiling:
+                    return self._profile(name, fn, args, kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    # Function to profile the next instrumented call, dumping its stats into directory
+    def arm_profile(self, directory='.'):
+        self.profile_directory = directory
+
+    def _profile(self, name, fn, args, kwargs):
+        directory, self.profile_directory = self.profile_directory, None
+        self.profiling = True
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            self.record(name, time.perf_counter() - start)
+            self.profiling = False
+            path = os.path.join(directory, 'profile-%s-%s.prof' % (name, time.strftime('%Y%m%d-%H%M%S')))
+            profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            with open(os.path.splitext(path)[0] + '.txt', 'w') as file:
+                file.write(text.getvalue())
+            self.last_profile = path
+
+    # Function to get {name: summary} for every operation recorded so far
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    # Function to write the summaries and raw bucket counts to a JSON file
+    def export(self, path):
+        with self.lock:
+            histograms = {name: dict(histogram.summary(), buckets=list(histogram.buckets))
+                          for name, histogram in sorted(self.histograms.items())}
+        report = {'started': self.started, 'exported': time.time(),
+                  'bucket_bounds_ms': [bound * 1000 for bound in BUCKET_BOUNDS], 'operations': histograms}
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.started = time.time()
+
+
+# Metrics of this process; the app, the engine and the writer thread all record here
+METRICS = Metrics()
@@ -0,0 +1,193 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+import journal
+import locking
+from metrics import METRICS
+
+# Background writer for the files behind a JsonStore.
+#
+# Mutations hand their journal records, or a snapshot of the whole list, to
+# the writer and return at once. The writer thread waits for edits to pause
+# for DEBOUNCE seconds (but never longer than MAX_DELAY) and then coalesces
+# everything queued into one write: a single journal append, or one snapshot
+# when a snapshot was queued, since it already holds every earlier edit.
+# Appends are fsynced, and snapshots go through a synced temp file renamed
+# over the old one, so a crash never leaves a half-written properties.json.
+#
+# Other instances of the app may share the files (see locking.py). Each write
+# holds the file lock and first reads what the others appended since, so its
+# records are numbered after theirs. A snapshot would silently drop records
+# of other instances that the store has not merged yet, so in that case it is
+# not written: its records are appended instead and deferred is set, and the
+# store queues a new snapshot once it has caught up.
+
+DEBOUNCE = 0.2
+MAX_DELAY = 2.0
+
+
+class BackgroundWriter:
+    def __init__(self, filename, origin=None, debounce=DEBOUNCE, max_delay=MAX_DELAY):
+        self.filename = filename
+        self.origin = origin  # Stamped on the records we write, to tell them from other instances'
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.pending = 0  # Jobs queued but not written yet
+        self.idle = threading.Condition()
+        self.error = None  # Error of the last failed write, cleared by the next good one
+        self.writes = 0
+        self.deferred = False  # Set when a snapshot was skipped, see above
+        self.folded = deque()  # Our records written only as part of a snapshot, for the store
+        # How far the log has been read: file, byte offset, generation, highest
+        # sequence number and highest one written by another instance
+        self.log_id = None
+        self.log_header = None
+        self.offset = 0
+        self.generation = 0
+        self.last_seq = 0
+        self.foreign_seq = 0
+        self.thread = threading.Thread(target=self._run, name='property-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    # Function to queue journal records for appending
+    def append(self, records):
+        self._put('append', records)
+
+    # Function to queue a full snapshot; properties is an iterable of dicts that
+    # is consumed on the writer thread, so it must not read live store data.
+    # seen_seq is the last record of the log the store has merged, and records
+    # the journal records of the edits the snapshot is written for.
+    def snapshot(self, properties, seen_seq=0, records=()):
+        self._put('snapshot', (properties, seen_seq, list(records)))
+
+    def _put(self, kind, payload):
+        with self.idle:
+            self.pending += 1
+        self.queue.put((kind, payload))
+
+    # True while queued changes have not reached the disk
+    def dirty(self):
+        return self.pending > 0 or self.error is not None
+
+    # Function to write everything queued right away and wait until it is on disk
+    def flush(self):
+        with self.idle:
+            if self.pending:
+                self.queue.put(('flush', None))
+            while self.pending:
+                self.idle.wait()
+
+    def _run(self):
+        while True:
+            jobs = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while jobs[-1][0] != 'flush':
+                timeout = min(self.debounce, deadline - time.monotonic())
+                if timeout <= 0:
+                    break
+                try:
+                    jobs.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write([job for job in jobs if job[0] != 'flush'])
+
+    def _write(self, jobs):
+        last = max((i for i, (kind, _) in enumerate(jobs) if kind == 'snapshot'), default=None)
+        records = []
+        try:
+            with locking.locked(self.filename):
+                self._catch_up()
+                for i, (kind, payload) in enumerate(jobs):
+                    if kind == 'append':
+                        records.extend(payload)
+                        continue
+                    properties, seen_seq, folded = payload
+                    records.extend(folded)
+                    if i != last:
+                        continue
+                    if self.foreign_seq > seen_seq:
+                        self.deferred = True
+                        continue
+                    # The snapshot already holds every edit queued before it. They are
+                    # still logged when few, so other instances can merge them instead
+                    # of reloading the new snapshot.
+                    if len(records) <= journal.COMPACT_THRESHOLD:
+                        self._append(records)
+                    else:
+                        self._number(records)
+                        self.folded.extend(records)
+                    self._compact(properties, partial=len(records) > journal.COMPACT_THRESHOLD)
+                    records = []
+                self._append(records)
+        except Exception as error:  # Keep the thread alive so flush() never waits forever
+            self.error = error
+            # Records that did not make it are covered by the snapshot the store writes next
+            for kind, payload in jobs:
+                for record in payload if kind == 'append' else payload[2]:
+                    record.setdefault('seq', 0)
+        else:
+            self.error = None
+            self.writes += 1
+        with self.idle:
+            self.pending -= len(jobs)
+            self.idle.notify_all()
+
+    # Function to read what was appended since our last look at the log (lock held)
+    def _catch_up(self):
+        path = journal.log_path(self.filename)
+        log_id = locking.file_id(path)
+        header = journal.read_header(path)
+        if (log_id, header) != (self.log_id, self.log_header):  # Replaced by a compaction, or removed
+            self.log_id, self.log_header, self.offset = log_id, header, 0
+        if log_id is None:
+            self.generation = 0
+            return
+        records, end = journal.read_log(path, self.offset)
+        if self.offset == 0:
+            self.generation = journal.generation_of(records)
+        for record in records:
+            seq = record.get('seq', 0)
+            self.last_seq = max(self.last_seq, seq)
+            if record.get('origin') != self.origin:
+                self.foreign_seq = max(self.foreign_seq, seq)
+        if end < os.path.getsize(path):  # Torn line left by a crashed writer
+            with open(path, 'r+b') as file:
+                file.truncate(end)
+        self.offset = end
+
+    # Function to stamp records with their sequence number and our origin
+    def _number(self, records):
+        for record in records:
+            self.last_seq += 1
+            record['seq'] = self.last_seq
+            record['origin'] = self.origin
+
+    # Function to number and append records (lock held)
+    def _append(self, records):
+        if not records:
+            return
+        if self.log_id is None:
+            journal.start_log(self.filename, self.generation, self.last_seq, origin=self.origin)
+            self._catch_up()
+        self._number(records)
+        began = time.perf_counter()
+        journal.append_records(self.filename, records)
+        METRICS.record('writer.journal', time.perf_counter() - began)
+        self._catch_up()
+
+    # Function to write a snapshot and rotate the log (lock held). A partial log
+    # lacks records of edits the snapshot holds, so readers must reload it.
+    def _compact(self, properties, partial):
+        header = {'origin': self.origin}
+        if partial:
+            header['partial'] = True
+        began = time.perf_counter()
+        journal.compact(self.filename, properties, self.generation, self.last_seq, **header)
+        METRICS.record('writer.snapshot', time.perf_counter() - began)
+        self.deferred = False
+        self._catch_up()
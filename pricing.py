@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import random
+import threading
+from collections import OrderedDict
+
+# Price model helpers shared by the GUI and the benchmarks.
+#
+# The app scores prices with LinearPriceModel, the regression's intercept and
+# coefficients read from a small JSON file (MODEL_FILENAME). That file is
+# exported once from the scikit-learn model it was trained as:
+#
+#   python pricing.py export [--estimator linear_regression_model.pkl] [--model linear_regression_model.json]
+#   python pricing.py check  [--estimator ...] [--model ...] [--rows N]
+#
+# Both compare the model file with the scikit-learn model on random rows
+# afterwards (see check_parity()) and exit with status 1 if they disagree.
+# One price is scored in plain Python and a batch with numpy, in the same
+# order of operations, so both give the same result to the last bit.
+# joblib and sklearn are imported only to read a pickle, and numpy only inside
+# the functions that need it, so importing this module costs nothing at GUI startup.
+
+MODEL_FILENAME = 'linear_regression_model.json'
+
+# The scikit-learn model the JSON file is exported from
+ESTIMATOR_FILENAME = 'linear_regression_model.pkl'
+
+# Model file format, and the newest version of it this code reads
+MODEL_FORMAT = 'linear-price-model'
+MODEL_FORMAT_VERSION = 1
+
+# Model inputs, in the order the regression was trained on
+FEATURES = ('total_sqft', 'bath', 'bhk')
+
+# Largest difference allowed between an exported price and scikit-learn's, relative to the price
+PARITY_TOLERANCE = 1e-9
+
+
+# Linear price model with the scikit-learn predict() interface. A price is
+# computed as ((c0*x0 + c1*x1) + c2*x2) + intercept, in that order, by both
+# predict_one() and predict(), so one row and a batch agree exactly. It is
+# never changed once made, so a front end can swap models with one assignment.
+class LinearPriceModel:
+    def __init__(self, intercept, coefficients, version=0, **info):
+        self.intercept_ = float(intercept)
+        self.coef_ = [float(value) for value in coefficients]
+        if len(self.coef_) != len(FEATURES):
+            raise ValueError('expected %d coefficients, got %d' % (len(FEATURES), len(self.coef_)))
+        self.n_features_in_ = len(FEATURES)
+        self.version = version
+        self.info = info  # Where it came from and how well it did: see training.ModelTrainer.fit()
+
+    # Function to score one row of FEATURES values, without numpy
+    def predict_one(self, *values):
+        price = 0.0
+        for coefficient, value in zip(self.coef_, values):
+            price += coefficient * value
+        return price + self.intercept_
+
+    def predict(self, X):
+        import numpy as np
+        X = np.asarray(X, dtype=float).reshape(-1, self.n_features_in_)
+        prices = np.zeros(len(X))
+        for i, coefficient in enumerate(self.coef_):
+            prices += coefficient * X[:, i]
+        return prices + self.intercept_
+
+
+# Function to load a scikit-learn model from a pickle
+def load_estimator(path=ESTIMATOR_FILENAME):
+    import joblib
+    return joblib.load(path)
+
+
+# Function to take the coefficients out of a fitted scikit-learn linear model,
+# in FEATURES order whatever order it was trained in
+def from_estimator(estimator, **info):
+    names = [str(name) for name in getattr(estimator, 'feature_names_in_', FEATURES)]
+    if sorted(names) != sorted(FEATURES):
+        raise ValueError('the model was trained on %s, not %s' % (', '.join(names), ', '.join(FEATURES)))
+    coefficients = [float(value) for value in estimator.coef_]
+    return LinearPriceModel(float(estimator.intercept_), [coefficients[names.index(feature)] for feature in FEATURES],
+                            **info)
+
+
+# Function to read a model file written by export_model()
+def read_model(path=MODEL_FILENAME):
+    with open(path) as file:
+        document = json.load(file)
+    if document.get('format') != MODEL_FORMAT:
+        raise ValueError('%s is not a %s file' % (path, MODEL_FORMAT))
+    if document.get('format_version', 0) > MODEL_FORMAT_VERSION:
+        raise ValueError('%s needs a newer version of this program' % path)
+    if tuple(document['features']) != FEATURES:
+        raise ValueError('%s scores %s, not %s' % (path, ', '.join(document['features']), ', '.join(FEATURES)))
+    return LinearPriceModel(document['intercept'], document['coefficients'], source=document.get('source'))
+
+
+# Function to export a scikit-learn model to a model file, replacing it atomically.
+# Floats are written with repr(), so they read back exactly.
+def export_model(estimator_path=ESTIMATOR_FILENAME, path=MODEL_FILENAME):
+    model = from_estimator(load_estimator(estimator_path))
+    document = {'format': MODEL_FORMAT, 'format_version': MODEL_FORMAT_VERSION, 'features': list(FEATURES),
+                'intercept': model.intercept_, 'coefficients': model.coef_,
+                'source': os.path.basename(estimator_path)}
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(document, file, indent=2)
+        file.write('\n')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return model
+
+
+# Function to load the prediction model: a model file, or a scikit-learn pickle
+# (.pkl) converted on the fly
+def load_model(path=MODEL_FILENAME):
+    if os.path.splitext(path)[1].lower() == '.pkl':
+        return from_estimator(load_estimator(path), source=os.path.basename(path))
+    return read_model(path)
+
+
+# Function to load the model on a background thread.
+# on_done(model, error) is called from that thread when loading finishes.
+def load_model_async(on_done, path=MODEL_FILENAME):
+    def run():
+        try:
+            model = load_model(path)
+        except Exception as error:
+            on_done(None, error)
+        else:
+            on_done(model, None)
+    thread = threading.Thread(target=run, name='model-loader', daemon=True)
+    thread.start()
+    return thread
+
+
+# Bounded LRU cache of predictions keyed on the normalized feature tuple.
+# The cache remembers which model object filled it and clears itself when
+# asked about a different one, so loading a new model file invalidates it.
+class PredictionCache:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.model = None
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, model):
+        if model is not self.model:
+            self.clear()
+            self.model = model
+
+    def get(self, key):
+        price = self.entries.get(key)
+        if price is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return price
+
+    def put(self, key, price):
+        self.entries[key] = price
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+# Function to normalize model inputs into a cache key (raises ValueError/TypeError)
+def feature_key(total_sqft, bath, bhk):
+    return (float(total_sqft), float(bath), int(bhk))
+
+
+# Function to round a price to two decimals exactly as numpy.round(prices, 2) does
+def round_price(price):
+    return round(price * 100) / 100
+
+
+# Function to predict the rounded price of one property, using the cache when given
+def predict_price(model, total_sqft, bath, bhk, cache=None):
+    key = feature_key(total_sqft, bath, bhk)
+    if cache is not None:
+        cache.bind(model)
+        price = cache.get(key)
+        if price is not None:
+            return price
+    price = round_price(model.predict_one(*key))
+    if cache is not None:
+        cache.put(key, price)
+    return price
+
+
+# Function to build the feature matrix for a list of properties.
+# Missing values become NaN and the returned mask marks the complete rows.
+def feature_matrix(properties):
+    import numpy as np
+    X = np.array([[prop.get(feature) for feature in FEATURES] for prop in properties], dtype=float)
+    X = X.reshape(len(properties), len(FEATURES))
+    mask = ~np.isnan(X).any(axis=1)
+    return X, mask
+
+
+# Function to predict prices for many properties with a single model call.
+# Returns one rounded price per property, or None where a feature is missing.
+# With a cache, only the distinct feature tuples not already cached reach the model.
+def predict_prices(model, properties, cache=None):
+    import numpy as np
+    X, mask = feature_matrix(properties)
+    if cache is None:
+        prices = np.full(len(properties), np.nan)
+        if mask.any():
+            prices[mask] = model.predict(X[mask])
+        prices = np.round(prices, 2)
+        return [None if missing else price for price, missing in zip(prices.tolist(), ~mask)]
+
+    cache.bind(model)
+    keys = [(row[0], row[1], int(row[2])) if complete else None
+            for row, complete in zip(X.tolist(), mask.tolist())]
+    found = {}
+    for key in keys:
+        if key is not None and key not in found:
+            found[key] = cache.get(key)
+    missing = [key for key, price in found.items() if price is None]
+    if missing:
+        predicted = np.round(model.predict(np.array(missing, dtype=float)), 2).tolist()
+        for key, price in zip(missing, predicted):
+            found[key] = price
+            cache.put(key, price)
+    return [None if key is None else found[key] for key in keys]
+
+
+# Function to compare a model file with the scikit-learn model it was exported from,
+# on random rows and a few extreme ones, and its single-row scoring with its batches.
+# Returns the problems found, an empty list when everything agrees.
+def check_parity(estimator_path=ESTIMATOR_FILENAME, path=MODEL_FILENAME, rows=10000, seed=42):
+    import warnings
+    import numpy as np
+    estimator, model = load_estimator(estimator_path), read_model(path)
+    rng = random.Random(seed)
+    X = [[rng.uniform(100, 20000), float(rng.randint(1, 10)), rng.randint(1, 12)] for _ in range(rows)]
+    X += [[0.0, 0.0, 0], [1.0, 1.0, 1], [1e7, 50.0, 40]]
+    with warnings.catch_warnings():  # It was fitted on a DataFrame and warns about plain arrays
+        warnings.simplefilter('ignore', UserWarning)
+        expected = estimator.predict(np.array(X, dtype=float))
+    batch = model.predict(X)
+    problems = []
+    error = float(np.max(np.abs(batch - expected) / np.maximum(np.abs(expected), 1.0)))
+    if error > PARITY_TOLERANCE:
+        problems.append('prices differ from scikit-learn by up to %.3g of the price' % error)
+    differing = int(np.count_nonzero(np.round(batch, 2) != np.round(expected, 2)))
+    if differing:
+        problems.append('%d of %d rounded prices differ from scikit-learn' % (differing, len(X)))
+    if [model.predict_one(*row) for row in X] != batch.tolist():
+        problems.append('single-row scores differ from batch scores')
+    if [predict_price(model, *row) for row in X] != predict_prices(model, [dict(zip(FEATURES, row)) for row in X]):
+        problems.append('predict_price() differs from predict_prices()')
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the price model from scikit-learn, or check an export.')
+    parser.add_argument('command', choices=('export', 'check'))
+    parser.add_argument('--estimator', default=ESTIMATOR_FILENAME, help='scikit-learn model pickle')
+    parser.add_argument('--model', default=MODEL_FILENAME, help='model file to write or check')
+    parser.add_argument('--rows', type=int, default=10000, help='random rows to compare')
+    args = parser.parse_args()
+    if args.command == 'export':
+        model = export_model(args.estimator, args.model)
+        print('Wrote %s: intercept %r, coefficients %r' % (args.model, model.intercept_, model.coef_))
+    problems = check_parity(args.estimator, args.model, args.rows)
+    for problem in problems:
+        print('Parity check failed: %s' % problem)
+    if not problems:
+        print('%s matches %s on %d rows' % (args.model, args.estimator, args.rows))
+    raise SystemExit(1 if problems else 0)
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from urllib.parse import parse_qsl, unquote, urlsplit
+import pricing
+import storage
+from storage import DuplicateName
+from engine import ModelNotLoaded, PropertyEngine, parse_criteria, parse_features
+from metrics import METRICS
+
+# HTTP/JSON service over a PropertyEngine, built on asyncio streams only.
+#
+#   GET    /properties?name=&name_match=exact|prefix|fuzzy&top_k=&total_sqft=&bath=
+#                      &min_price=&max_price=&bhk=&offset=&limit=
+#   GET    /properties/<name>
+#   POST   /properties                 body: property object
+#   PATCH  /properties/<name>          body: fields to change
+#   DELETE /properties/<name>
+#   POST   /predict                    body: {"total_sqft", "bath", "bhk"}
+#   POST   /reprice                    body: {"names": [...]} or {} for every property
+#   POST   /save
+#   GET    /metrics                    timing histograms of requests and engine calls
+#   GET    /conflicts                  latest clashes with edits made by other instances
+#   GET    /stats?<search fields>      price figures overall and per bhk and bath, of the
+#                                      properties matching the search fields (all by default)
+#   GET    /model                      version in use, every version and its fit quality
+#   POST   /model                      body: {"version": n} to use that version, and/or
+#                                      {"learning": true|false}
+#   POST   /retrain                    fit a new version from the listings now
+#
+# All requests are handled on the event loop thread, which owns the engine, so
+# reads run without any lock and always see a consistent store. Writes take
+# write_lock: they are serialized with each other, and a reprice keeps it
+# while the model runs in a worker thread, so no other write can slip in
+# between its predictions and the update. Edits other instances make to the
+# same file are merged in between requests by a periodic sync, also under
+# write_lock. With learning on, the same loop refits the price model once the
+# listings have changed (see PropertyEngine.refresh_model()).
+#
+# Usage: python server.py [--host HOST] [--port PORT] [--no-learning]
+
+DEFAULT_PORT = 8000
+PAGE_SIZE = 100
+MAX_BODY = 1 << 20
+SYNC_INTERVAL = 0.5
+MAX_CONFLICTS = 100
+
+# First path segments of the routes above; request timings are recorded per route
+RESOURCES = ('properties', 'predict', 'reprice', 'save', 'metrics', 'conflicts', 'stats', 'model', 'retrain')
+
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class PropertyServer:
+    def __init__(self, engine):
+        self.engine = engine
+        self.write_lock = asyncio.Lock()
+        self.conflicts = deque(maxlen=MAX_CONFLICTS)  # Latest sync conflicts, served by GET /conflicts
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, payload = 413, {'error': 'request body too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    start = time.perf_counter()
+                    status, payload = await self.dispatch(method, target, body)
+                    self.record_timing(method, target, time.perf_counter() - start)
+                    keep_alive = (headers.get('connection', '').lower() != 'close'
+                                  and version == 'HTTP/1.1')
+                data = json.dumps(payload).encode()
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                              'Content-Length: %d\r\nConnection: %s\r\n\r\n'
+                              % (status, REASONS[status], len(data), 'keep-alive' if keep_alive else 'close')
+                              ).encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # Function to route one request, returning (status, JSON payload)
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        try:
+            data = json.loads(body) if body else {}
+            if not isinstance(data, dict):
+                raise ValueError('expected a JSON object')
+            if parts[0] == 'properties' and len(parts) == 1:
+                if method == 'GET':
+                    return 200, self.list_properties(dict(parse_qsl(url.query)))
+                if method == 'POST':
+                    async with self.write_lock:
+                        return 201, self.engine.add(data)
+            elif parts[0] == 'properties' and len(parts) == 2:
+                if method == 'GET':
+                    prop = self.engine.find(parts[1])
+                    if prop is None:
+                        raise KeyError(parts[1])
+                    return 200, dict(prop)
+                if method == 'PATCH':
+                    async with self.write_lock:
+                        return 200, self.engine.update(parts[1], data)
+                if method == 'DELETE':
+                    async with self.write_lock:
+                        self.engine.remove(parts[1])
+                    return 200, {'removed': parts[1]}
+            elif parts == ['predict'] and method == 'POST':
+                return 200, {'price': self.engine.predict_price(*parse_features(data))}
+            elif parts == ['reprice'] and method == 'POST':
+                return 200, await self.reprice(data.get('names'))
+            elif parts == ['metrics'] and method == 'GET':
+                return 200, METRICS.summary()
+            elif parts == ['conflicts'] and method == 'GET':
+                return 200, {'conflicts': list(self.conflicts)}
+            elif parts == ['stats'] and method == 'GET':
+                return 200, self.statistics(dict(parse_qsl(url.query)))
+            elif parts == ['model'] and method == 'GET':
+                return 200, self.engine.model_info()
+            elif parts == ['model'] and method == 'POST':
+                return 200, self.select_model(data)
+            elif parts == ['retrain'] and method == 'POST':
+                if self.engine.retrain() is None:
+                    raise HttpError(409, 'too few priced listings to fit a model')
+                return 200, self.engine.model_info()
+            elif parts == ['save'] and method == 'POST':
+                async with self.write_lock:
+                    self.engine.save()
+                return 200, {'saved': True}
+            else:
+                raise HttpError(404, 'no such resource: %s' % url.path)
+            raise HttpError(405, 'method %s not allowed on %s' % (method, url.path))
+        except HttpError as error:
+            return error.status, {'error': str(error)}
+        except KeyError as error:
+            return 404, {'error': 'no property named %s' % error.args[0]}
+        except DuplicateName as error:
+            return 409, {'error': str(error)}
+        except ModelNotLoaded as error:
+            return 503, {'error': 'prediction model not available: %s' % error}
+        except (TypeError, ValueError) as error:
+            return 400, {'error': str(error)}
+
+    # Function to record a request's duration under its route, e.g. "http.GET /properties/<name>"
+    def record_timing(self, method, target, seconds):
+        parts = urlsplit(target).path.strip('/').split('/')
+        if parts[0] in RESOURCES:
+            route = '/' + parts[0] + ('/<name>' if len(parts) > 1 else '')
+            METRICS.record('http.%s %s' % (method, route), seconds)
+
+    def list_properties(self, query):
+        offset = max(0, int(query.pop('offset', 0)))
+        limit = min(int(query.pop('limit', PAGE_SIZE)), 10 * PAGE_SIZE)
+        rows = self.engine.search(parse_criteria(query))
+        return {'total': len(rows), 'offset': offset,
+                'properties': [dict(prop) for prop in rows[offset:offset + limit]]}
+
+    # Function to get the running figures, or those of a search when a field is set
+    def statistics(self, query):
+        criteria = parse_criteria(query)
+        if criteria['name'] or any(value is not None for key, value in criteria.items()
+                                   if key not in ('name', 'name_match')):
+            return self.engine.summarize(self.engine.search(criteria)).summary()
+        return self.engine.statistics().summary()
+
+    # Function to switch model version and/or learning, as POST /model asks
+    def select_model(self, data):
+        if 'version' in data:
+            if not isinstance(data['version'], int):
+                raise ValueError('version must be an integer')
+            self.engine.use_version(data['version'])
+        if 'learning' in data:
+            self.engine.learning = bool(data['learning'])
+        return self.engine.model_info()
+
+    async def reprice(self, names):
+        async with self.write_lock:
+            if names is None:
+                props = [dict(prop) for prop in self.engine.all()]
+            else:
+                props = [dict(prop) for prop in map(self.engine.find, names) if prop is not None]
+            # The prediction cache belongs to the loop thread, so the worker runs uncached
+            prices = await asyncio.get_running_loop().run_in_executor(
+                None, pricing.predict_prices, self.engine.require_model(), props)
+            repriced = self.engine.apply_prices([prop['name'] for prop in props], prices)
+        return {'repriced': repriced, 'skipped': len(props) - repriced}
+
+    # Function to pick up edits other instances made to the same file, and refit the
+    # model after any change, every SYNC_INTERVAL seconds
+    async def sync_forever(self):
+        while True:
+            await asyncio.sleep(SYNC_INTERVAL)
+            async with self.write_lock:
+                conflicts = self.engine.store.sync()
+            self.conflicts.extend(conflicts)
+            for conflict in conflicts:
+                print('Sync conflict: %s' % conflict['message'])
+            self.engine.refresh_model()
+
+
+async def serve(engine, host='127.0.0.1', port=DEFAULT_PORT):
+    server = PropertyServer(engine)
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print('Serving properties on http://%s:%d' % (host, port))
+    sync_task = asyncio.create_task(server.sync_forever())
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        sync_task.cancel()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the property inventory over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--file', default='properties.json')
+    parser.add_argument('--store', default=os.environ.get('PROPERTY_STORE', 'json'), choices=storage.BACKENDS)
+    parser.add_argument('--no-learning', action='store_true', help='keep the model until POST /retrain')
+    args = parser.parse_args()
+    engine = PropertyEngine(storage.open_store(args.store, args.file))
+    engine.learning = not args.no_learning
+    engine.load()
+    engine.load_model_async()
+    try:
+        asyncio.run(serve(engine, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
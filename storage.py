@@ -0,0 +1,1646 @@
+import os
+import sqlite3
+import threading
+import uuid
+from array import array
+from collections import deque
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+import binfile
+import journal
+import locking
+import streaming
+from persistence import BackgroundWriter
+from history import BULK_THRESHOLD, LOAD_CHECKPOINT, History, set_operations
+from analytics import STAT_COLUMNS, PortfolioStats, column_arrays, tuple_arrays
+from columnar import COLUMNS, PropertyColumns, PropertyRow, RowSequence, SortOrder
+from indexes import FUZZY_TOP_K, PropertyIndexes, TrigramIndex, rank_by_similarity
+from training import RegressionStats
+
+# Storage backends for the property list.
+#
+# Every backend exposes the same small interface used by the GUI:
+#   load(), load_iter(), all(), sort(column, descending), prepare_fuzzy_search(limit),
+#   prepare_search(criteria), get(name), search(criteria), add(property),
+#   add_many(properties), remove(name), remove_many(names), update(name, property),
+#   update_many(changes), reset(), undo(), redo(), checkpoint(name), restore(name),
+#   statistics(), training_stats(), unbuilt_parts(columns, criteria), build_job(part),
+#   install_part(built), sync(), save(), flush(), unsaved_changes(), close()
+# plus subscribe(listener) for change events. Listeners are called as
+# listener(kind, position, property) right after each change, with kind one of
+# 'inserted', 'deleted', 'updated' or 'reset' (anything may have changed) and
+# position the row's index in the sequence returned by all() (None when the
+# backend cannot tell cheaply).
+# all() and search() return a sequence of property mappings in the store's current
+# sort order; it supports len(), indexing and slicing, which is all the table needs.
+# Names are unique: add() and renames raise DuplicateName for a name in use.
+# statistics() and training_stats() return the store's running aggregates (see
+# AGGREGATES), computed on first use and then kept current by every change; bulk
+# changes have them recomputed on next use.
+# Search criteria may set name_match to 'exact' (the default), 'prefix' or 'fuzzy';
+# fuzzy results are ranked by name similarity instead of the sort order and capped
+# at top_k (FUZZY_TOP_K by default).
+# Stores belong to the thread that opened them, with one exception: once
+# prepare_search(criteria) ran on that thread, search(criteria) and the len()
+# and slices of its result are read-only and may run on another thread (see
+# livesearch.py). A change made meanwhile can make such a result wrong or
+# make it raise, so it is only good until the next change event.
+# The sort orders and search indexes built on first use are the other way to
+# use a second thread: unbuilt_parts(columns, criteria) lists those that
+# sorting on columns and prepare_search(criteria) still need, build_job(part)
+# returns a function that builds one from any thread, and install_part(built)
+# puts its result in place back on the owner thread, or drops it (returning
+# False) if the rows changed meanwhile. SqliteStore has nothing to build.
+# Every mutation is recorded in the store's History (see history.py): undo() and
+# redo() step through it, checkpoint(name) names the current version for
+# restore(name), and reset() restores the checkpoint taken at load.
+# Several instances of the app may open the same file. sync() takes in the
+# changes the others made since the last call, firing the usual change events,
+# and returns the conflicts found as dicts with name, field, mine, theirs and
+# a message for the user. Call it periodically; it is cheap when nothing changed.
+
+
+# Loads started over when another instance compacts the file while it is read;
+# the last attempt reads it under the file lock
+LOAD_ATTEMPTS = 3
+
+# Share of a binary file taken by deleted rows or replaced names above which saving compacts it
+COMPACT_GARBAGE = 0.25
+
+# Rows sorted per call when a sort order is built by build_job(); each call holds
+# the GIL, so this bounds how long the owner thread waits for it
+SORT_CHUNK = 16384
+
+# Running aggregates of the rows: each has add(prop) and remove(prop), called
+# around every change, and build(arrays) taking analytics.column_arrays() output
+AGGREGATES = {'portfolio': PortfolioStats, 'regression': RegressionStats}
+
+
+# Function to compute every aggregate from the columns of all rows
+def build_aggregates(arrays):
+    return {name: aggregate().build(arrays) for name, aggregate in AGGREGATES.items()}
+
+
+class DuplicateName(ValueError):
+    pass
+
+
+# Function to check one property against the search form criteria
+def matches(prop, criteria):
+    name = criteria.get('name')
+    total_sqft = criteria.get('total_sqft')
+    bath = criteria.get('bath')
+    min_price = criteria.get('min_price')
+    max_price = criteria.get('max_price')
+    bhk = criteria.get('bhk')
+    if name and criteria.get('name_match') == 'prefix':
+        name_ok = prop['name'].lower().startswith(name.lower())
+    else:
+        name_ok = not name or prop['name'].lower() == name.lower()
+    return (name_ok and
+            (total_sqft is None or (prop['total_sqft'] is not None and prop['total_sqft'] == total_sqft)) and
+            (bath is None or (prop['bath'] is not None and prop['bath'] == bath)) and
+            (min_price is None or (prop['price'] is not None and prop['price'] >= min_price)) and
+            (max_price is None or (prop['price'] is not None and prop['price'] <= max_price)) and
+            (bhk is None or (prop['bhk'] is not None and prop['bhk'] == bhk)))
+
+
+# Base class handling change listeners and the undo history. Subclasses record
+# each mutation in self.history; undoing replays the inverse operations through
+# the regular mutations, so indexes, events and persistence need no special case.
+class ObservableStore:
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def _notify(self, kind, position=None, property=None):
+        for listener in self.listeners:
+            listener(kind, position, property)
+
+    def undo(self):
+        self._apply_history(self.history.undo())
+
+    def redo(self):
+        self._apply_history(self.history.redo())
+
+    # Name the current version so restore() can return to it
+    def checkpoint(self, name):
+        self.history.checkpoint(name)
+
+    # Return to a checkpoint; the changes undone on the way can be redone
+    def restore(self, name):
+        self._apply_history(self.history.restore(name))
+
+    # Return to the state at load
+    def reset(self):
+        self.restore(LOAD_CHECKPOINT)
+
+    # Function to apply history operations without recording them again; long
+    # runs go through the bulk methods
+    def _apply_history(self, operations):
+        self.history.replaying = True
+        try:
+            for operation in operations:
+                kind = operation[0]
+                if kind == 'add':
+                    if len(operation[1]) > BULK_THRESHOLD:
+                        self.add_many(operation[1])
+                    else:
+                        for prop in operation[1]:
+                            self.add(prop)
+                elif kind == 'remove':
+                    if len(operation[1]) > BULK_THRESHOLD:
+                        self.remove_many(operation[1])
+                    else:
+                        for name in operation[1]:
+                            self.remove(name)
+                elif kind == 'update':
+                    self.update(operation[1], operation[2])
+                else:
+                    names, values = operation[1], operation[2]
+                    changes = [(name, {column: values[column][i] for column in values})
+                               for i, name in enumerate(names)]
+                    if len(changes) > BULK_THRESHOLD and 'name' not in values:
+                        self.update_many(changes)
+                    else:
+                        for name, property in changes:
+                            self.update(name, property)
+        finally:
+            self.history.replaying = False
+
+
+# Journal records of one of our mutations, kept so sync() can tell which fields
+# we wrote and whether they were already in the log when another instance wrote
+class OwnBatch:
+    def __init__(self, records):
+        self.records = records
+        self.by_name = None  # Name -> records, built on first lookup
+
+    # Function to get the records touching a name (as old or new name), newest first
+    def touching(self, name):
+        if self.by_name is None:
+            self.by_name = {}
+            for record in reversed(self.records):
+                names = {record.get('name'), record.get('property', {}).get('name')}
+                for touched in names - {None}:
+                    self.by_name.setdefault(touched, []).append(record)
+        return self.by_name.get(name, ())
+
+    # Sequence number of the last record, None until the writer got to it
+    def last_seq(self):
+        return self.records[-1].get('seq')
+
+
+# Function to get the name given to a row whose own name is taken: "name (2)", "name (3)"...
+def free_name(name, taken):
+    number = 2
+    while '%s (%d)' % (name, number) in taken:
+        number += 1
+    return '%s (%d)' % (name, number)
+
+
+# Function to tell whether a record renames, adds or removes a row
+def changes_names(record):
+    return record['op'] != 'update' or record['property'].get('name', record['name']) != record['name']
+
+
+# Properties kept in memory in a columnar store, persisted as a JSON snapshot
+# plus an append-only journal. all() is a live view over the display order.
+# Writes go through a BackgroundWriter, so mutations return before the disk is touched;
+# a store opened with no filename lives in memory only and has no writer.
+# One SortOrder per column is cached once used and kept up to date on every
+# insert, delete and update, so switching or reversing the sort costs nothing.
+# Edits of other instances are merged field by field in sync(): fields we did
+# not touch take their values, and a field both sides changed ends up with the
+# edit that comes last in the log, as it would on a reload. Clashes over names
+# (a name added twice, a row renamed or removed under our unwritten edits) are
+# settled by reloading the file instead.
+class JsonStore(ObservableStore):
+    def __init__(self, filename):
+        self.filename = filename
+        self.columns = PropertyColumns()
+        self.sort_orders = {}  # Column -> SortOrder, built on first use
+        self.by_name = {}  # Name -> row id, the primary key
+        self.fuzzy = None  # TrigramIndex over names, created on first use
+        self.aggregates = None  # Name -> running aggregate (see AGGREGATES), built on first use
+        self.links = 0  # Bumped by _link() and _unlink(), so a background build can tell it is stale
+        self.load_errors = []
+        self.loading_rows = None  # Row ids read so far while load_iter() runs
+        self.history = History()
+        self.sort_column = 'name'
+        self.sort_descending = False
+        self.indexes = PropertyIndexes(self.columns.names)
+        self.listeners = []
+        self.journal_records = 0  # Records in the journal since the last compaction
+        self.snapshot_stale = False  # Set when the journal no longer describes the list (e.g. after a reset)
+        self.origin = uuid.uuid4().hex  # Tells our journal records from those of other instances
+        self.syncing = False  # Set while sync() applies the edits of other instances
+        # How far the log has been merged: file, byte offset, generation, the
+        # sequence number the snapshot is current to and the last one merged
+        self.log_id = None
+        self.log_header = None
+        self.log_offset = 0
+        self.generation = 0
+        self.snapshot_seq = 0
+        self.seen_seq = 0
+        self.versions = {}  # Name -> sequence number of the last edit of another instance merged
+        self.own = deque()  # OwnBatch of each recent mutation, oldest first
+        self.writer = None if filename is None else BackgroundWriter(filename, self.origin)
+
+    def load(self):
+        for _ in self.load_iter():
+            pass
+
+    # Load the snapshot in batches, yielding the number of rows read so far so the
+    # caller can fill the table progressively, then replay the journal on top.
+    # While loading, all() lists the rows in file order.
+    # Invalid snapshot records are skipped and listed in load_errors.
+    def load_iter(self, batch_size=streaming.BATCH_SIZE):
+        if self.writer is not None:
+            self.writer.flush()
+            self.writer.folded.clear()
+        for attempt in range(LOAD_ATTEMPTS):
+            if attempt == LOAD_ATTEMPTS - 1:
+                with self._locked():
+                    for _ in self._read_snapshot(batch_size):
+                        pass
+                    records = self._read_log()
+                yield len(self.loading_rows)
+                break
+            snapshot_id = locking.file_id(self.filename)
+            yield from self._read_snapshot(batch_size)
+            with self._locked():
+                # A log started after the snapshot we read does not go with it
+                if locking.file_id(self.filename) == snapshot_id:
+                    records = self._read_log()
+                    break
+        self.journal_records = len(records)
+        self._replay(records)
+        self.loading_rows = None
+        self._index_names()
+        self.reindex()
+        self.history.clear()
+
+    def _locked(self):
+        return nullcontext() if self.filename is None else locking.locked(self.filename)
+
+    def _read_snapshot(self, batch_size):
+        self.columns = PropertyColumns()
+        self.sort_orders = {}
+        self.fuzzy = None
+        self.loading_rows = array('q')
+        self.load_errors = []
+        self.reindex()
+        try:
+            for batch in streaming.iter_properties(self.filename, batch_size, self.load_errors):
+                self.loading_rows.extend(self.columns.append(prop) for prop in batch)
+                yield len(self.loading_rows)
+        except FileNotFoundError:
+            pass
+
+    # Function to read the whole log (lock held), noting how far it goes; returns
+    # its mutation records
+    def _read_log(self):
+        path = journal.log_path(self.filename)
+        records, self.log_offset = journal.read_log(path)
+        self.log_id, self.log_header = locking.file_id(path), journal.read_header(path)
+        header = records.pop(0) if records and records[0].get('op') == 'header' else {}
+        self.generation = header.get('generation', 0)
+        self._prune(self.snapshot_seq)
+        self.snapshot_seq = header.get('seq', 0)
+        self.versions = {}
+        self._note_versions(records)
+        self.seen_seq = max([self.snapshot_seq] + [record.get('seq', 0) for record in records])
+        return records
+
+    # Apply journal records directly to the columns. Instances writing at the same
+    # time can log two rows under one name; the later one is renamed as sync() does.
+    def _replay(self, records):
+        if not records:
+            return
+        by_name = {}
+        for rowid in self.loading_rows:
+            by_name.setdefault(self.columns.names[rowid], []).append(rowid)
+        for record in records:
+            op = record.get('op')
+            if op == 'add':
+                try:
+                    prop = streaming.validate_property(record['property'])
+                except ValueError as error:
+                    self.load_errors.append(('journal', str(error)))
+                    continue
+                if by_name.get(prop['name']):
+                    prop['name'] = free_name(prop['name'], {name for name, rowids in by_name.items() if rowids})
+                by_name.setdefault(prop['name'], []).append(self.columns.append(prop))
+            elif op == 'remove':
+                for rowid in by_name.pop(record['name'], ()):
+                    self.columns.delete(rowid)
+            elif op == 'update' and by_name.get(record['name']):
+                rowid = by_name[record['name']][0]
+                changes = record['property']
+                new_name = changes.get('name', record['name'])
+                if new_name != record['name']:
+                    if by_name.get(new_name):
+                        new_name = free_name(new_name, {name for name, rowids in by_name.items() if rowids})
+                        changes = dict(changes, name=new_name)
+                    by_name[record['name']].remove(rowid)
+                    by_name.setdefault(new_name, []).append(rowid)
+                self.columns.set(rowid, changes)
+
+    # Build the name -> row id map. A row repeating an earlier name (possible in files
+    # written before names were unique) is renamed "name (2)", "name (3)"... and noted
+    # in load_errors; the next write saves the new names.
+    def _index_names(self):
+        self.by_name = {}
+        names = self.columns.names
+        rowids = self.columns.rowids()
+        taken = None  # Every name in use, gathered when the first duplicate turns up
+        for rowid in rowids:
+            name = names[rowid]
+            if name in self.by_name:
+                if taken is None:
+                    taken = {names[other] for other in rowids}
+                new_name = free_name(name, taken)
+                taken.add(new_name)
+                self.columns.set(rowid, {'name': new_name})
+                self.load_errors.append(('duplicate', 'renamed %s to %s' % (name, names[rowid])))
+                self.snapshot_stale = True
+            self.by_name[names[rowid]] = rowid
+
+    # Replace the contents of the store with a list of property dicts
+    def set_properties(self, properties):
+        self.columns = PropertyColumns()
+        for prop in properties:
+            self.columns.append(prop)
+        self.sort_orders = {}
+        self.fuzzy = None
+        self._index_names()
+        self.reindex()
+        self.history.clear()
+
+    # Rebuild the secondary indexes from the columns
+    def reindex(self):
+        self.indexes = PropertyIndexes(self.columns.names)
+        self.indexes.build((rowid, PropertyRow(self.columns, rowid)) for rowid in self.columns.rowids())
+        self.aggregates = None  # Recomputed on next use
+
+    # Function to get the running aggregates, computed in vectorized passes when new
+    def _aggregates(self):
+        if self.aggregates is None:
+            self.aggregates = build_aggregates(column_arrays(RowSequence(self.columns, self.columns.rowids()), True))
+        return self.aggregates
+
+    def statistics(self):
+        return self._aggregates()['portfolio']
+
+    def training_stats(self):
+        return self._aggregates()['regression']
+
+    def _row(self, rowid):
+        return PropertyRow(self.columns, rowid)
+
+    # Function to get the sort order of a column (the current one by default), building it if needed
+    def _order(self, column=None):
+        column = column or self.sort_column
+        order = self.sort_orders.get(column)
+        if order is None:
+            order = self.sort_orders[column] = SortOrder(self.columns, column, self.columns.rowids())
+        return order
+
+    # Function to get the fuzzy name index, queueing every row for indexing when it is new
+    def _fuzzy_index(self):
+        if self.fuzzy is None:
+            names = self.columns.names
+            self.fuzzy = TrigramIndex((rowid, names[rowid]) for rowid in self.columns.rowids()
+                                      if names[rowid] is not None)
+        return self.fuzzy
+
+    # Index up to limit rows for fuzzy search ahead of time; True once every row is indexed
+    def prepare_fuzzy_search(self, limit=5000):
+        if self.loading_rows is not None:
+            return False
+        return self._fuzzy_index().build(limit)
+
+    # Build whatever search(criteria) would build on first use, so it only reads
+    def prepare_search(self, criteria):
+        if criteria.get('name') and criteria.get('name_match') == 'fuzzy':
+            self._fuzzy_index().build()
+        self._order()
+
+    # The search indexes are kept from load on, so only sort orders are ever missing
+    def unbuilt_parts(self, columns=(), criteria=None):
+        if self.loading_rows is not None:
+            return []
+        if criteria is not None:
+            columns = list(columns) + [self.sort_column]
+        return [('sort', column) for column in dict.fromkeys(columns) if column not in self.sort_orders]
+
+    def build_job(self, part):
+        columns, orders, links = self.columns, self.sort_orders, self.links
+        column = part[1]
+        return lambda: (part, orders, links, SortOrder(columns, column, columns.rowids(), chunk_size=SORT_CHUNK))
+
+    def install_part(self, built):
+        part, orders, links, order = built
+        if orders is not self.sort_orders or links != self.links:
+            return False
+        orders.setdefault(part[1], order)
+        return True
+
+    def _position(self, rowid):
+        return self._order().position(rowid, self.sort_descending)
+
+    def get(self, name):
+        rowid = self.by_name.get(name)
+        return None if rowid is None else self._row(rowid)
+
+    def _check_unique(self, name):
+        if name in self.by_name:
+            raise DuplicateName('a property named %s already exists' % name)
+
+    def all(self):
+        if self.loading_rows is not None:
+            return RowSequence(self.columns, self.loading_rows)
+        return RowSequence(self.columns, self._order().view(self.sort_descending))
+
+    def sort(self, column, descending=False):
+        if column not in COLUMNS:
+            raise ValueError('Unknown column: %s' % column)
+        self.sort_column = column
+        self.sort_descending = descending
+
+    def search(self, criteria):
+        if criteria.get('name') and criteria.get('name_match') == 'fuzzy':
+            return self._fuzzy_search(criteria)
+        rowids = self.indexes.search(criteria, matches, self._row)
+        if rowids is None:
+            return RowSequence(self.columns, array('q', self._order().view(self.sort_descending)))
+        return RowSequence(self.columns, self._order().sort(rowids, self.sort_descending))
+
+    # Rank the names most similar to criteria['name'] among the rows passing the other filters
+    def _fuzzy_search(self, criteria):
+        index = self._fuzzy_index()
+        index.build()
+        top_k = criteria.get('top_k') or FUZZY_TOP_K
+        filters = dict(criteria, name=None)
+        names = self.columns.names
+        pairs = ((rowid, names[rowid]) for rowid in index.candidates(criteria['name'], max(20 * top_k, 1000))
+                 if matches(self._row(rowid), filters))
+        return RowSequence(self.columns, array('q', rank_by_similarity(criteria['name'], pairs, top_k)))
+
+    # Function to add a row to the indexes and cached sort orders
+    def _link(self, rowid):
+        self.links += 1
+        self.indexes.add(rowid, self._row(rowid))
+        for order in self.sort_orders.values():
+            order.insert(rowid)
+        if self.fuzzy is not None:
+            self.fuzzy.add(rowid, self.columns.names[rowid])
+        if self.aggregates is not None:
+            for aggregate in self.aggregates.values():
+                aggregate.add(self._row(rowid))
+
+    # Function to drop a row from the indexes and cached sort orders; call it before
+    # the row's values change
+    def _unlink(self, rowid):
+        self.links += 1
+        self.indexes.remove(rowid, self._row(rowid))
+        for order in self.sort_orders.values():
+            order.remove(rowid)
+        if self.fuzzy is not None:
+            self.fuzzy.remove(rowid, self.columns.names[rowid])
+        if self.aggregates is not None:
+            for aggregate in self.aggregates.values():
+                aggregate.remove(self._row(rowid))
+
+    def add(self, property):
+        self._check_unique(property['name'])
+        rowid = self.columns.append(property)
+        self.by_name[self.columns.names[rowid]] = rowid
+        self._link(rowid)
+        self._record('add', property=property)
+        self.history.record('add %s' % property['name'], [('add', [self.columns.to_dict(rowid)])],
+                            [('remove', [property['name']])])
+        self._notify('inserted', self._position(rowid), self._row(rowid))
+
+    def remove(self, name):
+        rowid = self.by_name.pop(name, None)
+        if rowid is None:
+            return
+        position = self._position(rowid)
+        prop = self.columns.to_dict(rowid)
+        self._unlink(rowid)
+        self.columns.delete(rowid)
+        self._record('remove', name=name)
+        self.history.record('remove %s' % name, [('remove', [name])], [('add', [prop])])
+        self._notify('deleted', position, prop)
+
+    # Remove many properties at once, rebuilding the indexes and sort orders once
+    def remove_many(self, names):
+        removed = []
+        for name in names:
+            rowid = self.by_name.pop(name, None)
+            if rowid is not None:
+                removed.append(self.columns.to_dict(rowid))
+                if self.fuzzy is not None:
+                    self.fuzzy.remove(rowid, name)
+                self.columns.delete(rowid)
+        if not removed:
+            return
+        self.sort_orders = {}
+        self.reindex()
+        self._record_many([journal.make_record('remove', name=prop['name']) for prop in removed])
+        self.history.record('remove %d properties' % len(removed),
+                            [('remove', [prop['name'] for prop in removed])], [('add', removed)])
+        self._notify('reset')
+
+    def update(self, name, property):
+        rowid = self.by_name.get(name)
+        if rowid is None:
+            return
+        new_name = property.get('name', name)
+        if new_name != name:
+            self._check_unique(new_name)
+        position = self._position(rowid)
+        old = self.columns.to_dict(rowid)
+        self._unlink(rowid)
+        self.columns.set(rowid, property)
+        self._link(rowid)
+        self.history.record('update %s' % name, [('update', name, dict(property))],
+                            [('update', new_name, {column: old[column] for column in property if column in COLUMNS})])
+        if new_name != name:
+            del self.by_name[name]
+            self.by_name[self.columns.names[rowid]] = rowid
+        changed = {column: value for column, value in property.items() if column in COLUMNS and old[column] != value}
+        if changed:
+            self._record('update', name=name, property=changed)
+        new_position = self._position(rowid)
+        prop = self._row(rowid)
+        if new_position == position:
+            self._notify('updated', position, prop)
+        else:
+            self._notify('deleted', position, prop)
+            self._notify('inserted', new_position, prop)
+
+    # Apply many (name, property) updates at once: one index rebuild, one write, one event.
+    # Renames are not supported here.
+    def update_many(self, changes):
+        for name, property in changes:
+            if property.get('name', name) != name:
+                raise ValueError('update_many cannot rename %s' % name)
+        changes = [(name, property) for name, property in changes if name in self.by_name]
+        if not changes:
+            return
+        forward, inverse = set_operations(changes, self.get)
+        records = []
+        for name, property in changes:
+            self.columns.set(self.by_name[name], property)
+            records.append({'op': 'update', 'name': name, 'property': property})
+        self.sort_orders = {}
+        self.reindex()
+        self._record_many(records)
+        self.history.record('update %d properties' % len(changes), forward, inverse)
+        self._notify('reset')
+
+    # Add many properties at once: the batch is sorted once and spliced into each
+    # cached sort order and index in a single copy rather than inserted row by row,
+    # then persisted and announced once.
+    # Properties whose name is already taken are skipped; their names are returned.
+    def add_many(self, properties):
+        rowids, added, skipped = [], [], []
+        for prop in properties:
+            if prop['name'] in self.by_name:
+                skipped.append(prop['name'])
+            else:
+                added.append(prop)
+                rowid = self.columns.append(prop)
+                self.by_name[self.columns.names[rowid]] = rowid
+                if self.fuzzy is not None:
+                    self.fuzzy.add(rowid, self.columns.names[rowid])
+                rowids.append(rowid)
+        if not rowids:
+            return skipped
+        self.links += 1
+        for order in self.sort_orders.values():
+            order.insert_many(self.columns, rowids)
+        self.indexes.add_many((rowid, self._row(rowid)) for rowid in rowids)
+        if self.aggregates is not None:
+            arrays = column_arrays(RowSequence(self.columns, rowids), True)
+            for aggregate in self.aggregates.values():
+                aggregate.build(arrays)
+        self._record_many([{'op': 'add', 'property': self.columns.to_dict(rowid)} for rowid in rowids])
+        self.history.record('add %d properties' % len(added), [('add', added)],
+                            [('remove', [prop['name'] for prop in added])])
+        self._notify('reset')
+        return skipped
+
+    # Persist a single mutation by appending it to the journal
+    def _record(self, op, name=None, property=None):
+        self._record_many([journal.make_record(op, name, property)])
+
+    # Persist a batch of mutations with one journal write, or one snapshot when that is
+    # smaller or when an earlier write failed
+    def _record_many(self, records):
+        if self.filename is None or self.syncing:  # In-memory store, or edits of another instance
+            return
+        for record in records:
+            if record['op'] != 'add':
+                record['base'] = self.versions.get(record['name'], self.snapshot_seq)
+        self.own.append(OwnBatch(records))
+        if (self.snapshot_stale or self.writer.error is not None
+                or self.journal_records + len(records) > journal.COMPACT_THRESHOLD):
+            self._snapshot(records)
+        else:
+            self.writer.append(records)
+            self.journal_records += len(records)
+
+    # Queue a fresh snapshot, taken from a copy so the writer never reads live rows
+    def _snapshot(self, records=()):
+        columns, order = self.columns.copy(), array('q', self._order().view(self.sort_descending))
+        self.writer.snapshot((columns.to_dict(rowid) for rowid in order), self.seen_seq, records)
+        self.journal_records = 0
+        self.snapshot_stale = False
+
+    # Merge the edits other instances made to the file since the last call, and
+    # return the conflicts found. Costs one stat() when the log did not change.
+    def sync(self):
+        if self.filename is None or self.loading_rows is not None:
+            return []
+        path = journal.log_path(self.filename)
+        try:
+            stat = os.stat(path)
+            changed = (stat.st_dev, stat.st_ino) != self.log_id or stat.st_size != self.log_offset
+        except FileNotFoundError:
+            changed = False
+        records = []
+        if changed:
+            with locking.locked(self.filename):
+                records = self._read_new_records(path)
+        conflicts = []
+        theirs = None if records is None else [record for record in records if record.get('origin') != self.origin
+                                               and record.get('op') != 'header']
+        if theirs is None or len(theirs) > journal.COMPACT_THRESHOLD:
+            self._reload(conflicts, None, 'The file was rewritten by another instance and has been reloaded.')
+        elif theirs:
+            self.journal_records += len(theirs)
+            self.seen_seq = max(self.seen_seq, max(record.get('seq', 0) for record in records))
+            self._merge(theirs, conflicts)
+        elif records:
+            self.seen_seq = max(self.seen_seq, max(record.get('seq', 0) for record in records))
+        if self.writer.deferred:
+            # A snapshot was held back for edits we had not merged; we have them now
+            self.writer.deferred = False
+            self._snapshot()
+        return conflicts
+
+    # Function to read the records appended since the last sync (lock held). After a
+    # compaction the rest of the old log is read from its archive; None when that
+    # cannot be done and the file has to be reloaded.
+    def _read_new_records(self, path):
+        log_id, log_header = locking.file_id(path), journal.read_header(path)
+        if (log_id, log_header) == (self.log_id, self.log_header):
+            records, self.log_offset = journal.read_log(path, self.log_offset)
+            return records
+        records, offset = journal.read_log(path)
+        header = records[0] if records and records[0].get('op') == 'header' else {}
+        archive = journal.archive_path(self.filename, self.generation)
+        if self.log_id is None and header.get('generation', 0) == self.generation:
+            tail = []  # The log was started since the last read
+        elif (header.get('generation') == self.generation + 1
+              and (not header.get('partial') or header.get('origin') == self.origin)
+              and locking.file_id(archive) is not None
+              and (self.log_id is None or (locking.file_id(archive), journal.read_header(archive))
+                   == (self.log_id, self.log_header))):
+            tail, _ = journal.read_log(archive, self.log_offset)
+        else:
+            return None
+        self.log_id, self.log_header, self.log_offset = log_id, log_header, offset
+        self.generation = header.get('generation', 0)
+        self._prune(self.snapshot_seq)
+        self.snapshot_seq = header.get('seq', 0)
+        self.journal_records = len(records) - 1 if header else len(records)
+        return tail + records
+
+    # Function to forget our batches no other instance can still be behind on
+    def _prune(self, seq):
+        while self.own and self.own[0].last_seq() is not None and self.own[0].last_seq() <= seq:
+            self.own.popleft()
+
+    # Function to note the rows other instances' records leave at which version
+    def _note_versions(self, records):
+        for record in records:
+            if record['op'] == 'add':
+                self.versions[record['property']['name']] = record.get('seq', 0)
+            elif record['op'] in ('update', 'remove'):
+                if changes_names(record):
+                    self.versions.pop(record['name'], None)
+                self.versions[record.get('property', {}).get('name', record['name'])] = record.get('seq', 0)
+
+    # Function to find our latest record touching a name (and one of fields, if given)
+    def _own_record(self, name, fields=None):
+        for batch in reversed(self.own):
+            for record in batch.touching(name):
+                if fields is None or record['op'] == 'add' or any(field in record.get('property', ()) for field in fields):
+                    return record
+        return None
+
+    # Function to tell where our record stands relative to another instance's
+    # record: 'pending' when it comes after it in the log (or is not written
+    # yet), 'unseen' when it comes before but its author had not merged it
+    @staticmethod
+    def _relation(mine, theirs):
+        if mine is None:
+            return None
+        seq = mine.get('seq')
+        if seq is None or seq > theirs.get('seq', 0):
+            return 'pending'
+        if seq > theirs.get('base', 0):
+            return 'unseen'
+        return None
+
+    # Function to tell whether we have an unwritten add, removal or rename involving a name
+    def _renames_pending(self, name, theirs):
+        for batch in reversed(self.own):
+            for record in batch.touching(name):
+                if changes_names(record) and self._relation(record, theirs) == 'pending':
+                    return True
+        return False
+
+    # Function to gather the fields our unwritten updates of a name set, oldest first
+    def _pending_changes(self, name, theirs):
+        changes = {}
+        for batch in self.own:
+            for record in reversed(batch.touching(name)):
+                if record['op'] == 'update' and self._relation(record, theirs) == 'pending':
+                    changes.update((field, value) for field, value in record['property'].items() if field in COLUMNS)
+        return changes
+
+    # Function to apply other instances' records field by field, without journaling
+    # them again or adding them to the history
+    def _merge(self, records, conflicts):
+        reason = None
+        self.syncing = self.history.replaying = True
+        try:
+            for record in records:
+                reason = self._merge_record(record, conflicts)
+                if reason is not None:
+                    break
+                self._note_versions([record])
+        finally:
+            self.syncing = self.history.replaying = False
+        if reason is not None:
+            self._reload(conflicts, record.get('name') or record['property'].get('name'),
+                         reason + ' The file has been reloaded.')
+
+    # Function to merge one record; returns a reason when the file has to be reloaded instead
+    def _merge_record(self, record, conflicts):
+        op = record.get('op')
+        if op == 'add':
+            try:
+                prop = streaming.validate_property(record['property'])
+            except ValueError:
+                return None
+            name = prop['name']
+            if self._renames_pending(name, record):
+                return 'Another instance added %s while it was being changed here.' % name
+            if name in self.by_name:
+                prop['name'] = free_name(name, self.by_name)
+                conflicts.append({'name': name, 'field': 'name', 'mine': name, 'theirs': prop['name'],
+                                  'message': 'Another instance added %s as well; theirs is listed as %s.'
+                                             % (name, prop['name'])})
+            # Our unwritten edits of an earlier row of that name will land on this one
+            self.add(dict(prop, **self._pending_changes(prop['name'], record)))
+        elif op == 'remove':
+            name = record['name']
+            if self._renames_pending(name, record):
+                return 'Another instance removed %s while it was being changed here.' % name
+            row = self.get(name)
+            if row is not None and self._relation(self._own_record(name), record) is not None:
+                conflicts.append({'name': name, 'field': None, 'mine': dict(row), 'theirs': None,
+                                  'message': 'Another instance removed %s, discarding the changes made here.' % name})
+            self.remove(name)
+        elif op == 'update':
+            name, changes = record['name'], record['property']
+            new_name = changes.get('name', name)
+            if name not in self.by_name:
+                mine = self._own_record(name)
+                # Dropping their edit matches the log when our removal of the row comes
+                # after it, but not when the row is renamed away first (by them or by us)
+                if self._relation(mine, record) == 'pending' and (new_name != name or mine['op'] == 'update'):
+                    return 'Another instance changed %s while it was being renamed or removed here.' % name
+                if mine is not None:
+                    conflicts.append({'name': name, 'field': None, 'mine': None, 'theirs': dict(changes),
+                                      'message': 'Changes to %s from another instance were dropped: '
+                                                 'it no longer exists here.' % name})
+                return None
+            if new_name != name:
+                if (self._renames_pending(new_name, record)
+                        or self._relation(self._own_record(name), record) == 'pending'):
+                    return 'Another instance renamed %s to %s while it was being changed here.' % (name, new_name)
+                if new_name in self.by_name:
+                    changes = dict(changes, name=free_name(new_name, self.by_name))
+                    conflicts.append({'name': name, 'field': 'name', 'mine': new_name, 'theirs': changes['name'],
+                                      'message': 'Another instance renamed %s to %s, which is taken here; '
+                                                 'it is listed as %s.' % (name, new_name, changes['name'])})
+            row = self.get(name)
+            merged = {}
+            for field, value in changes.items():
+                if field not in COLUMNS:
+                    continue
+                relation = self._relation(self._own_record(name, [field]), record)
+                if relation == 'pending':
+                    if row[field] != value:
+                        conflicts.append({'name': name, 'field': field, 'mine': row[field], 'theirs': value,
+                                          'message': 'Another instance also changed %s of %s; '
+                                                     'the value set here is kept.' % (field, name)})
+                    continue
+                if relation == 'unseen' and row[field] != value:
+                    conflicts.append({'name': name, 'field': field, 'mine': row[field], 'theirs': value,
+                                      'message': 'Another instance changed %s of %s after it was changed here; '
+                                                 'its value is kept.' % (field, name)})
+                merged[field] = value
+            if merged:
+                self.update(name, merged)
+        return None
+
+    # Function to reload the file after a change that cannot be merged
+    def _reload(self, conflicts, name, message):
+        self.load()
+        self._notify('reset')
+        conflicts.append({'name': name, 'field': None, 'mine': None, 'theirs': None, 'message': message})
+
+    # Fold the journal into a fresh snapshot and wait until it is on disk
+    def save(self):
+        if self.writer is not None:
+            self._snapshot()
+            self.flush()
+
+    # Wait until every queued write is on disk
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def unsaved_changes(self):
+        return self.snapshot_stale or (self.writer is not None and self.writer.dirty())
+
+    def close(self):
+        self.flush()
+
+
+# Lazy result sequence for an SQLite query; rows are fetched only when sliced
+class SqlRows:
+    def __init__(self, store, where, params, order_by):
+        self.store = store
+        self.where = where
+        self.params = params
+        self.order_by = order_by
+        self.count = None
+        self.count_version = None
+
+    def __len__(self):
+        if self.count_version != self.store.version:
+            self.count = self.store.connection().execute('SELECT COUNT(*) FROM properties%s' % self.where,
+                                           self.params).fetchone()[0]
+            self.count_version = self.store.version
+        return self.count
+
+    def _fetch(self, offset, limit):
+        cursor = self.store.connection().execute('SELECT name, total_sqft, bath, price, bhk FROM properties%s '
+                                                 'ORDER BY %s LIMIT ? OFFSET ?' % (self.where, self.order_by),
+                                                 list(self.params) + [limit, offset])
+        return [dict(zip(COLUMNS, row)) for row in cursor]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            rows = self._fetch(start, max(0, stop - start))
+            return rows[::step] if step != 1 else rows
+        if index < 0:
+            index += len(self)
+        rows = self._fetch(index, 1)
+        if not rows:
+            raise IndexError('row index out of range')
+        return rows[0]
+
+    def __iter__(self):
+        cursor = self.store.connection().execute('SELECT name, total_sqft, bath, price, bhk FROM properties%s '
+                                                 'ORDER BY %s' % (self.where, self.order_by), self.params)
+        for row in cursor:
+            yield dict(zip(COLUMNS, row))
+
+
+# Properties kept in an SQLite database; filtering and sorting run as indexed SQL.
+# Change events carry no position since finding it would need an extra query.
+class SqliteStore(ObservableStore):
+    def __init__(self, filename, json_filename=None):
+        self.filename = filename
+        self.json_filename = json_filename  # Legacy JSON file imported on first use
+        self.order_by = 'name COLLATE NOCASE, rowid'
+        self.conn = sqlite3.connect(filename)
+        self.thread = threading.get_ident()  # Owner of conn; other threads read through their own
+        self.readers = threading.local()
+        self.listeners = []
+        self.version = 0  # Bumped on every change so lazy row counts are re-read
+        self.fuzzy = None  # In-memory TrigramIndex over names, built on first fuzzy search
+        self.aggregates = None  # Name -> running aggregate (see AGGREGATES), built on first use
+        self.history = History()
+        self.data_version = None  # Changes when another connection commits
+
+    def load(self):
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS properties ('
+                              'name TEXT NOT NULL, total_sqft REAL, bath REAL, price REAL, bhk INTEGER)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_properties_name ON properties (name)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_properties_name_nocase ON properties (name COLLATE NOCASE)')
+            for column in COLUMNS[1:]:
+                self.conn.execute('CREATE INDEX IF NOT EXISTS idx_properties_%s ON properties (%s)' % (column, column))
+                self.conn.execute('CREATE INDEX IF NOT EXISTS idx_properties_%s_nulls_last ON properties (%s IS NULL, %s)'
+                                  % (column, column, column))
+        empty = self.conn.execute('SELECT NOT EXISTS (SELECT 1 FROM properties)').fetchone()[0]
+        if empty and self.json_filename and os.path.exists(self.json_filename):
+            properties, _ = journal.load(self.json_filename)
+            with self.conn:
+                self.conn.executemany('INSERT INTO properties VALUES (?, ?, ?, ?, ?)',
+                                      [self._values(prop) for prop in properties])
+        self.history.clear()
+        self.aggregates = None
+        self.data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def load_iter(self, batch_size=None):
+        self.load()
+        yield from ()
+
+    # Function to get the connection of the calling thread, since an SQLite connection
+    # only serves the thread that made it. Every change is committed at once, so the
+    # read-only connections of other threads see it too.
+    def connection(self):
+        if threading.get_ident() == self.thread:
+            return self.conn
+        conn = getattr(self.readers, 'conn', None)
+        if conn is None:
+            conn = self.readers.conn = sqlite3.connect(self.filename)
+        return conn
+
+    @staticmethod
+    def _values(prop):
+        return (prop['name'], prop.get('total_sqft'), prop.get('bath'), prop.get('price'), prop.get('bhk'))
+
+    def all(self):
+        return SqlRows(self, '', [], self.order_by)
+
+    def get(self, name):
+        row = self.conn.execute('SELECT name, total_sqft, bath, price, bhk FROM properties WHERE name = ? LIMIT 1',
+                                (name,)).fetchone()
+        return None if row is None else dict(zip(COLUMNS, row))
+
+    def _check_unique(self, name):
+        if self.conn.execute('SELECT 1 FROM properties WHERE name = ?', (name,)).fetchone():
+            raise DuplicateName('a property named %s already exists' % name)
+
+    def sort(self, column, descending=False):
+        if column not in COLUMNS:
+            raise ValueError('Unknown column: %s' % column)
+        direction = 'DESC' if descending else 'ASC'
+        if column == 'name':
+            self.order_by = 'name COLLATE NOCASE %s, rowid %s' % (direction, direction)
+        elif descending:
+            self.order_by = '%s DESC, rowid DESC' % column  # NULL sorts last here already
+        else:
+            # Missing values last as in JsonStore, served by the idx_*_nulls_last indexes
+            self.order_by = '%s IS NULL, %s ASC, rowid ASC' % (column, column)
+
+    def search(self, criteria):
+        clauses, params = [], []
+        name_match = criteria.get('name_match', 'exact')
+        if criteria.get('name') and name_match == 'prefix':
+            clauses.append("name LIKE ? ESCAPE '\\'")
+            params.append(criteria['name'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        elif criteria.get('name') and name_match != 'fuzzy':
+            clauses.append('name = ? COLLATE NOCASE')
+            params.append(criteria['name'])
+        for column, op, key in (('total_sqft', '=', 'total_sqft'), ('bath', '=', 'bath'),
+                                ('price', '>=', 'min_price'), ('price', '<=', 'max_price'),
+                                ('bhk', '=', 'bhk')):
+            if criteria.get(key) is not None:
+                clauses.append('%s %s ?' % (column, op))
+                params.append(criteria[key])
+        if criteria.get('name') and name_match == 'fuzzy':
+            return self._fuzzy_search(criteria, clauses, params)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return SqlRows(self, where, params, self.order_by)
+
+    # Rank the names most similar to criteria['name'] among the rows passing the other
+    # filters. The trigram index lives in memory and is built on first use.
+    def _fuzzy_search(self, criteria, clauses, params):
+        self._fuzzy_index()
+        top_k = criteria.get('top_k') or FUZZY_TOP_K
+        rowids = self.fuzzy.candidates(criteria['name'], max(20 * top_k, 1000))
+        rows = {}
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            where = ' AND '.join(clauses + ['rowid IN (%s)' % ', '.join('?' * len(chunk))])
+            for rowid, *values in self.connection().execute('SELECT rowid, name, total_sqft, bath, price, bhk '
+                                                            'FROM properties WHERE ' + where, params + chunk):
+                rows[rowid] = dict(zip(COLUMNS, values))
+        ranked = rank_by_similarity(criteria['name'], ((rowid, row['name']) for rowid, row in rows.items()), top_k)
+        return [rows[rowid] for rowid in ranked]
+
+    def add(self, property):
+        self._check_unique(property['name'])
+        with self.conn:
+            rowid = self.conn.execute('INSERT INTO properties VALUES (?, ?, ?, ?, ?)', self._values(property)).lastrowid
+        if self.fuzzy is not None:
+            self.fuzzy.add(rowid, property['name'])
+        if self.aggregates is not None:
+            for aggregate in self.aggregates.values():
+                aggregate.add(dict(zip(COLUMNS, self._values(property))))
+        self.version += 1
+        self.history.record('add %s' % property['name'], [('add', [dict(zip(COLUMNS, self._values(property)))])],
+                            [('remove', [property['name']])])
+        self._notify('inserted', None, property)
+
+    def remove(self, name):
+        old = self.get(name)
+        with self.conn:
+            rowids = [rowid for rowid, in self.conn.execute('SELECT rowid FROM properties WHERE name = ?', (name,))]
+            self.conn.execute('DELETE FROM properties WHERE name = ?', (name,))
+        if rowids:
+            if self.fuzzy is not None:
+                for rowid in rowids:
+                    self.fuzzy.remove(rowid, name)
+            if self.aggregates is not None:
+                for aggregate in self.aggregates.values():
+                    aggregate.remove(old)
+            self.version += 1
+            self.history.record('remove %s' % name, [('remove', [name])], [('add', [old])])
+            self._notify('deleted', None, {'name': name})
+
+    # Delete many properties in one transaction
+    def remove_many(self, names):
+        removed = [prop for prop in map(self.get, names) if prop is not None]
+        if not removed:
+            return
+        with self.conn:
+            self.conn.executemany('DELETE FROM properties WHERE name = ?', [(prop['name'],) for prop in removed])
+        self.fuzzy = None
+        self.aggregates = None
+        self.version += 1
+        self.history.record('remove %d properties' % len(removed),
+                            [('remove', [prop['name'] for prop in removed])], [('add', removed)])
+        self._notify('reset')
+
+    def update(self, name, property):
+        assignments = ', '.join('%s = ?' % column for column in property if column in COLUMNS)
+        if not assignments:
+            return
+        if property.get('name', name) != name:
+            self._check_unique(property['name'])
+        params = [property[column] for column in property if column in COLUMNS]
+        row = self.conn.execute('SELECT rowid, name, total_sqft, bath, price, bhk FROM properties '
+                                'WHERE name = ? LIMIT 1', (name,)).fetchone()
+        if row is None:
+            return
+        old = dict(zip(COLUMNS, row[1:]))
+        with self.conn:
+            self.conn.execute('UPDATE properties SET %s WHERE rowid = ?' % assignments, params + [row[0]])
+        if self.fuzzy is not None and property.get('name', name) != name:
+            self.fuzzy.remove(row[0], name)
+            self.fuzzy.add(row[0], property['name'])
+        if self.aggregates is not None:
+            new = dict(old, **{column: property[column] for column in property if column in COLUMNS})
+            for aggregate in self.aggregates.values():
+                aggregate.remove(old)
+                aggregate.add(new)
+        self.version += 1
+        self.history.record('update %s' % name, [('update', name, dict(property))],
+                            [('update', property.get('name', name),
+                              {column: old[column] for column in property if column in COLUMNS})])
+        self._notify('updated', None, property)
+
+    # Insert many properties in one transaction, skipping (and returning) names already taken
+    def add_many(self, properties):
+        added, skipped, seen = [], [], set()
+        for prop in properties:
+            name = prop['name']
+            if name in seen or self.conn.execute('SELECT 1 FROM properties WHERE name = ?', (name,)).fetchone():
+                skipped.append(name)
+            else:
+                seen.add(name)
+                added.append(prop)
+        if added:
+            with self.conn:
+                self.conn.executemany('INSERT INTO properties VALUES (?, ?, ?, ?, ?)', map(self._values, added))
+            self.fuzzy = None  # Rebuilt on the next fuzzy search
+            self.aggregates = None
+            self.version += 1
+            self.history.record('add %d properties' % len(added), [('add', added)],
+                                [('remove', [prop['name'] for prop in added])])
+            self._notify('reset')
+        return skipped
+
+    # Apply many (name, property) updates in one transaction
+    def update_many(self, changes):
+        if any(property.get('name', name) != name for name, property in changes):
+            self.fuzzy = None
+        current = {name: self.get(name) for name, _ in changes}
+        changes = [(name, property) for name, property in changes if current[name] is not None]
+        forward, inverse = set_operations(changes, current.get)
+        updated = 0
+        with self.conn:
+            for name, property in changes:
+                columns = [column for column in property if column in COLUMNS]
+                if columns:
+                    updated += self.conn.execute(
+                        'UPDATE properties SET %s WHERE rowid = '
+                        '(SELECT rowid FROM properties WHERE name = ? LIMIT 1)'
+                        % ', '.join('%s = ?' % column for column in columns),
+                        [property[column] for column in columns] + [name]).rowcount
+        if updated:
+            self.aggregates = None
+            self.version += 1
+            self.history.record('update %d properties' % len(changes), forward, inverse)
+            self._notify('reset')
+
+    def save(self):
+        self.conn.commit()
+
+    # Function to get the fuzzy name index, building it in one go when it is new
+    def _fuzzy_index(self):
+        if self.fuzzy is None:
+            self.fuzzy = TrigramIndex(self.conn.execute('SELECT rowid, name FROM properties'))
+            self.fuzzy.build()
+        return self.fuzzy
+
+    # The fuzzy index is built in one go on the first fuzzy search
+    def prepare_fuzzy_search(self, limit=None):
+        return True
+
+    def _aggregates(self):
+        if self.aggregates is None:
+            rows = self.conn.execute('SELECT name, %s FROM properties' % ', '.join(STAT_COLUMNS)).fetchall()
+            arrays = tuple_arrays([row[1:] for row in rows])
+            arrays['name'] = [row[0] for row in rows]
+            self.aggregates = build_aggregates(arrays)
+        return self.aggregates
+
+    def statistics(self):
+        return self._aggregates()['portfolio']
+
+    def training_stats(self):
+        return self._aggregates()['regression']
+
+    def unbuilt_parts(self, columns=(), criteria=None):
+        return []
+
+    # Only the fuzzy index is built lazily; SQL searches have nothing to prepare
+    def prepare_search(self, criteria):
+        if criteria.get('name') and criteria.get('name_match') == 'fuzzy':
+            self._fuzzy_index()
+
+    # SQLite does the locking between instances itself and every change is committed
+    # at once, so there is nothing to merge: when another connection committed, the
+    # table is simply re-read. Conflicting edits are not detected; the last one wins.
+    def sync(self):
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if self.data_version is not None and data_version != self.data_version:
+            self.fuzzy = None
+            self.aggregates = None
+            self.version += 1
+            self._notify('reset')
+        self.data_version = data_version
+        return []
+
+    # Every change is committed as it is made
+    def flush(self):
+        pass
+
+    def unsaved_changes(self):
+        return False
+
+    def close(self):
+        self.conn.close()
+
+
+# Properties kept in a memory-mapped binary file (see binfile.py). Opening it
+# maps the file and reads its header only: rows are decoded from the map when
+# shown or searched, and every change is patched into the file at once under
+# the file lock. The file keeps the name order itself, so the default listing
+# needs no sort at load; the other sort orders and the search indexes are
+# built in memory on first use.
+# Other instances are noticed through the file's change counter. As with
+# SQLite the last write wins and sync() reports no conflicts.
+class BinaryStore(ObservableStore):
+    def __init__(self, filename, json_filename=None):
+        self.filename = filename
+        self.json_filename = json_filename  # Legacy JSON file converted on first use
+        self.columns = None
+        self.file_id = None
+        self.changes = None  # Change counter of the file as of our last look
+        self.sort_orders = {}  # Column -> SortOrder; the name order is read from the file
+        self.indexes = None  # PropertyIndexes, built on the first search
+        self.fuzzy = None  # TrigramIndex over names, created on first use
+        self.aggregates = None  # Name -> running aggregate (see AGGREGATES), built on first use
+        self.links = 0  # Bumped by _link() and _unlink(), so a background build can tell it is stale
+        self.history = History()
+        self.sort_column = 'name'
+        self.sort_descending = False
+        self.listeners = []
+
+    def load(self):
+        with locking.locked(self.filename):
+            if not os.path.exists(self.filename):
+                binfile.to_binary(self.json_filename if self.json_filename and os.path.exists(self.json_filename)
+                                  else None, self.filename)
+            self._open()
+        self.history.clear()
+
+    def load_iter(self, batch_size=None):
+        self.load()
+        yield from ()
+
+    def _open(self):
+        if self.columns is not None:
+            self.columns.close()
+        self.columns = binfile.BinaryColumns(self.filename)
+        self.file_id = locking.file_id(self.filename)
+        self.changes = self.columns.changes()
+        self.sort_orders = {}
+        self.indexes = None
+        self.aggregates = None
+        self.fuzzy = None
+
+    # Function to take in what other instances wrote since our last look (lock
+    # held); True when anything changed
+    def _catch_up(self):
+        file_id = locking.file_id(self.filename)
+        if file_id is not None and file_id != self.file_id:
+            self._open()  # Compacted by another instance
+        elif self.columns.changes() != self.changes:
+            self.columns.refresh()
+            self.changes = self.columns.changes()
+            self.sort_orders = {}
+            self.indexes = None
+            self.aggregates = None
+            self.fuzzy = None
+        else:
+            return False
+        return True
+
+    # Context manager around every change: holds the file lock and catches up first
+    @contextmanager
+    def _writing(self):
+        with locking.locked(self.filename):
+            if self._catch_up():
+                self._notify('reset')
+            try:
+                yield
+            finally:
+                self.changes = self.columns.changes()
+
+    # Function to rewrite the file without deleted rows and replaced names,
+    # leaving room for spare more rows (lock held)
+    def _rewrite(self, spare=0):
+        temp_path = self.filename + '.tmp'
+        binfile.compact(self.columns, temp_path, spare)
+        self.columns.close()
+        self.columns = None
+        os.replace(temp_path, self.filename)
+        self._open()
+
+    def _reserve(self, count):
+        if not self.columns.has_room(count):
+            self._rewrite(max(count, len(self.columns)))
+
+    def _row(self, rowid):
+        return PropertyRow(self.columns, rowid)
+
+    def _order(self, column=None):
+        column = column or self.sort_column
+        order = self.sort_orders.get(column)
+        if order is None:
+            if column == 'name':
+                order = SortOrder(self.columns, column, self.columns.name_order(), presorted=True)
+            else:
+                order = SortOrder(self.columns, column, self.columns.rowids())
+            self.sort_orders[column] = order
+        return order
+
+    # Function to get the search indexes, built from the sort orders (which
+    # sorting then reuses) rather than row by row
+    def _indexes(self):
+        if self.indexes is None:
+            self.indexes = PropertyIndexes(self.columns.names)
+            self.indexes.build_sorted(lambda column: (self._order(column).values,
+                                                      self.columns.values.get(column, self.columns.names).__getitem__))
+        return self.indexes
+
+    def _fuzzy_index(self):
+        if self.fuzzy is None:
+            names = self.columns.names
+            self.fuzzy = TrigramIndex((rowid, names[rowid]) for rowid in self.columns.rowids())
+        return self.fuzzy
+
+    def prepare_fuzzy_search(self, limit=5000):
+        return self._fuzzy_index().build(limit)
+
+    def prepare_search(self, criteria):
+        if criteria.get('name') and criteria.get('name_match') == 'fuzzy':
+            self._fuzzy_index().build()
+        else:
+            self._indexes()
+        self._order()
+
+    # The name order comes presorted from the file, so it is never worth a thread;
+    # the search indexes are built from the sort orders of every column
+    def unbuilt_parts(self, columns=(), criteria=None):
+        columns = list(columns)
+        indexes = False
+        if criteria is not None:
+            columns.append(self.sort_column)
+            if not (criteria.get('name') and criteria.get('name_match') == 'fuzzy') and self.indexes is None:
+                columns += COLUMNS
+                indexes = True
+        parts = [('sort', column) for column in dict.fromkeys(columns)
+                 if column != 'name' and column not in self.sort_orders]
+        return parts + [('indexes', None)] if indexes else parts
+
+    def build_job(self, part):
+        columns, orders, links = self.columns, self.sort_orders, self.links
+        kind, column = part
+        if kind == 'sort':
+            return lambda: (part, orders, links, SortOrder(columns, column, columns.rowids(), chunk_size=SORT_CHUNK))
+        sorted_columns = {column: self._order(column) for column in COLUMNS}
+
+        # A row's value goes through Python code, as looping over a C getter would
+        # hold the GIL for a whole column
+        def order(column):
+            value = columns.values.get(column, columns.names).__getitem__
+            return sorted_columns[column].values, lambda rowid: value(rowid)
+
+        def build():
+            indexes = PropertyIndexes(columns.names)
+            indexes.build_sorted(order)
+            return part, orders, links, indexes
+        return build
+
+    def install_part(self, built):
+        part, orders, links, value = built
+        if orders is not self.sort_orders or links != self.links:
+            return False
+        if part[0] == 'sort':
+            orders.setdefault(part[1], value)
+        elif self.indexes is None:
+            self.indexes = value
+        return True
+
+    def _aggregates(self):
+        if self.aggregates is None:
+            self.aggregates = build_aggregates(column_arrays(RowSequence(self.columns, self.columns.rowids()), True))
+        return self.aggregates
+
+    def statistics(self):
+        return self._aggregates()['portfolio']
+
+    def training_stats(self):
+        return self._aggregates()['regression']
+
+    def _position(self, rowid):
+        return self._order().position(rowid, self.sort_descending)
+
+    # Function to find the row id of a name by bisection over the name order
+    def _find(self, name):
+        order = self._order('name').values
+        names = self.columns.names
+        key = name.lower()
+        i = bisect_left(order, key, key=lambda rowid: names[rowid].lower())
+        while i < len(order) and names[order[i]].lower() == key:
+            if names[order[i]] == name:
+                return order[i]
+            i += 1
+        return None
+
+    def get(self, name):
+        rowid = self._find(name)
+        return None if rowid is None else self._row(rowid)
+
+    def _check_unique(self, name):
+        if self._find(name) is not None:
+            raise DuplicateName('a property named %s already exists' % name)
+
+    def all(self):
+        return RowSequence(self.columns, self._order().view(self.sort_descending))
+
+    def sort(self, column, descending=False):
+        if column not in COLUMNS:
+            raise ValueError('Unknown column: %s' % column)
+        self.sort_column = column
+        self.sort_descending = descending
+
+    def search(self, criteria):
+        if criteria.get('name') and criteria.get('name_match') == 'fuzzy':
+            return self._fuzzy_search(criteria)
+        rowids = self._indexes().search(criteria, matches, self._row)
+        if rowids is None:
+            return RowSequence(self.columns, array('q', self._order().view(self.sort_descending)))
+        return RowSequence(self.columns, self._order().sort(rowids, self.sort_descending))
+
+    def _fuzzy_search(self, criteria):
+        index = self._fuzzy_index()
+        index.build()
+        top_k = criteria.get('top_k') or FUZZY_TOP_K
+        filters = dict(criteria, name=None)
+        names = self.columns.names
+        pairs = ((rowid, names[rowid]) for rowid in index.candidates(criteria['name'], max(20 * top_k, 1000))
+                 if matches(self._row(rowid), filters))
+        return RowSequence(self.columns, array('q', rank_by_similarity(criteria['name'], pairs, top_k)))
+
+    # Function to add a row to the indexes and orders built so far, or just to
+    # those of the given fields; the aggregates take every change, as a rename can
+    # move a listing between training splits
+    def _link(self, rowid, fields=COLUMNS):
+        self.links += 1
+        prop = self._row(rowid)
+        if self.indexes is not None:
+            for index in self.indexes.all:
+                if index.column in fields:
+                    index.add(rowid, prop)
+        for column, order in self.sort_orders.items():
+            if column in fields:
+                order.insert(rowid)
+        if self.fuzzy is not None and 'name' in fields:
+            self.fuzzy.add(rowid, self.columns.names[rowid])
+        if self.aggregates is not None:
+            for aggregate in self.aggregates.values():
+                aggregate.add(prop)
+
+    # Function to drop a row from the indexes and orders (or those of the given
+    # fields); call it before its values change
+    def _unlink(self, rowid, fields=COLUMNS):
+        self.links += 1
+        prop = self._row(rowid)
+        if self.indexes is not None:
+            for index in self.indexes.all:
+                if index.column in fields:
+                    index.remove(rowid, prop)
+        for column, order in self.sort_orders.items():
+            if column in fields:
+                order.remove(rowid)
+        if self.fuzzy is not None and 'name' in fields:
+            self.fuzzy.remove(rowid, self.columns.names[rowid])
+        if self.aggregates is not None:
+            for aggregate in self.aggregates.values():
+                aggregate.remove(prop)
+
+    def add(self, property):
+        with self._writing():
+            self._check_unique(property['name'])
+            self._reserve(1)
+            rowid = self.columns.append(property)
+            self._link(rowid)
+        self.history.record('add %s' % property['name'], [('add', [self.columns.to_dict(rowid)])],
+                            [('remove', [property['name']])])
+        self._notify('inserted', self._position(rowid), self._row(rowid))
+
+    def remove(self, name):
+        with self._writing():
+            rowid = self._find(name)
+            if rowid is None:
+                return
+            position = self._position(rowid)
+            prop = self.columns.to_dict(rowid)
+            self._unlink(rowid)
+            self.columns.delete(rowid)
+        self.history.record('remove %s' % name, [('remove', [name])], [('add', [prop])])
+        self._notify('deleted', position, prop)
+
+    # Remove many properties at once; the orders and indexes are rebuilt on next use
+    def remove_many(self, names):
+        with self._writing():
+            rowids = [rowid for rowid in map(self._find, names) if rowid is not None]
+            if not rowids:
+                return
+            removed = [self.columns.to_dict(rowid) for rowid in rowids]
+            self.columns.delete_many(rowids)
+            self.sort_orders = {}
+            self.indexes = None
+            self.aggregates = None
+            self.fuzzy = None
+        self.history.record('remove %d properties' % len(removed),
+                            [('remove', [prop['name'] for prop in removed])], [('add', removed)])
+        self._notify('reset')
+
+    def update(self, name, property):
+        with self._writing():
+            rowid = self._find(name)
+            if rowid is None:
+                return
+            new_name = property.get('name', name)
+            if new_name != name:
+                self._check_unique(new_name)
+            position = self._position(rowid)
+            old = self.columns.to_dict(rowid)
+            fields = [column for column in property if column in COLUMNS]
+            self._unlink(rowid, fields)
+            self.columns.set(rowid, property)
+            self._link(rowid, fields)
+        self.history.record('update %s' % name, [('update', name, dict(property))],
+                            [('update', new_name, {column: old[column] for column in property if column in COLUMNS})])
+        new_position = self._position(rowid)
+        prop = self._row(rowid)
+        if new_position == position:
+            self._notify('updated', position, prop)
+        else:
+            self._notify('deleted', position, prop)
+            self._notify('inserted', new_position, prop)
+
+    # Apply many (name, property) updates at once; renames are not supported here
+    def update_many(self, changes):
+        for name, property in changes:
+            if property.get('name', name) != name:
+                raise ValueError('update_many cannot rename %s' % name)
+        with self._writing():
+            changes = [(name, property, rowid) for (name, property), rowid
+                       in zip(changes, map(self._find, (name for name, _ in changes))) if rowid is not None]
+            if not changes:
+                return
+            forward, inverse = set_operations([(name, property) for name, property, _ in changes], self.get)
+            for _, property, rowid in changes:
+                self.columns.set(rowid, property)
+            self.sort_orders = {column: order for column, order in self.sort_orders.items() if column == 'name'}
+            self.indexes = None
+            self.aggregates = None
+        self.history.record('update %d properties' % len(changes), forward, inverse)
+        self._notify('reset')
+
+    # Add many properties at once, skipping (and returning) names already taken
+    def add_many(self, properties):
+        added, skipped, seen = [], [], set()
+        with self._writing():
+            for prop in properties:
+                if prop['name'] in seen or self._find(prop['name']) is not None:
+                    skipped.append(prop['name'])
+                else:
+                    seen.add(prop['name'])
+                    added.append(prop)
+            if not added:
+                return skipped
+            self._reserve(len(added))
+            rowids = self.columns.append_many(added)
+            self.sort_orders = {}
+            self.indexes = None
+            self.aggregates = None
+            if self.fuzzy is not None:
+                for rowid in rowids:
+                    self.fuzzy.add(rowid, self.columns.names[rowid])
+        self.history.record('add %d properties' % len(added), [('add', [self.columns.to_dict(rowid) for rowid in rowids])],
+                            [('remove', [prop['name'] for prop in added])])
+        self._notify('reset')
+        return skipped
+
+    # Every change is in the file already; saving also compacts it once deleted
+    # rows and replaced names take up enough of it
+    def save(self):
+        with self._writing():
+            if self.columns.garbage() > COMPACT_GARBAGE:
+                self._rewrite()
+        self.flush()
+
+    def sync(self):
+        if self.columns is None:
+            return []
+        file_id = locking.file_id(self.filename)
+        if (file_id is None or file_id == self.file_id) and self.columns.changes() == self.changes:
+            return []
+        with locking.locked(self.filename):
+            changed = self._catch_up()
+        if changed:
+            self._notify('reset')
+        return []
+
+    # Function to write the changed pages of the map to disk
+    def flush(self):
+        if self.columns is not None:
+            self.columns.flush()
+
+    def unsaved_changes(self):
+        return False
+
+    def close(self):
+        if self.columns is not None:
+            self.columns.flush()
+            self.columns.close()
+            self.columns = None
+
+
+# Backends open_store() can open
+BACKENDS = ('json', 'sqlite', 'binary')
+
+
+# Function to open the configured storage backend
+def open_store(backend, filename):
+    if backend == 'json':
+        return JsonStore(filename)
+    if backend == 'sqlite':
+        return SqliteStore(os.path.splitext(filename)[0] + '.db', json_filename=filename)
+    if backend == 'binary':
+        return BinaryStore(os.path.splitext(filename)[0] + '.bin', json_filename=filename)
+    raise ValueError('Unknown storage backend: %s' % backend)
@@ -0,0 +1,230 @@
+import csv
+import json
+import os
+import threading
+
+# Streaming reader and writer for property files.
+#
+# Three layouts are understood:
+#   - a JSON array (the legacy properties.json layout, on one line or many)
+#   - NDJSON, one property object per line (.ndjson / .jsonl)
+#   - CSV with a header row naming the property fields (.csv)
+# Records are parsed incrementally from fixed-size chunks, validated one at a
+# time and handed out in batches, so memory stays bounded by the batch size.
+# The writer emits one record per line, so arrays written here stay valid
+# JSON for other tools while still being cheap to stream back in.
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 1 << 16
+
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+CSV_EXTENSIONS = ('.csv',)
+
+
+# File wrapper counting the characters read through it, for progress reports
+class _CountingFile:
+    def __init__(self, file):
+        self.file = file
+        self.consumed = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.consumed += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self.file:
+            self.consumed += len(line)
+            yield line
+
+    def seek(self, offset):
+        self.consumed = offset
+        return self.file.seek(offset)
+
+
+# Function to check a raw record and normalize it into a property dict
+def validate_property(record):
+    if not isinstance(record, dict):
+        raise ValueError('expected an object, got %s' % type(record).__name__)
+    name = record.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('name must be a non-empty string')
+    prop = {'name': name.strip()}
+    for field in ('total_sqft', 'bath', 'price'):
+        value = record.get(field)
+        if value is None or value == '':
+            prop[field] = None
+        elif isinstance(value, bool):
+            raise ValueError('%s must be a number' % field)
+        else:
+            try:
+                prop[field] = float(value)
+            except (TypeError, ValueError):
+                raise ValueError('%s must be a number' % field)
+    bhk = record.get('bhk')
+    if bhk is None or bhk == '':
+        prop['bhk'] = None
+    else:
+        try:
+            prop['bhk'] = int(float(bhk))
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError('bhk must be an integer')
+        if prop['bhk'] != float(bhk):
+            raise ValueError('bhk must be an integer')
+    return prop
+
+
+# Function to yield the records of an NDJSON file
+def _iter_ndjson(file):
+    for line in file:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+# Function to yield the elements of a JSON array without loading it whole
+def _iter_json_array(file, buffer):
+    decoder = json.JSONDecoder()
+    pos = buffer.index('[') + 1
+    eof = False
+    while True:
+        # Skip separators, reading more input when the buffer runs out
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+        if pos >= len(buffer):
+            raise ValueError('unterminated JSON array')
+        if buffer[pos] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+            complete = end < len(buffer) or eof
+        except ValueError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            # The element may continue in the next chunk
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield record
+        pos = end
+        if pos > CHUNK_SIZE:
+            buffer, pos = buffer[pos:], 0
+
+
+# Function to yield the records of an open JSON array or NDJSON file
+def _iter_file(file):
+    buffer = ''
+    while not buffer.strip():
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer += chunk
+    if buffer.lstrip().startswith('['):
+        yield from _iter_json_array(file, buffer)
+    else:
+        file.seek(0)
+        yield from _iter_ndjson(file)
+
+
+# Function to yield the raw records of a property file in any supported layout.
+# When given, progress(fraction) is called with the share of the file consumed.
+def iter_records(path, progress=None):
+    is_csv = os.path.splitext(path)[1].lower() in CSV_EXTENSIONS
+    size = os.path.getsize(path)
+    with open(path, 'r', newline='' if is_csv else None) as raw:
+        file = _CountingFile(raw)
+        for record in csv.DictReader(file) if is_csv else _iter_file(file):
+            yield record
+            if progress:
+                progress(min(1.0, file.consumed / size))
+
+
+# Function to yield validated properties in batches. Invalid records are
+# skipped; when errors is a list, (record number, message) pairs are added to it.
+def iter_properties(path, batch_size=BATCH_SIZE, errors=None, progress=None):
+    batch = []
+    for number, record in enumerate(iter_records(path, progress), 1):
+        try:
+            batch.append(validate_property(record))
+        except ValueError as error:
+            if errors is not None:
+                errors.append((number, str(error)))
+            continue
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Function to write properties one record at a time, replacing path atomically:
+# the temp file is synced to disk before it is renamed over the old one.
+# NDJSON is used for .ndjson/.jsonl paths, a one-record-per-line JSON array otherwise.
+def write_properties(path, properties):
+    ndjson = os.path.splitext(path)[1].lower() in NDJSON_EXTENSIONS
+    temp_path = path + '.tmp'
+    count = 0
+    with open(temp_path, 'w') as file:
+        if not ndjson:
+            file.write('[')
+        for prop in properties:
+            if not ndjson:
+                file.write(',\n' if count else '\n')
+            file.write(json.dumps(dict(prop)))
+            if ndjson:
+                file.write('\n')
+            count += 1
+        if not ndjson:
+            file.write('\n]\n')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return count
+
+
+# Parse and validate a property file on a background thread. The Tk side polls
+# rows and fraction for progress; properties, errors and error are final once
+# done is set.
+class ImportJob:
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.properties = []
+        self.errors = []  # (record number, message) of skipped records
+        self.error = None  # Set when the file as a whole could not be read
+        self.rows = 0
+        self.fraction = 0.0
+        self.cancelled = False
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='property-import', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _progress(self, fraction):
+        self.fraction = fraction
+
+    def _run(self):
+        try:
+            for batch in iter_properties(self.path, self.batch_size, self.errors, self._progress):
+                if self.cancelled:
+                    break
+                self.properties.extend(batch)
+                self.rows = len(self.properties)
+        except (OSError, ValueError, csv.Error) as error:
+            self.error = error
+        finally:
+            self.done.set()
@@ -1,102 +1,485 @@
-import json
-import tkinter as tk
-from tkinter import messagebox, simpledialog, Toplevel, Label, Entry, Button, ttk
-from PIL import Image, ImageTk
-import joblib  # Assuming your prediction model is saved using joblib
+import time
+START_TIME = time.perf_counter()  # For the time-to-first-paint report
 
-# Sample data structure
+import os
+import threading
+import tkinter as tk
+from tkinter import messagebox, simpledialog, filedialog, Toplevel, Label, Entry, Button, ttk
+import icons
+import storage
+import streaming
+from engine import ModelNotLoaded, PropertyEngine, parse_criteria
+from livesearch import LiveSearch
+from metrics import METRICS
+from virtual_table import create_virtual_table
+
+# Properties currently listed in the table, in display order
 properties = []
 
-# Original properties loaded from file
-original_properties = []
+# True while the table lists store.all(), False while it lists search results
+showing_all = True
+
+# Search results listed in the table, while showing_all is False
+search_results = None
+
+# True while properties are still streaming in from the file
+properties_loading = True
+
+# Bulk import running on a worker thread, if any
+import_job = None
+
+# Performance panel toggled with F12, while open
+debug_panel = None
+
+# Analytics panel, while open
+analytics_panel = None
 
 # File to store properties
 FILENAME = 'properties.json'
 
+# Conflicts listed in one warning after syncing with other instances
+CONFLICTS_SHOWN = 10
+
+# Price ranges in the analytics panel's distribution, the last one open-ended
+HISTOGRAM_BINS = 10
+
+# Quiet time after a keystroke in the filter bar before searching, and how often
+# the running search is polled for results (milliseconds)
+FILTER_DELAY_MS = 250
+FILTER_POLL_MS = 30
+
+# How often a sort order or index being built on a worker thread is checked on (milliseconds)
+BUILD_POLL_MS = 50
+
+# Columns the table can be sorted on, whose sort orders are built ahead of time
+SORT_COLUMNS = ('name', 'price', 'total_sqft', 'bhk', 'bath')
+
+# How often the price model is refitted from the listings when they changed (milliseconds)
+MODEL_REFRESH_MS = 1000
+
+# Storage backend: 'json' (snapshot + journal), 'sqlite' or 'binary' (memory-mapped file)
+STORAGE_BACKEND = os.environ.get('PROPERTY_STORE', 'json')
+
+# Shared property engine; this window is one of its front ends (server.py is another)
+engine = PropertyEngine(storage.open_store(STORAGE_BACKEND, FILENAME))
+store = engine.store
+
+# Searches for the filter bar, run on a worker thread
+live_search = LiveSearch(engine.search)
+filter_job = None  # Pending root.after id of the debounced search
+filter_offset = None  # Scroll position for the results of the search running
+store_builds = {}  # Part of the store being built on a worker thread -> callbacks waiting for it
+
 # Sorting variables
 sort_column = None
 sort_descending = False
 
-# Load the prediction model
-lr_clf_loaded = joblib.load('linear_regression_model.pkl')  # Update with your actual model file
+# Prediction model, loaded by the engine on a background thread after the window is up
+lr_clf_loaded = None
+model_loading = True
+model_load_result = None  # (model, error) handed over by the loader thread
+model_load_time = None
 
 # Function to predict price
+@METRICS.timed('predict_price')
 def predict_price(total_sqft, bath, bhk):
-    if lr_clf_loaded:
-        try:
-            total_sqft = float(total_sqft)
-            bath = float(bath)
-            bhk = int(bhk)
-            price_prediction = lr_clf_loaded.predict([[total_sqft, bath, bhk]])
-            return round(price_prediction[0], 2)  # Return rounded prediction
-        except ValueError:
-            messagebox.showwarning("Warning", "Total Sqft, Bath, and BHK must be numeric values.")
+    if model_loading and engine.model is None:
+        messagebox.showinfo("Info", "The prediction model is still loading.")
+        return None
+    try:
+        return engine.predict_price(total_sqft, bath, bhk)
+    except ModelNotLoaded:
+        messagebox.showwarning("Warning", "Prediction model not found or loaded.")
+    except (TypeError, ValueError):
+        messagebox.showwarning("Warning", "Total Sqft, Bath, and BHK must be numeric values.")
+
+# Function called on the loader thread once the model is loaded
+def on_model_loaded(model, error):
+    global model_load_result, model_load_time
+    model_load_time = time.perf_counter() - START_TIME
+    model_load_result = (model, error)
+
+# Function to pick up the loaded model on the Tk thread and enable prediction
+def check_model_loaded():
+    global lr_clf_loaded, model_loading
+    if model_load_result is None:
+        root.after(50, check_model_loaded)
+        return
+    model, error = model_load_result
+    lr_clf_loaded = model
+    model_loading = False
+    update_button_states()
+    if error is None:
+        show_status("Prediction model loaded in %.0f ms" % (model_load_time * 1000))
     else:
+        show_status("Prediction model not found or loaded: %s" % error)
+
+# Function to enable the buttons that can be used right now
+def update_button_states():
+    state = tk.DISABLED if properties_loading else tk.NORMAL
+    for button in frame_buttons.winfo_children():
+        button.config(state=state)
+    if import_job is not None:
+        btn_import.config(state=tk.DISABLED)
+    if engine.model is None:
+        btn_reprice_all.config(state=tk.DISABLED)
+        btn_reprice_selection.config(state=tk.DISABLED)
+
+# Function to show a message in the status bar
+def show_status(message):
+    status_bar.config(text=message)
+
+# Function to report the time from start-up to the first painted window
+def report_first_paint():
+    elapsed = time.perf_counter() - START_TIME
+    METRICS.record('first_paint', elapsed)
+    if model_loading:
+        show_status("First paint in %.0f ms; loading prediction model..." % (elapsed * 1000))
+
+# Function to reprice properties with one vectorized model call and a single save
+@METRICS.timed('reprice_properties')
+def reprice_properties(props):
+    try:
+        repriced, skipped = engine.reprice(props)
+    except ModelNotLoaded:
         messagebox.showwarning("Warning", "Prediction model not found or loaded.")
+        return
+    messagebox.showinfo("Reprice", "Repriced %d properties." % repriced +
+                        (" %d skipped because Total Sqft, Bath or BHK is missing." % skipped if skipped else ""))
 
 # Function to add a new property
+@METRICS.timed('add_property')
 def add_property(property):
-    properties.append(property)
-    properties.sort(key=lambda x: x['name'].lower())  # Maintain sorted order for binary search
-    save_to_file()
-    update_table()
+    try:
+        engine.add(property)
+    except ValueError as error:
+        messagebox.showwarning("Warning", "Invalid property: %s" % error)
 
 # Function to remove a property by name
+@METRICS.timed('remove_property')
 def remove_property(property_name):
-    global properties
-    properties = [prop for prop in properties if prop['name'] != property_name]
-    save_to_file()
-    update_table()
+    try:
+        engine.remove(property_name)
+    except KeyError:
+        messagebox.showwarning("Warning", "Property %s no longer exists." % property_name)
 
 # Function to update a property by name
+@METRICS.timed('update_property')
 def update_property(property_name, updated_property):
-    for i, prop in enumerate(properties):
-        if prop['name'] == property_name:
-            properties[i].update(updated_property)
-            save_to_file()
-            update_table()
-            break
-
-# Binary search function to find a property by name
-def binary_search(property_name):
-    low, high = 0, len(properties) - 1
-    while low <= high:
-        mid = (low + high) // 2
-        if properties[mid]['name'] == property_name:
-            return mid, properties[mid]
-        elif properties[mid]['name'] < property_name:
-            low = mid + 1
-        else:
-            high = mid - 1
-    return None, None
-
-# Function to save properties to a file
+    try:
+        engine.update(property_name, updated_property)
+    except KeyError:
+        messagebox.showwarning("Warning", "Property %s no longer exists." % property_name)
+    except ValueError as error:
+        messagebox.showwarning("Warning", "Invalid property: %s" % error)
+
+# Function to save properties to a file, waiting for pending writes to finish
+@METRICS.timed('save_to_file')
 def save_to_file():
-    with open(FILENAME, 'w') as file:
-        json.dump(properties, file)
-
-# Function to read properties from a file
+    engine.save()
+    show_status("Saved to %s" % FILENAME)
+
+# Function to show in the title bar whether some changes are not on disk yet
+def check_unsaved_changes():
+    title = "Real Estate Management System"
+    if store.unsaved_changes():
+        title += " (unsaved changes)"
+    if root.title() != title:
+        root.title(title)
+    writer = getattr(store, 'writer', None)
+    if writer is not None and writer.error is not None:
+        show_status("Could not save changes: %s" % writer.error)
+    show_conflicts(store.sync())
+    root.after(250, check_unsaved_changes)
+
+# Function to report edits from another instance that clashed with ours
+def show_conflicts(conflicts):
+    if not conflicts:
+        return
+    show_status(conflicts[-1]['message'])
+    lines = [conflict['message'] for conflict in conflicts[:CONFLICTS_SHOWN]]
+    if len(conflicts) > CONFLICTS_SHOWN:
+        lines.append("... and %d more" % (len(conflicts) - CONFLICTS_SHOWN))
+    messagebox.showwarning("Changed elsewhere", "\n".join(lines))
+
+# Function to read properties from a file in batches, filling the table as they arrive
 def read_from_file():
-    global properties, original_properties
-    try:
-        with open(FILENAME, 'r') as file:
-            properties = json.load(file)
-            original_properties = properties[:]  # Create a copy of properties for resetting
-    except FileNotFoundError:
-        properties = []
-        original_properties = []
-
-# Function to reset properties to original state
+    global properties_loading
+    properties_loading = True
+    live_search.cancel()
+    update_button_states()
+    loader = store.load_iter()
+    started = time.perf_counter()
+
+    def step():
+        global properties_loading
+        try:
+            count = next(loader)
+        except StopIteration:
+            show_status("Sorting properties...")
+            when_built(finish, [sort_column or 'name'])
+            return
+        if count <= streaming.BATCH_SIZE:
+            update_table()
+        else:
+            table.refresh()
+        show_status("Loading properties... %d" % count)
+        root.after(1, step)
+
+    # Function to list the properties once their sort order was built off the Tk thread
+    def finish():
+        global properties_loading
+        properties_loading = False
+        show_listing()
+        METRICS.record('read_from_file', time.perf_counter() - started)
+        update_button_states()
+        prepare_sorts()
+        errors = getattr(store, 'load_errors', [])
+        renamed = sum(1 for kind, _ in errors if kind == 'duplicate')
+        show_status("Loaded %d properties" % len(store.all()) +
+                    (" (%d invalid records skipped)" % (len(errors) - renamed) if len(errors) > renamed else "") +
+                    (" (%d duplicate names renamed)" % renamed if renamed else ""))
+
+    step()
+
+# Function to import a CSV, JSON or NDJSON file. Parsing and validation run on a
+# worker thread polled from the Tk loop; the result is merged and saved in one go.
+def import_gui():
+    global import_job
+    path = filedialog.askopenfilename(title="Import Properties",
+                                      filetypes=[("Property files", "*.csv *.json *.ndjson *.jsonl"), ("All files", "*.*")])
+    if not path:
+        return
+    import_job = streaming.ImportJob(path).start()
+    update_button_states()
+
+    dialog = Toplevel(root)
+    dialog.title("Import Properties")
+    dialog.transient(root)
+    dialog.protocol("WM_DELETE_WINDOW", import_job.cancel)
+    label = Label(dialog, text="Reading %s..." % os.path.basename(path))
+    label.pack(padx=10, pady=5)
+    progress = ttk.Progressbar(dialog, length=300, maximum=1.0)
+    progress.pack(padx=10, pady=5)
+    Button(dialog, text="Cancel", command=import_job.cancel).pack(pady=5)
+
+    def poll():
+        global import_job
+        job = import_job
+        if not job.done.is_set():
+            progress['value'] = job.fraction
+            label.config(text="Read %d properties" % job.rows)
+            root.after(100, poll)
+            return
+        dialog.destroy()
+        import_job = None
+        if job.error is not None:
+            messagebox.showerror("Import", "Could not import %s: %s" % (path, job.error))
+        elif job.cancelled:
+            show_status("Import cancelled")
+        else:
+            duplicates = store.add_many(job.properties)
+            show_status("Imported %d properties" % (len(job.properties) - len(duplicates)) +
+                        (" (%d invalid records skipped)" % len(job.errors) if job.errors else "") +
+                        (" (%d already existing names skipped)" % len(duplicates) if duplicates else ""))
+        update_button_states()
+
+    root.after(100, poll)
+
+# Function to build what the store still lacks for sorting on columns and for
+# searching with criteria (see unbuilt_parts() in storage.py) on a worker thread,
+# one part at a time, and call then() from the Tk loop once all of it is in place.
+# A part built while the rows changed is dropped and built again.
+def when_built(then, columns=(), criteria=None):
+    parts = store.unbuilt_parts(columns, criteria)
+    if not parts:
+        then()
+        return
+    part = parts[0]
+    waiting = store_builds.setdefault(part, [])
+    waiting.append(lambda: when_built(then, columns, criteria))
+    if len(waiting) > 1:  # Already being built
+        return
+    job = store.build_job(part)
+    result = {}
+
+    def run():
+        try:
+            result['built'] = job()
+        except Exception as error:  # The store was reloaded or closed under it
+            result['error'] = error
+
+    thread = threading.Thread(target=run, name='store-builder', daemon=True)
+    thread.start()
+    root.after(BUILD_POLL_MS, poll_build, part, thread, result)
+
+# Function to put a part built on a worker thread in place and go on with what waits for it
+def poll_build(part, thread, result):
+    if thread.is_alive():
+        root.after(BUILD_POLL_MS, poll_build, part, thread, result)
+        return
+    if 'error' in result:  # Built here instead, so a failing build cannot be retried forever
+        result['built'] = store.build_job(part)()
+    store.install_part(result['built'])
+    for callback in store_builds.pop(part):
+        callback()
+
+# Function to build the sort order of every column off the Tk thread, so clicking a
+# header later does not have to sort; the search indexes and the fuzzy name index
+# are built next
+def prepare_sorts():
+    if not properties_loading:
+        when_built(lambda: root.after(50, prepare_fuzzy_search), SORT_COLUMNS, {})
+
+# Function to index names for fuzzy search a few thousand rows per idle callback
+def prepare_fuzzy_search():
+    if not properties_loading and not store.prepare_fuzzy_search():
+        root.after(50, prepare_fuzzy_search)
+
+# Function to export the properties listed in the table, one record at a time
+def export_gui():
+    path = filedialog.asksaveasfilename(title="Export Properties", defaultextension=".ndjson",
+                                        filetypes=[("NDJSON", "*.ndjson"), ("JSON", "*.json")])
+    if path:
+        count = streaming.write_properties(path, table.rows)
+        show_status("Exported %d properties to %s" % (count, path))
+
+# Function to reset properties to their state at load; Redo brings the changes back
 def reset_properties():
-    global properties
-    properties = original_properties[:]
-    update_table()
+    store.reset()
+    show_status("Restored the properties as loaded")
+
+# Function to undo the last change
+@METRICS.timed('undo')
+def undo_change(event=None):
+    label = store.history.undo_label()
+    if label and not properties_loading:
+        store.undo()
+        show_status("Undid %s" % label)
+
+# Function to redo the last undone change
+@METRICS.timed('redo')
+def redo_change(event=None):
+    label = store.history.redo_label()
+    if label and not properties_loading:
+        store.redo()
+        show_status("Redid %s" % label)
+
+# Function to name the current version so it can be restored later
+def create_checkpoint():
+    name = simpledialog.askstring("Checkpoint", "Name for this version:", parent=root)
+    if name and name.strip():
+        store.checkpoint(name.strip())
+        show_status("Checkpoint %s created" % name.strip())
+
+# Function to go back (or forward) to a named checkpoint
+def restore_checkpoint(name):
+    if not properties_loading:
+        store.restore(name)
+        show_status("Restored checkpoint %s" % name)
+
+# Function to refresh the Edit menu labels and checkpoint list before it opens
+def update_edit_menu():
+    undo_label, redo_label = store.history.undo_label(), store.history.redo_label()
+    edit_menu.entryconfig(0, label="Undo %s" % undo_label if undo_label else "Undo",
+                          state=tk.NORMAL if undo_label and not properties_loading else tk.DISABLED)
+    edit_menu.entryconfig(1, label="Redo %s" % redo_label if redo_label else "Redo",
+                          state=tk.NORMAL if redo_label and not properties_loading else tk.DISABLED)
+    checkpoints_menu.delete(0, tk.END)
+    for name in sorted(store.history.checkpoints):
+        checkpoints_menu.add_command(label=name, command=lambda name=name: restore_checkpoint(name))
+
+# Function to describe a fit for the status bar and the Model menu
+def describe_fit(r2, rmse):
+    if r2 is None:
+        return "no holdout score" if rmse is None else "holdout RMSE %.2f" % rmse
+    return "holdout R² %.3f, RMSE %.2f" % (r2, rmse)
+
+# Function to report a newly fitted model version, and whether it replaced the one in use
+def show_model_version(model):
+    fit = describe_fit(model.info['r2'], model.info['rmse'])
+    if engine.model is model:
+        show_status("Price model version %d trained on %d listings (%s)" % (
+            model.version, model.info['training_rows'], fit))
+    else:
+        show_status("Price model version %d scored worse (%s); keeping version %d" % (
+            model.version, fit, engine.model_version()))
+    update_button_states()
+
+# Function to fit a new price model version from the listings right away
+@METRICS.timed('retrain_model')
+def retrain_model():
+    if properties_loading:
+        return
+    model = engine.retrain()
+    if model is None:
+        messagebox.showwarning("Warning", "Too few priced listings to fit a price model.")
+    else:
+        show_model_version(model)
+
+# Function to refit the price model every MODEL_REFRESH_MS once the listings changed,
+# if learning from edits is on
+def refresh_model():
+    if not properties_loading:
+        model = engine.refresh_model()
+        if model is not None:
+            show_model_version(model)
+    root.after(MODEL_REFRESH_MS, refresh_model)
+
+# Function to turn learning from edits on or off from the Model menu
+def toggle_learning():
+    engine.learning = learning_var.get()
+
+# Function to go back to an earlier price model version; learning from edits stops
+def use_model_version(number):
+    engine.use_version(number)
+    learning_var.set(engine.learning)
+    show_status("Using price model version %d" % number)
+    update_button_states()
+
+# Function to list the model versions with their holdout scores before the Model menu opens
+def update_model_menu():
+    learning_var.set(engine.learning)
+    versions_menu.delete(0, tk.END)
+    if properties_loading:
+        return
+    info = engine.model_info()
+    version_var.set(-1 if info['version'] is None else info['version'])
+    for version in info['versions']:
+        label = "Version %d: %s (%s)" % (version['version'],
+                                         "loaded from file" if version['version'] == 0 else
+                                         "%d listings" % version['training_rows'],
+                                         describe_fit(version['holdout_r2'], version['holdout_rmse']))
+        versions_menu.add_radiobutton(label=label, variable=version_var, value=version['version'],
+                                      command=lambda number=version['version']: use_model_version(number))
 
 # Function to update the table with current properties data
-def update_table():
-    tree.delete(*tree.get_children())
-    for prop in properties:
-        tree.insert('', 'end', values=(prop['name'], prop['total_sqft'], prop['bath'], prop['price'], prop['bhk']))
+@METRICS.timed('update_table')
+def update_table(offset=None):
+    global properties, showing_all
+    properties = store.all()
+    showing_all = True
+    table.set_rows(properties, offset=offset)
+
+# Function to apply a store change event to the table, touching only the changed row
+@METRICS.timed('on_store_change')
+def on_store_change(kind, position, property):
+    if not showing_all or live_search.busy():
+        run_filter()  # The results, or the search in flight, predate the change
+        if not showing_all:
+            return
+    if kind == 'reset' or position is None:
+        update_table()
+    elif kind == 'inserted':
+        table.row_inserted(position)
+    elif kind == 'deleted':
+        table.row_deleted(position)
+    else:
+        table.row_updated(position)
+
+# Function to get the values shown in a table row for a property
+def row_values(prop):
+    return (prop['name'], prop['total_sqft'], prop['bath'], prop['price'], prop['bhk'])
 
 sort_directions = {
     'name': '',
@@ -106,16 +489,18 @@ sort_directions = {
     'bhk': ''
 }
 
+@METRICS.timed('sort_table')
 def sort_table(column):
     global sort_column, sort_descending
+    if properties_loading:
+        return
     if sort_column == column:
         sort_descending = not sort_descending
     else:
         sort_column = column
         sort_descending = False
 
-    properties.sort(key=lambda x: x[column], reverse=sort_descending)
-    update_table()
+    when_built(lambda: show_sorted(column), [column])
     
     for col in sort_directions:
         sort_directions[col] = ''
@@ -128,6 +513,13 @@ def sort_table(column):
     tree.heading('Price', text='Price' + sort_directions['price'], command=lambda: sort_table('price'))
     tree.heading('BHK', text='BHK' + sort_directions['bhk'], command=lambda: sort_table('bhk'))
 
+# Function to list the properties in the order chosen, once its sort order is built;
+# a header clicked meanwhile has the last word
+def show_sorted(column):
+    if column == sort_column and not properties_loading:
+        store.sort(column, sort_descending)
+        show_listing(offset=0)
+
 # Function to display the property form
 def show_property_form(property=None, title="Add Property", callback=None):
     form = Toplevel(root)
@@ -153,10 +545,9 @@ def show_property_form(property=None, title="Add Property", callback=None):
             messagebox.showwarning("Warning", "Total Sqft, Bath, and Price must be numbers, and BHK must be an integer.")
             return
         
-        # Predict price
-        predicted_price = predict_price(total_sqft, bath, bhk)
-        if predicted_price is not None:
-            price = predicted_price  # Update price with predicted value
+        # Predict the price only when none was entered
+        if price is None:
+            price = predict_price(total_sqft, bath, bhk)
         
         if callback:
             callback({
@@ -168,7 +559,6 @@ def show_property_form(property=None, title="Add Property", callback=None):
             })
         
         form.destroy()
-        update_table()
 
     Label(form, text="Name:").grid(row=0, column=0, padx=5, pady=5)
     entry_name = Entry(form)
@@ -197,7 +587,20 @@ def show_property_form(property=None, title="Add Property", callback=None):
         entry_price.insert(0, property.get('price', ''))
         entry_bhk.insert(0, property.get('bhk', ''))
     
-    Button(form, text="Submit", command=on_submit).grid(row=5, columnspan=2, pady=10)
+    # Function to fill in the predicted price, which can still be edited before submitting
+    def on_suggest_price():
+        try:
+            total_sqft, bath, bhk = float(entry_total_sqft.get()), float(entry_bath.get()), int(entry_bhk.get())
+        except ValueError:
+            messagebox.showwarning("Warning", "Enter Total Sqft, Bath, and BHK to suggest a price.", parent=form)
+            return
+        price = predict_price(total_sqft, bath, bhk)
+        if price is not None:
+            entry_price.delete(0, tk.END)
+            entry_price.insert(0, price)
+
+    Button(form, text="Suggest Price", command=on_suggest_price).grid(row=3, column=2, padx=5, pady=5)
+    Button(form, text="Submit", command=on_submit).grid(row=5, columnspan=3, pady=10)
     form.transient(root)
     form.grab_set()
     root.wait_window(form)
@@ -206,103 +609,301 @@ def add_property_gui():
     show_property_form(title="Add Property", callback=lambda property: add_property(property))
 
 def remove_property_gui():
-    selected = tree.selection()
+    selected = table.selected_rows()
     if selected:
-        property_name = tree.item(selected[0])['values'][0]
+        property_name = selected[0]['name']
         remove_property(property_name)
     else:
         messagebox.showwarning("Warning", "Select a property to remove.")
         
 def update_property_gui():
-    selected = tree.selection()
+    selected = table.selected_rows()
     if selected:
-        property_name = tree.item(selected[0])['values'][0]
-        _, property = binary_search(property_name)
+        property_name = selected[0]['name']
+        property = engine.find(property_name)
         show_property_form(property=property, title="Update Property", callback=lambda updated_property: update_property(property_name, updated_property))
     else:
         messagebox.showwarning("Warning", "Select a property to update.")
 
-def search_property_gui():
-    form = Toplevel(root)
-    form.title("Search Property")
-
-    def on_submit():
-        name = entry_name.get().strip()
-        total_sqft = entry_total_sqft.get().strip()
-        bath = entry_bath.get().strip()
-        min_price = entry_min_price.get().strip()
-        max_price = entry_max_price.get().strip()
-        bhk = entry_bhk.get().strip()
-
-        try:
-            total_sqft = float(total_sqft) if total_sqft else None
-            bath = float(bath) if bath else None
-            min_price = float(min_price) if min_price else None
-            max_price = float(max_price) if max_price else None
-            bhk = int(bhk) if bhk else None
-        except ValueError:
-            messagebox.showwarning("Warning", "Total Sqft, Bath, and Price must be numbers, and BHK must be an integer.")
-            return
+def reprice_all_gui():
+    reprice_properties(engine.all())
 
-        filtered_properties = [prop for prop in properties if
-                               (not name or prop['name'].lower() == name.lower()) and
-                               (total_sqft is None or (prop['total_sqft'] is not None and prop['total_sqft'] == total_sqft)) and
-                               (bath is None or (prop['bath'] is not None and prop['bath'] == bath)) and
-                               (min_price is None or (prop['price'] is not None and prop['price'] >= min_price)) and
-                               (max_price is None or (prop['price'] is not None and prop['price'] <= max_price)) and
-                               (bhk is None or (prop['bhk'] is not None and prop['bhk'] == bhk))]
-
-        if filtered_properties:
-            tree.delete(*tree.get_children())
-            for prop in filtered_properties:
-                tree.insert('', 'end', values=(prop['name'], prop['total_sqft'], prop['bath'], prop['price'], prop['bhk']))
-            form.destroy()
+def reprice_selection_gui():
+    selected = table.selected_rows()
+    if selected:
+        reprice_properties(selected)
+    else:
+        messagebox.showwarning("Warning", "Select properties to reprice.")
+
+# Function to read the filter bar into search criteria; None when every field is empty
+def filter_criteria():
+    criteria = parse_criteria({key: variable.get() for key, variable in filter_fields.items()})
+    if criteria['name'] or any(criteria[key] is not None for key in criteria if key not in ('name', 'name_match')):
+        return criteria
+    return None
+
+# Function to search again a moment after the last edit in the filter bar
+def on_filter_changed(*args):
+    global filter_job
+    if filter_job is not None:
+        root.after_cancel(filter_job)
+    filter_job = root.after(FILTER_DELAY_MS, run_filter, 0)
+
+# Function to start the search for the filter bar on the worker thread, or to list
+# every property when the bar is empty. The results replace the table's rows when
+# they arrive (see poll_filter), scrolled to offset (None keeps the position).
+@METRICS.timed('filter')
+def run_filter(offset=None):
+    global filter_job, filter_offset
+    if filter_job is not None:
+        root.after_cancel(filter_job)
+        filter_job = None
+    if properties_loading:
+        return
+    try:
+        criteria = filter_criteria()
+    except ValueError as error:
+        show_status("Filter: %s" % error)
+        return
+    if criteria is None:
+        live_search.cancel()
+        if not showing_all:
+            update_table(offset=0)
+            show_status("Filter cleared")
+        return
+    if criteria['name'] and criteria['name_match'] == 'fuzzy' and not store.prepare_fuzzy_search():
+        show_status("Indexing names for fuzzy search...")
+        filter_job = root.after(FILTER_DELAY_MS, run_filter, offset)
+        return
+    if store.unbuilt_parts(criteria=criteria):
+        show_status("Preparing the search...")
+        when_built(lambda: None, criteria=criteria)
+        filter_job = root.after(FILTER_DELAY_MS, run_filter, offset)
+        return
+    polling = live_search.busy()
+    engine.prepare_search(criteria)
+    live_search.submit(criteria)
+    filter_offset = offset
+    if not polling:
+        root.after(FILTER_POLL_MS, poll_filter)
+
+# Function to show what the running search delivered: its first page, then its count
+def poll_filter():
+    global search_results, showing_all
+    for kind, value in live_search.results():
+        if kind == 'page':
+            search_results = value
+            showing_all = False
+            table.set_rows(value, offset=filter_offset)
+            show_status("No properties match the filter" if not value else "Counting matches...")
+        elif kind == 'count':
+            search_results.total = value
+            table.refresh()
+            if value:
+                show_status("%d properties match the filter" % value)
         else:
-            messagebox.showinfo("Search Result", "No properties found matching the criteria.")
-
-    Label(form, text="Name:").grid(row=0, column=0, padx=5, pady=5)
-    entry_name = Entry(form)
-    entry_name.grid(row=0, column=1, padx=5, pady=5)
-
-    Label(form, text="Total Sqft:").grid(row=1, column=0, padx=5, pady=5)
-    entry_total_sqft = Entry(form)
-    entry_total_sqft.grid(row=1, column=1, padx=5, pady=5)
-
-    Label(form, text="Bath:").grid(row=2, column=0, padx=5, pady=5)
-    entry_bath = Entry(form)
-    entry_bath.grid(row=2, column=1, padx=5, pady=5)
-
-    Label(form, text="Min Price:").grid(row=3, column=0, padx=5, pady=5)
-    entry_min_price = Entry(form)
-    entry_min_price.grid(row=3, column=1, padx=5, pady=5)
-
-    Label(form, text="Max Price:").grid(row=4, column=0, padx=5, pady=5)
-    entry_max_price = Entry(form)
-    entry_max_price.grid(row=4, column=1, padx=5, pady=5)
-
-    Label(form, text="BHK:").grid(row=5, column=0, padx=5, pady=5)
-    entry_bhk = Entry(form)
-    entry_bhk.grid(row=5, column=1, padx=5, pady=5)
-
-    Button(form, text="Submit", command=on_submit).grid(row=6, columnspan=2, pady=10)
-    form.transient(root)
-    form.grab_set()
-    root.wait_window(form)
+            show_status("Search failed: %s" % value)
+    if live_search.busy():
+        root.after(FILTER_POLL_MS, poll_filter)
+
+# Function to list the properties again, through the filter bar when it is in use
+def show_listing(offset=None):
+    if not showing_all or filter_criteria_set():
+        run_filter(offset)
+    else:
+        update_table(offset)
+
+# Function to tell whether any filter field holds something
+def filter_criteria_set():
+    return any(variable.get().strip() for key, variable in filter_fields.items() if key != 'name_match')
+
+# Function to empty the filter bar, listing every property again
+def clear_filter():
+    for key, variable in filter_fields.items():
+        if key != 'name_match':
+            variable.set('')
+    run_filter()
+
+# Function to write the timing histograms to a JSON metrics file
+def export_metrics():
+    path = filedialog.asksaveasfilename(title="Export Metrics", defaultextension=".json",
+                                        filetypes=[("JSON", "*.json")])
+    if path:
+        METRICS.export(path)
+        show_status("Metrics exported to %s" % path)
+
+# Function to run the next timed action under cProfile
+def profile_next_action():
+    METRICS.arm_profile(os.getcwd())
+    show_status("The next action will be profiled")
+
+# Function to show or hide the performance panel with the timing of each operation
+def toggle_debug_panel(event=None):
+    global debug_panel
+    if debug_panel is not None:
+        debug_panel.destroy()
+        debug_panel = None
+        return
+    debug_panel = panel = Toplevel(root)
+    panel.title("Performance")
+    panel.protocol("WM_DELETE_WINDOW", toggle_debug_panel)
+    columns = ('Operation', 'Calls', 'Mean ms', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms', 'Last ms')
+    metrics_tree = ttk.Treeview(panel, columns=columns, show='headings', height=15)
+    for column in columns:
+        metrics_tree.heading(column, text=column)
+        metrics_tree.column(column, width=180 if column == 'Operation' else 75,
+                            anchor=tk.W if column == 'Operation' else tk.E)
+    metrics_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    profile_label = Label(panel, anchor=tk.W)
+    profile_label.pack(fill=tk.X, padx=10)
+    frame = tk.Frame(panel)
+    frame.pack(pady=10)
+    Button(frame, text="Export Metrics...", command=export_metrics).pack(side=tk.LEFT, padx=5)
+    Button(frame, text="Profile Next Action", command=profile_next_action).pack(side=tk.LEFT, padx=5)
+    Button(frame, text="Reset", command=METRICS.reset).pack(side=tk.LEFT, padx=5)
+
+    def refresh():
+        if not metrics_tree.winfo_exists():
+            return
+        metrics_tree.delete(*metrics_tree.get_children())
+        for name, stats in METRICS.summary().items():
+            metrics_tree.insert('', tk.END, values=(name, stats['count']) + tuple(
+                '%.2f' % stats[key] for key in ('mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'last_ms')))
+        if METRICS.profile_directory is not None:
+            profile_label.config(text="Profiling armed: waiting for the next action")
+        elif METRICS.last_profile:
+            profile_label.config(text="Last profile: %s" % METRICS.last_profile)
+        root.after(1000, refresh)
+
+    refresh()
+
+# Function to format a figure of the analytics panel
+def format_figure(value, digits=2):
+    return '' if value is None else '%.*f' % (digits, value)
+
+# Function to show or hide the analytics panel: price figures overall and per bhk and
+# bath, for every property (kept current by the store) or for the search results
+def toggle_analytics_panel():
+    global analytics_panel
+    if analytics_panel is not None:
+        analytics_panel.destroy()
+        analytics_panel = None
+        return
+    analytics_panel = panel = Toplevel(root)
+    panel.title("Analytics")
+    panel.protocol("WM_DELETE_WINDOW", toggle_analytics_panel)
+    scope = tk.StringVar(value='all')
+    frame = tk.Frame(panel)
+    frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+    tk.Radiobutton(frame, text="All properties", variable=scope, value='all').pack(side=tk.LEFT)
+    tk.Radiobutton(frame, text="Search results", variable=scope, value='search').pack(side=tk.LEFT)
+    columns = ('Group', 'Count', 'Mean Price', 'p10 Price', 'Median Price', 'p90 Price', 'Mean Sqft',
+               'Mean Price/Sqft', 'Median Price/Sqft')
+    stats_tree = ttk.Treeview(panel, columns=columns, show='headings', height=12, selectmode='browse')
+    for column in columns:
+        stats_tree.heading(column, text=column)
+        stats_tree.column(column, width=100 if column == 'Group' else 90, anchor=tk.W if column == 'Group' else tk.E)
+    stats_tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    Label(panel, text="Price distribution of the selected group", anchor=tk.W).pack(fill=tk.X, padx=10)
+    histogram_tree = ttk.Treeview(panel, columns=('Price', 'Count', 'Share'), show='headings', height=HISTOGRAM_BINS)
+    histogram_tree.heading('Price', text='Price')
+    histogram_tree.heading('Count', text='Count')
+    histogram_tree.heading('Share', text='Share')
+    histogram_tree.column('Price', width=160)
+    histogram_tree.column('Count', width=80, anchor=tk.E)
+    histogram_tree.column('Share', width=400)
+    histogram_tree.pack(fill=tk.BOTH, padx=10, pady=(0, 10))
+    groups = {}  # Item id -> GroupStats shown in that row
+    cache = {}  # The search results summarized last and their PortfolioStats
+
+    # Function to get the figures in scope; those of search results are computed once per result set
+    def current_stats():
+        if scope.get() == 'all' or showing_all or search_results is None:
+            return engine.statistics()
+        if cache.get('results') is not search_results:
+            cache['results'] = search_results
+            cache['stats'] = engine.summarize(search_results.rows)
+        return cache['stats']
+
+    def show_histogram(event=None):
+        histogram_tree.delete(*histogram_tree.get_children())
+        selection = stats_tree.selection()
+        group = groups.get(selection[0]) if selection else None
+        if group is None or not group.price.count:
+            return
+        low, high = group.price.quantile(0.0), group.price.quantile(0.99)
+        step = (high - low) / (HISTOGRAM_BINS - 1) or 1.0
+        edges = [low + i * step for i in range(HISTOGRAM_BINS)] + [float('inf')]
+        for start, end, count in group.price.histogram(edges):
+            label = "%.2f - %.2f" % (start, end) if end != float('inf') else "%.2f and above" % start
+            histogram_tree.insert('', tk.END, values=(label, count, '#' * round(50 * count / group.price.count)))
+
+    def refresh():
+        if not stats_tree.winfo_exists():
+            return
+        selection = stats_tree.selection()
+        selected = stats_tree.item(selection[0], 'values')[0] if selection else "All"
+        stats = current_stats()
+        summary = stats.summary()
+        stats_tree.delete(*stats_tree.get_children())
+        groups.clear()
+        rows = [("All", summary['all'], stats.all)]
+        for group, label in (('bhk', "BHK"), ('bath', "Bath")):
+            for key, figures in summary[group].items():
+                rows.append(("%s %s" % (label, '?' if key is None else format_figure(key, 0 if group == 'bhk' else 1)),
+                             figures, stats.groups[group][key]))
+        for name, figures, group in rows:
+            item = stats_tree.insert('', tk.END, values=(
+                name, figures['count'], format_figure(figures['mean_price']), format_figure(figures['p10_price']),
+                format_figure(figures['median_price']), format_figure(figures['p90_price']),
+                format_figure(figures['mean_sqft'], 0), format_figure(figures['mean_price_per_sqft'], 4),
+                format_figure(figures['median_price_per_sqft'], 4)))
+            groups[item] = group
+            if name == selected:
+                stats_tree.selection_set(item)
+        show_histogram()
+        root.after(1000, refresh)
+
+    stats_tree.bind('<<TreeviewSelect>>', show_histogram)
+    refresh()
 
 # Initialize main window
 root = tk.Tk()
 root.title("Real Estate Management System")
 
-# Load icons for buttons and resize them
-def load_icon(path, size=(16, 16)):
-    return ImageTk.PhotoImage(Image.open(path).resize(size, Image.LANCZOS))
-
-icon_add = load_icon("add_icon.png")
-icon_remove = load_icon("remove_icon.png")
-icon_update = load_icon("update_icon.png")
-icon_search = load_icon("search_icon.png")
-icon_reset = load_icon("reset_icon.png")
-icon_save = load_icon("save_icon.png")
+# Edit menu with undo/redo and named checkpoints
+menu_bar = tk.Menu(root)
+edit_menu = tk.Menu(menu_bar, tearoff=0, postcommand=update_edit_menu)
+edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=undo_change)
+edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=redo_change)
+edit_menu.add_separator()
+edit_menu.add_command(label="Create Checkpoint...", command=create_checkpoint)
+checkpoints_menu = tk.Menu(edit_menu, tearoff=0)
+edit_menu.add_cascade(label="Restore Checkpoint", menu=checkpoints_menu)
+menu_bar.add_cascade(label="Edit", menu=edit_menu)
+
+# Model menu: retraining the price model from the listings and its versions
+learning_var = tk.BooleanVar(value=engine.learning)
+version_var = tk.IntVar(value=-1)
+model_menu = tk.Menu(menu_bar, tearoff=0, postcommand=update_model_menu)
+model_menu.add_command(label="Retrain Now", command=retrain_model)
+model_menu.add_checkbutton(label="Learn From Edits", variable=learning_var, command=toggle_learning)
+model_menu.add_separator()
+versions_menu = tk.Menu(model_menu, tearoff=0)
+model_menu.add_cascade(label="Use Version", menu=versions_menu)
+menu_bar.add_cascade(label="Model", menu=model_menu)
+root.config(menu=menu_bar)
+root.bind('<Control-z>', undo_change)
+root.bind('<Control-y>', redo_change)
+root.bind('<Control-Z>', redo_change)
+
+# Load icons for buttons from the pre-resized icon cache
+icon_add = icons.load_icon("add_icon.png")
+icon_remove = icons.load_icon("remove_icon.png")
+icon_update = icons.load_icon("update_icon.png")
+icon_search = icons.load_icon("search_icon.png")
+icon_reset = icons.load_icon("reset_icon.png")
+icon_save = icons.load_icon("save_icon.png")
 
 # Create a frame to hold buttons and treeview
 frame_buttons = tk.Frame(root)
@@ -318,7 +919,7 @@ btn_remove.grid(row=0, column=1, padx=5)
 btn_update = tk.Button(frame_buttons, text="Update Property", image=icon_update, compound=tk.LEFT, command=update_property_gui)
 btn_update.grid(row=0, column=2, padx=5)
 
-btn_search = tk.Button(frame_buttons, text="Search Property", image=icon_search, compound=tk.LEFT, command=search_property_gui)
+btn_search = tk.Button(frame_buttons, text="Search Property", image=icon_search, compound=tk.LEFT, command=lambda: entry_filter_name.focus_set())
 btn_search.grid(row=0, column=3, padx=5)
 
 btn_reset = tk.Button(frame_buttons, text="Reset", image=icon_reset, compound=tk.LEFT, command=reset_properties)
@@ -327,18 +928,70 @@ btn_reset.grid(row=0, column=4, padx=5)
 btn_save = tk.Button(frame_buttons, text="Save to File", image=icon_save, compound=tk.LEFT, command=save_to_file)
 btn_save.grid(row=0, column=5, padx=5)
 
-# Create treeview with columns
-tree = ttk.Treeview(root, columns=('Name', 'Total Sqft', 'Bath', 'Price', 'BHK'), show='headings')
+btn_import = tk.Button(frame_buttons, text="Import", image=icon_add, compound=tk.LEFT, command=import_gui)
+btn_import.grid(row=0, column=6, padx=5)
+
+btn_export = tk.Button(frame_buttons, text="Export", image=icon_save, compound=tk.LEFT, command=export_gui)
+btn_export.grid(row=0, column=7, padx=5)
+
+btn_reprice_all = tk.Button(frame_buttons, text="Reprice All", image=icon_update, compound=tk.LEFT, command=reprice_all_gui, state=tk.DISABLED)
+btn_reprice_all.grid(row=0, column=8, padx=5)
+
+btn_reprice_selection = tk.Button(frame_buttons, text="Reprice Selection", image=icon_update, compound=tk.LEFT, command=reprice_selection_gui, state=tk.DISABLED)
+btn_reprice_selection.grid(row=0, column=9, padx=5)
+
+btn_analytics = tk.Button(frame_buttons, text="Analytics", image=icon_search, compound=tk.LEFT, command=toggle_analytics_panel)
+btn_analytics.grid(row=0, column=10, padx=5)
+
+# Filter bar: the table is searched as you type
+frame_filter = tk.Frame(root)
+frame_filter.pack(fill=tk.X, padx=10)
+filter_fields = {key: tk.StringVar() for key in ('name', 'name_match', 'min_price', 'max_price', 'bhk', 'bath', 'total_sqft')}
+filter_fields['name_match'].set('prefix')
+
+Label(frame_filter, text="Name:").pack(side=tk.LEFT)
+entry_filter_name = Entry(frame_filter, textvariable=filter_fields['name'], width=20)
+entry_filter_name.pack(side=tk.LEFT, padx=(0, 5))
+# Names starting with the text, the exact name, or the closest names ranked by similarity
+ttk.Combobox(frame_filter, textvariable=filter_fields['name_match'], values=('prefix', 'exact', 'fuzzy'),
+             state='readonly', width=7).pack(side=tk.LEFT, padx=(0, 10))
+for key, text, width in (('min_price', "Min Price:", 8), ('max_price', "Max Price:", 8), ('bhk', "BHK:", 4),
+                         ('bath', "Bath:", 4), ('total_sqft', "Total Sqft:", 8)):
+    Label(frame_filter, text=text).pack(side=tk.LEFT)
+    Entry(frame_filter, textvariable=filter_fields[key], width=width).pack(side=tk.LEFT, padx=(0, 10))
+Button(frame_filter, text="Clear", command=clear_filter).pack(side=tk.LEFT)
+for variable in filter_fields.values():
+    variable.trace_add('write', on_filter_changed)
+
+# Create treeview with columns; only the rows in view are materialized in the widget
+frame_table, tree, table = create_virtual_table(root, ('Name', 'Total Sqft', 'Bath', 'Price', 'BHK'), row_values)
 tree.heading('Name', text='Name', command=lambda: sort_table('name'))
 tree.heading('Total Sqft', text='Total Sqft', command=lambda: sort_table('total_sqft'))
 tree.heading('Bath', text='Bath', command=lambda: sort_table('bath'))
 tree.heading('Price', text='Price', command=lambda: sort_table('price'))
 tree.heading('BHK', text='BHK', command=lambda: sort_table('bhk'))
-tree.pack(padx=10, pady=10)
+frame_table.pack(padx=10, pady=10)
+
+# Status bar
+status_bar = tk.Label(root, anchor=tk.W)
+status_bar.pack(fill=tk.X, padx=10, pady=(0, 5))
 
-# Load initial data
+# F12 shows operation timings; PROPERTY_DEBUG=1 opens them at start-up
+root.bind('<F12>', toggle_debug_panel)
+if os.environ.get('PROPERTY_DEBUG') == '1':
+    root.after_idle(toggle_debug_panel)
+
+# Load initial data, filling the table as batches arrive
+store.subscribe(on_store_change)
 read_from_file()
-update_table()
 
-# Run the GUI loop
+# Show the window first, then load the prediction model in the background
+root.after_idle(report_first_paint)
+engine.load_model_async(on_model_loaded)
+root.after(50, check_model_loaded)
+root.after(MODEL_REFRESH_MS, refresh_model)
+root.after(250, check_unsaved_changes)
+
+# Run the GUI loop, then flush pending writes before exiting
 root.mainloop()
+engine.close()
@@ -0,0 +1,206 @@
+import time
+import zlib
+from pricing import FEATURES, LinearPriceModel
+
+# Online training of the price regression from the stored listings.
+#
+# price ~ intercept + total_sqft + bath + bhk is fitted by least squares from
+# the sufficient statistics XᵀX, Xᵀy and yᵀy. Adding or removing a listing
+# updates them in O(1), and a fit solves a 4x4 system whatever the number of
+# listings, so the model can follow every edit. Listings are split by a hash
+# of their name: HOLDOUT_PERCENT of them are never trained on and only score
+# a fit (R² and RMSE, from the same kind of sums). Listings missing the price
+# or a feature are left out.
+# A fit gives a pricing.LinearPriceModel, the same kind of model the app
+# loads from its model file.
+
+HOLDOUT_PERCENT = 20
+
+# Training listings needed before a fit is attempted
+MIN_TRAINING_ROWS = 10
+
+# Ridge term, relative to the scaled system's unit diagonal, keeping it solvable
+# when features are collinear (every listing with the same bath count, say)
+RIDGE = 1e-9
+
+# Fitted versions kept besides the best one on the holdout and the one in use
+KEPT_VERSIONS = 10
+
+
+# Function to tell whether a listing belongs to the holdout split
+def in_holdout(name):
+    return zlib.crc32(name.encode('utf-8')) % 100 < HOLDOUT_PERCENT
+
+
+# Function to get (x, y) of a listing, x starting with the intercept's 1, or None
+def training_row(prop):
+    values = [prop[feature] for feature in FEATURES]
+    price = prop['price']
+    if price is None or None in values:
+        return None
+    return [1.0] + [float(value) for value in values], float(price)
+
+
+# XᵀX, Xᵀy and yᵀy of one split
+class NormalEquations:
+    def __init__(self):
+        size = len(FEATURES) + 1
+        self.count = 0
+        self.xtx = [[0.0] * size for _ in range(size)]
+        self.xty = [0.0] * size
+        self.yty = 0.0
+
+    # Function to add a row, or take it out again with sign -1
+    def add(self, x, y, sign=1):
+        for i, xi in enumerate(x):
+            xi *= sign
+            self.xty[i] += xi * y
+            row = self.xtx[i]
+            for j, xj in enumerate(x):
+                row[j] += xi * xj
+        self.yty += sign * y * y
+        self.count += sign
+
+    # Function to add the rows of a numpy matrix (intercept column included) at once
+    def add_arrays(self, X, y):
+        xtx, xty = X.T @ X, X.T @ y
+        for i in range(len(self.xty)):
+            self.xty[i] += float(xty[i])
+            for j in range(len(self.xty)):
+                self.xtx[i][j] += float(xtx[i][j])
+        self.yty += float(y @ y)
+        self.count += len(y)
+
+    # Function to solve the normal equations, returning [intercept, coefficients...] or
+    # None without enough rows. The system is scaled to a unit diagonal first, since
+    # total_sqft is orders of magnitude above bath and bhk.
+    def solve(self):
+        if self.count < MIN_TRAINING_ROWS:
+            return None
+        size = len(self.xty)
+        scale = [self.xtx[i][i] ** -0.5 if self.xtx[i][i] > 0 else 1.0 for i in range(size)]
+        a = [[self.xtx[i][j] * scale[i] * scale[j] + (RIDGE if i == j else 0.0) for j in range(size)]
+             + [self.xty[i] * scale[i]] for i in range(size)]
+        for column in range(size):  # Gaussian elimination with partial pivoting
+            pivot = max(range(column, size), key=lambda row: abs(a[row][column]))
+            if a[pivot][column] == 0:
+                return None
+            a[column], a[pivot] = a[pivot], a[column]
+            for row in range(column + 1, size):
+                factor = a[row][column] / a[column][column]
+                for j in range(column, size + 1):
+                    a[row][j] -= factor * a[column][j]
+        solution = [0.0] * size
+        for row in reversed(range(size)):
+            solution[row] = (a[row][size] - sum(a[row][j] * solution[j] for j in range(row + 1, size))) / a[row][row]
+        return [value * factor for value, factor in zip(solution, scale)]
+
+    # Function to score [intercept, coefficients...] on these rows: (R², RMSE), or
+    # (None, None) without rows. The residual sum comes from the sums alone:
+    # yᵀy - 2βᵀXᵀy + βᵀXᵀXβ.
+    def score(self, beta):
+        if self.count <= 0:
+            return None, None
+        size = len(beta)
+        residual = (self.yty - 2 * sum(beta[i] * self.xty[i] for i in range(size))
+                    + sum(beta[i] * self.xtx[i][j] * beta[j] for i in range(size) for j in range(size)))
+        residual = max(residual, 0.0)
+        mean = self.xty[0] / self.count  # The intercept column sums y
+        total = self.yty - self.count * mean * mean
+        r2 = 1 - residual / total if total > 0 else None
+        return r2, (residual / self.count) ** 0.5
+
+
+# Running training data: the normal equations of the training and holdout splits.
+# A store keeps it current like analytics.PortfolioStats; changes counts the
+# updates, so a trainer can tell when a new fit is due.
+class RegressionStats:
+    def __init__(self):
+        self.train = NormalEquations()
+        self.holdout = NormalEquations()
+        self.changes = 0
+
+    def _split(self, name):
+        return self.holdout if in_holdout(name) else self.train
+
+    def add(self, prop):
+        row = training_row(prop)
+        if row is not None:
+            self._split(prop['name']).add(*row)
+            self.changes += 1
+
+    # Call it with the listing as it was added
+    def remove(self, prop):
+        row = training_row(prop)
+        if row is not None:
+            self._split(prop['name']).add(*row, sign=-1)
+            self.changes += 1
+
+    # Function to add the rows of analytics.column_arrays() output, names included
+    def build(self, arrays):
+        import numpy as np
+        X = np.column_stack([np.ones(len(arrays['price']))] + [arrays[feature] for feature in FEATURES])
+        y = arrays['price']
+        complete = ~np.isnan(X).any(axis=1) & ~np.isnan(y)
+        holdout = np.fromiter(map(in_holdout, arrays['name']), dtype=bool, count=len(y))
+        self.train.add_arrays(X[complete & ~holdout], y[complete & ~holdout])
+        self.holdout.add_arrays(X[complete & holdout], y[complete & holdout])
+        self.changes += int(complete.sum())
+        return self
+
+    # Function to score a model with intercept_ and coef_ on the holdout split
+    def evaluate(self, model):
+        return self.holdout.score([float(model.intercept_)] + [float(value) for value in model.coef_])
+
+
+# Versions of the price model: version 0 is the one loaded from disk, each
+# fit() adds the next. prune() keeps the list bounded. Only the trainer's
+# owner thread may call it.
+class ModelTrainer:
+    def __init__(self):
+        self.versions = []  # LinearPriceModels fitted and kept, oldest first
+        self.fitted = 0  # Number of the last version fitted
+        self.fitted_changes = None  # (RegressionStats, changes) the last fit was made from
+
+    # Function to tell whether stats changed since the last fit
+    def stale(self, stats):
+        return self.fitted_changes != (stats, stats.changes)
+
+    # Function to fit a new version from stats, or None without enough training rows
+    def fit(self, stats):
+        self.fitted_changes = (stats, stats.changes)
+        beta = stats.train.solve()
+        if beta is None:
+            return None
+        r2, rmse = stats.holdout.score(beta)
+        self.fitted += 1
+        model = LinearPriceModel(beta[0], beta[1:], version=self.fitted, trained_at=time.time(),
+                                 training_rows=stats.train.count, holdout_rows=stats.holdout.count,
+                                 r2=r2, rmse=rmse)
+        self.versions.append(model)
+        return model
+
+    # Function to tell whether model scores worse than current on the holdout (by
+    # RMSE); anything beats no model, and without holdout rows neither is worse
+    def worse(self, stats, model, current):
+        if current is None:
+            return False
+        rmse, current_rmse = stats.evaluate(model)[1], stats.evaluate(current)[1]
+        return rmse is not None and current_rmse is not None and rmse > current_rmse
+
+    # Function to drop all versions but the last KEPT_VERSIONS, the best one on
+    # the current holdout and the one in use
+    def prune(self, stats, in_use):
+        if len(self.versions) <= KEPT_VERSIONS:
+            return
+        kept = self.versions[-KEPT_VERSIONS:] + [in_use]
+        scored = [(stats.evaluate(model)[1], model.version) for model in self.versions]
+        if all(rmse is not None for rmse, number in scored):
+            kept.append(self.version(min(scored)[1]))
+        self.versions = [model for model in self.versions if any(model is other for other in kept)]
+
+    def version(self, number):
+        for model in self.versions:
+            if model.version == number:
+                return model
+        raise ValueError('no model version %s' % number)
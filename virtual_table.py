@@ -0,0 +1,132 @@
+import tkinter as tk
+from tkinter import ttk
+
+# Virtual-scrolling wrapper around a ttk.Treeview.
+#
+# Only a window of rows (the visible rows plus a buffer on either side) is
+# inserted into the widget. The scrollbar is driven by the position in the
+# full row sequence, and the window is re-filled from that sequence whenever
+# the view gets close to one of its edges, so redraw cost does not depend on
+# how many rows there are. The row sequence only needs len() and slicing.
+
+
+class VirtualTable:
+    def __init__(self, tree, scrollbar, values, buffer=50):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.values = values  # Function mapping a property to the tuple shown in the row
+        self.buffer = buffer
+        self.rows = []
+        self.items = []  # Item ids currently in the widget, reused across re-fills
+        self.start = 0  # Position in rows of the first item in the widget
+        self.offset = 0  # Position in rows of the first visible row
+        self.scrollbar.configure(command=self._on_scrollbar)
+        self.tree.configure(yscrollcommand=self._on_tree_scroll)
+
+    def visible(self):
+        return max(1, int(self.tree.cget('height')))
+
+    # Function to show a new row sequence, keeping the scroll position where possible
+    def set_rows(self, rows, offset=None):
+        self.rows = rows
+        self.show(self.offset if offset is None else offset, refill=True)
+
+    # Function to re-read the current window from the row sequence
+    def refresh(self):
+        self.show(self.offset, refill=True)
+
+    # Functions applying a single-row change at a position in the row sequence.
+    # They touch at most two items in the widget, whatever the window size.
+    def row_inserted(self, position):
+        end = self.start + len(self.items)
+        if position < self.start:
+            self.start += 1
+            self.offset += 1  # Keep the same rows in view
+        elif position < end or end == len(self.rows) - 1:
+            i = position - self.start
+            self.items.insert(i, self.tree.insert('', i, values=self.values(self.rows[position])))
+            if len(self.items) > self.visible() + 2 * self.buffer:
+                self.tree.delete(self.items.pop())
+        self.show(self.offset)
+
+    def row_deleted(self, position):
+        end = self.start + len(self.items)
+        if position < self.start:
+            self.start -= 1
+            self.offset = max(0, self.offset - 1)
+        elif position < end:
+            self.tree.delete(self.items.pop(position - self.start))
+            end -= 1
+            if end < len(self.rows):  # Pull the next row in to keep the window full
+                self.items.append(self.tree.insert('', 'end', values=self.values(self.rows[end])))
+        self.show(self.offset)
+
+    def row_updated(self, position):
+        if self.start <= position < self.start + len(self.items):
+            self.tree.item(self.items[position - self.start], values=self.values(self.rows[position]))
+
+    # Function to get the rows behind the selected items
+    def selected_rows(self):
+        return [self.rows[self.start + self.items.index(item)] for item in self.tree.selection()
+                if item in self.items]
+
+    # Function to scroll so that the given row is the first visible one
+    def show(self, offset, refill=False):
+        total = len(self.rows)
+        visible = self.visible()
+        offset = max(0, min(offset, total - visible))
+        end = self.start + len(self.items)
+        margin = self.buffer // 2
+        if (refill or offset < self.start or offset + visible > end or
+                (offset - self.start < margin and self.start > 0) or
+                (end - offset - visible < margin and end < total)):
+            start = max(0, offset - self.buffer)
+            self._fill(start, min(total, offset + visible + self.buffer))
+        self.offset = offset
+        if self.items:
+            self.tree.yview_moveto((offset - self.start) / len(self.items))
+        if total:
+            self.scrollbar.set(offset / total, min(1.0, (offset + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    # Function to replace the items in the widget with rows[start:end]
+    def _fill(self, start, end):
+        key = self.tree['columns'][0]
+        selected = {self.tree.set(item, key) for item in self.tree.selection()}
+        window = self.rows[start:end] if end > start else []
+        for i, prop in enumerate(window):
+            if i < len(self.items):
+                self.tree.item(self.items[i], values=self.values(prop))
+            else:
+                self.items.append(self.tree.insert('', 'end', values=self.values(prop)))
+        if len(self.items) > len(window):
+            self.tree.delete(*self.items[len(window):])
+            del self.items[len(window):]
+        self.start = start
+        self.tree.selection_set([item for item, prop in zip(self.items, window) if str(prop['name']) in selected])
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.show(int(float(amount) * len(self.rows)))
+        elif unit == 'pages':
+            self.show(self.offset + int(amount) * self.visible())
+        else:
+            self.show(self.offset + int(amount))
+
+    # Native scrolling inside the window (wheel, keyboard, see()) lands here
+    def _on_tree_scroll(self, first, last):
+        if self.items:
+            offset = self.start + round(float(first) * len(self.items))
+            if offset != self.offset:
+                self.show(offset)
+
+
+# Function to create a Treeview plus scrollbar in a frame, wrapped in a VirtualTable
+def create_virtual_table(parent, columns, values, height=10, buffer=50):
+    frame = tk.Frame(parent)
+    tree = ttk.Treeview(frame, columns=columns, show='headings', height=height)
+    scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL)
+    tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+    return frame, tree, VirtualTable(tree, scrollbar, values, buffer=buffer)